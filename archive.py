@@ -0,0 +1,41 @@
+"""
+Moves completed reports older than ARCHIVE_AFTER_DAYS from reports to
+reports_archive, keeping the hot table (pending queue, reminders, list
+indexes) small. Archived reports are still found by id, in user and worker
+lists, search and exports through the reports_all view.
+
+Each run moves ARCHIVE_BATCH_SIZE reports per short transaction and pauses
+ARCHIVE_BATCH_PAUSE seconds between batches, so live updates aren't blocked.
+"""
+import asyncio
+import logging
+from config import ARCHIVE_AFTER_DAYS, ARCHIVE_INTERVAL, ARCHIVE_BATCH_SIZE, ARCHIVE_BATCH_PAUSE
+from db.queries import archive_completed_reports
+from metrics import REPORTS_ARCHIVED
+
+async def archive_once() -> int:
+    """Archive everything that is due, batch by batch. Returns the number of moved reports"""
+    total = 0
+    while True:
+        moved = await archive_completed_reports(ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE)
+        REPORTS_ARCHIVED.inc(moved)
+        total += moved
+        if moved < ARCHIVE_BATCH_SIZE:
+            return total
+        await asyncio.sleep(ARCHIVE_BATCH_PAUSE)
+
+async def _archive_loop():
+    while True:
+        try:
+            moved = await archive_once()
+            if moved:
+                logging.info(f"Archived {moved} completed reports")
+        except Exception:
+            logging.exception("Report archiving failed")
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+
+def start_archiver():
+    """Start the periodic archive job, None if ARCHIVE_AFTER_DAYS is 0"""
+    if ARCHIVE_AFTER_DAYS <= 0:
+        return None
+    return asyncio.create_task(_archive_loop())
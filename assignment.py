@@ -0,0 +1,221 @@
+"""
+Workload-aware assignment of new reports to staff.
+
+Staff are listed in ASSIGNMENT_STAFF_FILE:
+
+    [
+        {"id": 111, "name": "Анна", "skills": ["Помещение/оборудование"],
+         "hours": "09:00-18:00", "days": [1, 2, 3, 4, 5]},
+        {"id": 222, "name": "Борис", "skills": ["*"]}
+    ]
+
+skills are report types ("*" for all), days are ISO weekdays (1 = Monday),
+hours may wrap past midnight ("22:00-06:00"); without them a member is
+always on shift.
+
+A new report goes to the on-shift member with the report type's skill and
+the fewest open reports (in progress plus routed to them and not taken yet),
+the one who got a report least recently on a tie. They get a direct message
+with the take button, and the admin group notification is queued in the
+outbox ASSIGNMENT_SLA seconds later; it is skipped if the report is taken
+by then. With nobody available the group is notified at once.
+
+Loads live in one heap per report type, updated as reports are routed,
+taken and completed in this process, and re-read from the database every
+ASSIGNMENT_REFRESH_INTERVAL seconds (other processes' changes).
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import time
+from collections import deque
+from datetime import datetime, time as dt_time, timedelta
+from typing import Optional
+from config import ASSIGNMENT_STAFF_FILE, ASSIGNMENT_SLA, ASSIGNMENT_MAX_OPEN, ASSIGNMENT_REFRESH_INTERVAL
+from db.queries import add_report_listener, get_assignment_load
+from metrics import ASSIGNMENTS, ASSIGNMENT_LOAD
+from outbox import ACCEPTED, NEW_REPORT, ASSIGNED
+
+ANY_SKILL = "*"
+
+class Worker:
+    __slots__ = ('id', 'name', 'skills', 'start', 'end', 'days', 'load', 'turn')
+
+    def __init__(self, entry: dict):
+        self.id = int(entry['id'])
+        self.name = entry.get('name') or str(self.id)
+        self.skills = frozenset(entry.get('skills') or (ANY_SKILL,))
+        self.start = self.end = None
+        if entry.get('hours'):
+            start, _, end = entry['hours'].partition("-")
+            self.start, self.end = dt_time.fromisoformat(start.strip()), dt_time.fromisoformat(end.strip())
+        self.days = frozenset(entry.get('days') or range(1, 8))
+        # Open reports, and the order in which workers last got one (ties go to the earliest)
+        self.load = 0
+        self.turn = 0
+
+    def can_take(self, report_type: str) -> bool:
+        return report_type in self.skills or ANY_SKILL in self.skills
+
+    def on_shift(self, now: datetime) -> bool:
+        if self.start is None:
+            return now.isoweekday() in self.days
+        moment = now.time()
+        if self.start <= self.end:
+            return now.isoweekday() in self.days and self.start <= moment < self.end
+        # Overnight shift: the part after midnight belongs to the previous day's shift
+        if moment >= self.start:
+            return now.isoweekday() in self.days
+        return moment < self.end and (now - timedelta(days=1)).isoweekday() in self.days
+
+# worker_id -> Worker
+_staff = {}
+# report_type -> min-heap of (load, turn, worker_id). Entries that no longer
+# match the worker's load and turn are stale and skipped when popped.
+_queues = {}
+_turns = itertools.count(1)
+# report_id -> worker_id of reports routed and not taken yet, and
+# (expires_at, report_id) in routing order to release them after the SLA.
+# expires_at is time.monotonic(); report ages come from the database clock.
+_reserved = {}
+_expiring = deque()
+
+def load_staff(path: str) -> dict:
+    """Read the staff file: worker_id -> Worker"""
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    staff = {}
+    for entry in entries:
+        worker = Worker(entry)
+        staff[worker.id] = worker
+    return staff
+
+def _queue(report_type: str) -> list:
+    queue = _queues.get(report_type)
+    if queue is None:
+        queue = _queues[report_type] = [
+            (worker.load, worker.turn, worker.id) for worker in _staff.values() if worker.can_take(report_type)
+        ]
+        heapq.heapify(queue)
+    return queue
+
+def _update(worker: Worker, load: int, turn: int = None):
+    """Change a worker's load (and turn) and requeue them"""
+    worker.load = max(0, load)
+    if turn is not None:
+        worker.turn = turn
+    for report_type, queue in list(_queues.items()):
+        if not worker.can_take(report_type):
+            continue
+        heapq.heappush(queue, (worker.load, worker.turn, worker.id))
+        # Mostly stale entries: rebuilt on next use
+        if len(queue) > 4 * len(_staff) + 16:
+            del _queues[report_type]
+
+def _expire():
+    """Release reservations of reports not taken within the SLA (they went to the group)"""
+    now = time.monotonic()
+    while _expiring and _expiring[0][0] <= now:
+        _, report_id = _expiring.popleft()
+        worker_id = _reserved.pop(report_id, None)
+        if worker_id in _staff:
+            _update(_staff[worker_id], _staff[worker_id].load - 1)
+
+def pick_worker(report_type: str, now: datetime = None) -> Optional[Worker]:
+    """On-shift worker with the skill and the lowest load, counted as loaded by one more report"""
+    if not _staff:
+        return None
+    now = now or datetime.now()
+    _expire()
+    queue = _queue(report_type)
+    chosen, kept = None, []
+    while queue:
+        entry = heapq.heappop(queue)
+        load, turn, worker_id = entry
+        worker = _staff[worker_id]
+        if (load, turn) != (worker.load, worker.turn):
+            continue
+        kept.append(entry)
+        if ASSIGNMENT_MAX_OPEN and load >= ASSIGNMENT_MAX_OPEN:
+            # Everyone further down has at least as many
+            break
+        if worker.on_shift(now):
+            chosen = worker
+            break
+    for entry in kept:
+        heapq.heappush(queue, entry)
+    if chosen is not None:
+        _update(chosen, chosen.load + 1, next(_turns))
+    return chosen
+
+def route_report(report_type: str, username: str) -> tuple:
+    """(assigned_user_id or None, outbox notifications) for a new report"""
+    worker = pick_worker(report_type)
+    if worker is None:
+        ASSIGNMENTS.inc(result="group" if _staff else "disabled")
+        return None, {ACCEPTED: {}, NEW_REPORT: {'username': username}}
+    ASSIGNMENTS.inc(result="assigned")
+    return worker.id, {
+        ACCEPTED: {},
+        ASSIGNED: {'username': username, 'sla': ASSIGNMENT_SLA},
+        # Sent to the group only if still pending then
+        NEW_REPORT: {'username': username, 'assignee': worker.name, 'delay': ASSIGNMENT_SLA},
+    }
+
+def _reserve(report_id: int, worker_id: int, age: float):
+    """Hold a report routed age seconds ago against the worker until the SLA runs out"""
+    _reserved[report_id] = worker_id
+    _expiring.append((time.monotonic() + ASSIGNMENT_SLA - age, report_id))
+
+def on_report_event(event: str, report: dict):
+    """Keep loads in sync with reports routed, taken and completed in this process"""
+    if event == 'created':
+        # The load was counted when the worker was picked (just now)
+        if report.get('assigned_user_id') in _staff:
+            _reserve(report['id'], report['assigned_user_id'], 0.0)
+        return
+    worker_id = _reserved.pop(report['id'], None)
+    if worker_id in _staff:
+        _update(_staff[worker_id], _staff[worker_id].load - 1)
+    worker = _staff.get(report.get('responsible_user_id'))
+    if worker is None:
+        return
+    if event == 'taken':
+        _update(worker, worker.load + 1)
+    elif event == 'completed' or (event == 'deleted' and report['status'] == 'in_progress'):
+        _update(worker, worker.load - 1)
+
+async def refresh_loads():
+    """Re-read open report counts of all workers from the database"""
+    in_progress, reserved = await get_assignment_load(list(_staff), ASSIGNMENT_SLA)
+    _reserved.clear()
+    _expiring.clear()
+    loads = dict.fromkeys(_staff, 0)
+    for worker_id, count in in_progress.items():
+        loads[worker_id] += count
+    for report in reserved:
+        loads[report['assigned_user_id']] += 1
+        _reserve(report['id'], report['assigned_user_id'], report['age'])
+    for worker_id, load in loads.items():
+        _staff[worker_id].load = load
+    _queues.clear()
+
+async def _refresh_loop():
+    while True:
+        try:
+            await refresh_loads()
+        except Exception:
+            logging.exception("Failed to refresh assignment loads")
+        await asyncio.sleep(ASSIGNMENT_REFRESH_INTERVAL)
+
+def start_assignment() -> Optional[asyncio.Task]:
+    """Load the staff file and keep loads up to date, None if assignment is off"""
+    if not ASSIGNMENT_STAFF_FILE:
+        return None
+    _staff.update(load_staff(ASSIGNMENT_STAFF_FILE))
+    add_report_listener(on_report_event)
+    ASSIGNMENT_LOAD.set_function(lambda: sum(worker.load for worker in _staff.values()))
+    logging.info(f"Assignment: {len(_staff)} staff members, SLA {ASSIGNMENT_SLA:g}s")
+    return asyncio.create_task(_refresh_loop())
@@ -0,0 +1,243 @@
+"""
+Photos, documents and voice notes sent with reports.
+
+A report keeps the Telegram file_id of each file (db/queries.py stores a
+file once per file_unique_id and links it to reports). The admin group and
+the assignee get them as media groups replying to the report's message:
+photos together, documents together (Telegram doesn't mix the two), up to
+10 per group, voice notes one by one.
+
+Telegram doesn't keep files forever. With ATTACHMENT_ARCHIVE_DIR set, a
+background downloader copies every new file there: at most
+ATTACHMENT_DOWNLOAD_CONCURRENCY downloads at a time, each streamed to disk
+in chunks, so memory use doesn't depend on file size. A file that fails is
+retried with backoff up to ATTACHMENT_DOWNLOAD_ATTEMPTS times.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import Optional
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import SendDocument, SendMediaGroup, SendPhoto, SendVoice
+from aiogram.types import InputMediaDocument, InputMediaPhoto, Message, ReplyParameters
+from config import ATTACHMENT_ARCHIVE_DIR, ATTACHMENT_DOWNLOAD_CONCURRENCY, ATTACHMENT_DOWNLOAD_ATTEMPTS
+from db.queries import (
+    add_report_listener, claim_attachment_downloads, mark_attachment_archived, retry_attachment_download,
+)
+from metrics import ATTACHMENTS_ARCHIVED, ATTACHMENT_DOWNLOAD_FAILURES, ATTACHMENT_DOWNLOAD_SECONDS
+from sender import send
+import render
+
+# Items per media group (Bot API limit)
+MEDIA_GROUP_SIZE = 10
+
+# Seconds a claimed download may take before another process claims it again
+DOWNLOAD_LEASE = 600
+DOWNLOAD_TIMEOUT = 300
+CHUNK_SIZE = 1 << 16
+# Seconds between looks for new files when nothing wakes the downloader
+DOWNLOAD_POLL_INTERVAL = 60
+
+# Set when a report with attachments is created
+_wakeup = asyncio.Event()
+
+_DEFAULT_EXTENSIONS = {'photo': '.jpg', 'document': '', 'voice': '.ogg'}
+_EXTENSION = re.compile(r"^\.[A-Za-z0-9]{1,10}$")
+
+def extract(message: Message) -> Optional[dict]:
+    """Attachment of a message as stored by save_report, None if it has none we accept"""
+    if message.photo:
+        # Sizes come smallest first
+        photo = message.photo[-1]
+        return {
+            'file_unique_id': photo.file_unique_id, 'file_id': photo.file_id, 'kind': 'photo',
+            'file_name': None, 'mime_type': 'image/jpeg', 'file_size': photo.file_size,
+        }
+    if message.document:
+        document = message.document
+        return {
+            'file_unique_id': document.file_unique_id, 'file_id': document.file_id, 'kind': 'document',
+            'file_name': document.file_name, 'mime_type': document.mime_type, 'file_size': document.file_size,
+        }
+    if message.voice:
+        voice = message.voice
+        return {
+            'file_unique_id': voice.file_unique_id, 'file_id': voice.file_id, 'kind': 'voice',
+            'file_name': None, 'mime_type': voice.mime_type, 'file_size': voice.file_size,
+        }
+    return None
+
+def collect(messages: list) -> list:
+    """Attachments of the messages in order, each file once"""
+    attachments = {}
+    for message in messages:
+        attachment = extract(message)
+        if attachment is not None:
+            attachments.setdefault(attachment['file_unique_id'], attachment)
+    return list(attachments.values())
+
+def message_text(messages: list) -> str:
+    """Text of a report sent as one message or an album (the caption is on one of its parts)"""
+    for message in messages:
+        text = message.text or message.caption
+        if text:
+            return text
+    return ""
+
+def _methods(chat_id, report_id: int, attachments: list, reply_to: Optional[int]) -> list:
+    """Bot API calls that send the attachments, the first one captioned with the report"""
+    reply = ReplyParameters(message_id=reply_to, allow_sending_without_reply=True) if reply_to else None
+    caption = render.attachments_caption(report_id, len(attachments))
+    methods = []
+    for kind, single, media_type in (
+        ('photo', SendPhoto, InputMediaPhoto),
+        ('document', SendDocument, InputMediaDocument),
+    ):
+        files = [a['file_id'] for a in attachments if a['kind'] == kind]
+        for start in range(0, len(files), MEDIA_GROUP_SIZE):
+            chunk = files[start:start + MEDIA_GROUP_SIZE]
+            text = caption if not methods else None
+            if len(chunk) == 1:
+                methods.append(single(chat_id=chat_id, **{kind: chunk[0]}, caption=text, reply_parameters=reply))
+            else:
+                media = [media_type(media=chunk[0], caption=text)] + [media_type(media=f) for f in chunk[1:]]
+                methods.append(SendMediaGroup(chat_id=chat_id, media=media, reply_parameters=reply))
+    for attachment in attachments:
+        if attachment['kind'] == 'voice':
+            text = caption if not methods else None
+            methods.append(SendVoice(chat_id=chat_id, voice=attachment['file_id'], caption=text, reply_parameters=reply))
+    return methods
+
+def send_attachments(chat_id, report_id: int, attachments: list, priority: int, reply_to: int = None) -> asyncio.Future:
+    """Queue the report's attachments; the future is done when all are sent
+
+    Each call is queued after the previous one is sent so they arrive in
+    order, the captioned one first.
+    """
+    methods = _methods(chat_id, report_id, attachments, reply_to)
+    result = asyncio.get_running_loop().create_future()
+
+    def send_next(index: int):
+        future = send(methods[index], priority)
+        future.add_done_callback(lambda f: on_sent(f, index))
+
+    def on_sent(future: asyncio.Future, index: int):
+        if future.cancelled():
+            result.cancel()
+        elif future.exception() is not None:
+            result.set_exception(future.exception())
+        elif index == len(methods) - 1:
+            result.set_result(None)
+        else:
+            send_next(index + 1)
+
+    # Failures are logged by the sender, only mark the exception as retrieved
+    result.add_done_callback(lambda f: f.cancelled() or f.exception())
+    if methods:
+        send_next(0)
+    else:
+        result.set_result(None)
+    return result
+
+def send_with_attachments(message_future: asyncio.Future, chat_id, report: dict, priority: int) -> asyncio.Future:
+    """Send the report's attachments as a reply to its message once that is sent
+
+    The returned future is done when the message and the attachments are sent.
+    """
+    if not report.get('attachments'):
+        return message_future
+    result = asyncio.get_running_loop().create_future()
+
+    def on_message(future: asyncio.Future):
+        if future.cancelled():
+            result.cancel()
+        elif future.exception() is not None:
+            result.set_exception(future.exception())
+        else:
+            message = future.result()
+            reply_to = message.message_id if isinstance(message, Message) else None
+            sent = send_attachments(chat_id, report['id'], report['attachments'], priority, reply_to)
+            sent.add_done_callback(lambda f: on_sent(f, message))
+
+    def on_sent(future: asyncio.Future, message):
+        if future.cancelled():
+            result.cancel()
+        elif future.exception() is not None:
+            result.set_exception(future.exception())
+        else:
+            result.set_result(message)
+
+    message_future.add_done_callback(on_message)
+    # Failures are logged by the sender, only mark the exception as retrieved
+    result.add_done_callback(lambda f: f.cancelled() or f.exception())
+    return result
+
+def archive_path(attachment: dict) -> str:
+    """Where the downloader keeps a file: <dir>/<2 chars of file_unique_id>/<file_unique_id><ext>"""
+    extension = os.path.splitext(attachment.get('file_name') or "")[1]
+    if not _EXTENSION.match(extension):
+        extension = _DEFAULT_EXTENSIONS[attachment['kind']]
+    unique_id = attachment['file_unique_id']
+    return os.path.join(ATTACHMENT_ARCHIVE_DIR, unique_id[:2], unique_id + extension.lower())
+
+def _retry_delay(attempts: int) -> float:
+    return min(6 * 3600.0, 60.0 * 4 ** (attempts - 1))
+
+async def download(bot: Bot, attachment: dict):
+    """Stream one file to its archive path and record it"""
+    path = archive_path(attachment)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = path + ".part"
+    start = time.perf_counter()
+    try:
+        # Written chunk by chunk, renamed only when complete
+        await bot.download(attachment['file_id'], destination=partial, timeout=DOWNLOAD_TIMEOUT, chunk_size=CHUNK_SIZE)
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    ATTACHMENT_DOWNLOAD_SECONDS.observe(time.perf_counter() - start)
+    await mark_attachment_archived(attachment['id'], path)
+    ATTACHMENTS_ARCHIVED.inc(kind=attachment['kind'])
+
+async def _download_one(bot: Bot, attachment: dict, semaphore: asyncio.Semaphore):
+    async with semaphore:
+        try:
+            await download(bot, attachment)
+        except Exception as e:
+            ATTACHMENT_DOWNLOAD_FAILURES.inc(kind=attachment['kind'])
+            # "file is too big" and the like won't change on retry
+            give_up = isinstance(e, TelegramBadRequest) or attachment['archive_attempts'] >= ATTACHMENT_DOWNLOAD_ATTEMPTS
+            logging.warning(f"Attachment {attachment['id']} download failed{' for good' if give_up else ''}: {e!r}")
+            await retry_attachment_download(
+                attachment['id'], repr(e), None if give_up else _retry_delay(attachment['archive_attempts'])
+            )
+
+async def _downloader_loop(bot: Bot):
+    semaphore = asyncio.Semaphore(ATTACHMENT_DOWNLOAD_CONCURRENCY)
+    batch_size = ATTACHMENT_DOWNLOAD_CONCURRENCY * 4
+    while True:
+        _wakeup.clear()
+        attachments = []
+        try:
+            attachments = await claim_attachment_downloads(batch_size, DOWNLOAD_LEASE, ATTACHMENT_DOWNLOAD_ATTEMPTS)
+            await asyncio.gather(*(_download_one(bot, a, semaphore) for a in attachments))
+        except Exception:
+            logging.exception("Attachment archive failed")
+        if len(attachments) == batch_size:
+            continue
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=DOWNLOAD_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+def start_attachment_archive(bot: Bot) -> Optional[asyncio.Task]:
+    """Start the downloader, None if ATTACHMENT_ARCHIVE_DIR is not set"""
+    if not ATTACHMENT_ARCHIVE_DIR:
+        return None
+    add_report_listener(lambda event, report: event == 'created' and report['attachment_count'] and _wakeup.set())
+    return asyncio.create_task(_downloader_loop(bot))
@@ -0,0 +1,128 @@
+"""
+Broadcast benchmark: /broadcast to many report authors through the fake Bot API.
+
+Creates a scratch database <DB_NAME>_broadcast with one report from each of
+--users users, starts the bot against the fake Telegram server (its 30
+messages/s limit answers 429 like Telegram's) and sends a broadcast from
+the admin group. --blocked of the users answer 403. With --crash-after N
+the bot is killed after N deliveries and started again: the broadcast
+resumes from its checkpoint once BROADCAST_LEASE (--lease) runs out.
+
+Prints messages/s, 429s, users who got the message twice or not at all,
+and how many unreachable users ended up in blocked_users.
+
+    python -m benchmarks.broadcast --users 3000 --blocked 0.05 --crash-after 1000
+"""
+import argparse
+import asyncio
+import time
+from collections import Counter
+
+import asyncpg
+
+from config import DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME
+from benchmarks.fake_telegram import FakeTelegram
+from benchmarks.load import (
+    create_database, drop_database, start_bot, stop_bot, free_port, ADMIN_GROUP_ID, USER_ID_BASE, ADMIN_ID_BASE,
+)
+
+TEXT = "Уважаемые родители! Завтра занятия начинаются на час позже."
+
+async def connect(database: str):
+    return await asyncpg.connect(host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASSWORD, database=database)
+
+async def fill(database: str, users: int):
+    """One report per user, once the bot has applied the migrations"""
+    conn = await connect(database)
+    try:
+        while not await conn.fetchval("SELECT to_regclass('blocked_users') IS NOT NULL"):
+            await asyncio.sleep(0.2)
+        await conn.execute('''
+            INSERT INTO reports (user_id, user_name, report_type, report_text)
+            SELECT $1::bigint + g, 'Родитель ' || g, 'Обратная связь', 'Обращение ' || g
+            FROM generate_series(0, $2 - 1) g
+        ''', USER_ID_BASE, users)
+    finally:
+        await conn.close()
+
+async def blocked_rows(database: str) -> int:
+    conn = await connect(database)
+    try:
+        return await conn.fetchval('SELECT count(*) FROM blocked_users')
+    finally:
+        await conn.close()
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=3000)
+    parser.add_argument("--blocked", type=float, default=0.05, help="share of users who blocked the bot")
+    parser.add_argument("--latency", type=float, default=40, help="fake API latency, ms")
+    parser.add_argument("--crash-after", type=int, default=0, help="kill the bot after this many deliveries")
+    parser.add_argument("--lease", type=float, default=10, help="BROADCAST_LEASE for the bot, seconds")
+    parser.add_argument("--log", default="broadcast_bot.log")
+    parser.add_argument("--keep-db", action="store_true")
+    args = parser.parse_args()
+
+    database = f"{DB_NAME}_broadcast"
+    api = FakeTelegram(latency_ms=args.latency)
+    step = round(1 / args.blocked) if args.blocked else 0
+    api.blocked = {str(USER_ID_BASE + i) for i in range(0, args.users, step)} if step else set()
+    delivered = Counter()
+    api.observers.append(
+        lambda method, params, result: method == "sendMessage" and str(params["chat_id"]) != str(ADMIN_GROUP_ID)
+        and delivered.update((params["chat_id"],))
+    )
+    runner = await api.start()
+    await create_database(database)
+    env = {"BROADCAST_LEASE": str(args.lease), "DIGEST_MODE": "off"}
+    bot = await start_bot(api, database, free_port(), args.log, **env)
+    group = {"id": ADMIN_GROUP_ID, "type": "supergroup", "title": "Админы"}
+    admin = {"id": ADMIN_ID_BASE, "is_bot": False, "first_name": "Админ"}
+    try:
+        await fill(database, args.users)
+
+        asked = api.expect(ADMIN_GROUP_ID, lambda method, params: "Отправьте текст" in params.get("text", ""))
+        api.push_message(admin, group, "/broadcast")
+        await asyncio.wait_for(asked, 60)
+        preview = api.expect(ADMIN_GROUP_ID, lambda method, params: TEXT in params.get("text", ""))
+        api.push_message(admin, group, TEXT)
+        _, _, message = await asyncio.wait_for(preview, 60)
+        finished = api.expect(ADMIN_GROUP_ID, lambda method, params: "завершена" in params.get("text", ""))
+        start = time.perf_counter()
+        api.push_callback(admin, message, "bc_confirm")
+
+        crashed_at = None
+        if args.crash_after:
+            while sum(delivered.values()) < args.crash_after:
+                await asyncio.sleep(0.05)
+            bot.kill()
+            await bot.wait()
+            crashed_at = time.perf_counter() - start
+            api.calls["getUpdates"] = 0
+            bot = await start_bot(api, database, free_port(), args.log + ".restart", **env)
+        _, params, _ = await asyncio.wait_for(finished, 3600)
+        elapsed = time.perf_counter() - start
+    finally:
+        await stop_bot(bot)
+        await runner.cleanup()
+    try:
+        unreachable = await blocked_rows(database)
+    finally:
+        if not args.keep_db:
+            await drop_database(database)
+
+    reachable = args.users - len(api.blocked)
+    got = sum(1 for chat_id, count in delivered.items() if str(chat_id) not in api.blocked)
+    twice = sum(1 for count in delivered.values() if count > 1)
+    sent = sum(count for chat_id, count in delivered.items() if str(chat_id) not in api.blocked)
+    print(params["text"])
+    print()
+    print(f"users: {args.users}, reachable: {reachable}, blocked the bot: {len(api.blocked)}")
+    if crashed_at is not None:
+        print(f"bot killed after {crashed_at:.1f}s, lease {args.lease:g}s")
+    print(f"{elapsed:.1f}s, {sent / elapsed:.1f} messages/s delivered, 429s: {api.throttled['sendMessage']}")
+    print(f"reached: {got}, missed: {reachable - got}, got it twice: {twice}")
+    print(f"blocked_users rows: {unreachable}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
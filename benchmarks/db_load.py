@@ -0,0 +1,79 @@
+"""
+Load benchmark for the database layer.
+
+Simulates N users submitting a report at the same moment and measures
+handler latency (save_report + get_user_reports) for:
+  - pool:   the asyncpg pool from db/queries.py
+  - legacy: one psycopg2.connect() per call, run inline on the event loop
+
+Run against a scratch database (rows are cleaned up afterwards):
+    python -m benchmarks.db_load --users 500
+"""
+import argparse
+import asyncio
+import time
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from config import DATABASE_URL
+from db import queries
+from db.migrate import ensure_schema
+from benchmarks.stats import print_latencies
+
+# User IDs far outside the Telegram range, so cleanup can't touch real data
+BENCH_USER_BASE = 10 ** 15
+
+def legacy_save_report(user_id, user_name, report_type, report_text):
+    with psycopg2.connect(DATABASE_URL) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute('''
+                INSERT INTO reports (user_id, user_name, report_type, report_text)
+                VALUES (%s, %s, %s, %s)
+                RETURNING id
+            ''', (user_id, user_name, report_type, report_text))
+            report_id = cursor.fetchone()[0]
+            conn.commit()
+            return report_id
+
+def legacy_get_user_reports(user_id):
+    with psycopg2.connect(DATABASE_URL) as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute('SELECT * FROM reports WHERE user_id = %s ORDER BY created_at DESC', (user_id,))
+            return cursor.fetchall()
+
+async def legacy_handler(user_id):
+    legacy_save_report(user_id, "bench", "Персонал", "load test")
+    legacy_get_user_reports(user_id)
+
+async def pool_handler(user_id):
+    await queries.save_report(user_id, "bench", "Персонал", "load test")
+    await queries.get_user_reports(user_id)
+
+async def run(handler, users: int) -> list:
+    """Start all handlers at once, return per-handler latency in ms"""
+    start = time.perf_counter()
+
+    async def timed(user_id):
+        await handler(user_id)
+        return (time.perf_counter() - start) * 1000
+
+    return await asyncio.gather(*(timed(BENCH_USER_BASE + i) for i in range(users)))
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=300)
+    args = parser.parse_args()
+
+    await queries.init_pool()
+    await ensure_schema()
+    try:
+        print_latencies("legacy", await run(legacy_handler, args.users))
+        print_latencies("pool", await run(pool_handler, args.users))
+    finally:
+        async with queries.get_connection() as conn:
+            await conn.execute('DELETE FROM reports WHERE user_id >= $1', BENCH_USER_BASE)
+        await queries.close_pool()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,284 @@
+"""
+Fake Telegram Bot API server for load tests.
+
+Serves getUpdates from an in-memory queue and answers sendMessage,
+editMessageText, answerCallbackQuery, the media methods and the other
+methods the bot calls with Telegram-shaped results after a random latency;
+getFile and the file download route serve file_size bytes for any file. Flood control works
+like Telegram's: more than --global-limit messages per second overall or
+--group-limit messages per minute to one group get a 429 with
+retry_after, and --error-rate adds random 429s on top. Messages to chats
+in blocked get a 403 as from a user who blocked the bot.
+
+Point the bot at it with TELEGRAM_API_URL=http://127.0.0.1:<port>.
+Test drivers push updates with push_message()/push_callback() and wait
+for the bot's answers with expect().
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from aiohttp import web
+
+# Methods that post or change a message and count against flood limits
+SEND_METHODS = ("sendMessage", "editMessageText", "sendDocument", "sendMediaGroup", "sendPhoto", "sendVoice")
+# Media methods -> the message field holding the file
+MEDIA_METHODS = {"sendPhoto": "photo", "sendDocument": "document", "sendVoice": "voice"}
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Load test bot", "username": "load_test_bot"}
+
+class _Bucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, cost: int = 1) -> float:
+        """Take cost tokens; seconds until they are available if there aren't enough"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+class FakeTelegram:
+    def __init__(self, latency_ms: float = 40, error_rate: float = 0.0,
+                 global_limit: float = 30, group_limit: float = 20, file_size: int = 1 << 18):
+        self.latency = latency_ms / 1000
+        self.file_size = file_size
+        self.error_rate = error_rate
+        self._global = _Bucket(global_limit, global_limit) if global_limit else None
+        self.group_limit = group_limit
+        self._groups = {}
+        self._updates = []  # (update_id, update) not yet confirmed by the bot
+        self._new_updates = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+        self._messages = {}  # (chat_id, message_id) -> message dict
+        self._waiters = []  # (chat_id, predicate, future)
+        # Observers see every delivered call: observer(method, params, result)
+        self.observers = []
+        self.calls = Counter()
+        self.throttled = Counter()
+        self.updates_served = 0
+        # Chat ids (as strings) that answer sends with 403
+        self.blocked = set()
+
+    # Driver side
+
+    def push_message(self, user: dict, chat: dict, text: str = None, **fields) -> dict:
+        """Push a message from user; fields are added as is (photo=[...], caption=..., media_group_id=...)"""
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": chat,
+            "from": user,
+            **fields,
+        }
+        if text is not None:
+            message["text"] = text
+        if text and text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        self._push({"message": message})
+        return message
+
+    def push_callback(self, user: dict, message: dict, data: str) -> str:
+        callback_id = str(next(self._callback_ids))
+        self._push({"callback_query": {
+            "id": callback_id,
+            "from": user,
+            "message": message,
+            "chat_instance": str(message["chat"]["id"]),
+            "data": data,
+        }})
+        return callback_id
+
+    def _push(self, update: dict):
+        update_id = next(self._update_ids)
+        self._updates.append((update_id, {"update_id": update_id, **update}))
+        self._new_updates.set()
+
+    def expect(self, chat_id, predicate=None) -> asyncio.Future:
+        """Future of the next (method, params, result) for chat_id matching predicate(method, params)
+
+        Register it before pushing the update that causes the answer.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((str(chat_id), predicate, future))
+        return future
+
+    def _deliver(self, method: str, params: dict, result):
+        chat_id = str(params.get("chat_id", ""))
+        for waiter in list(self._waiters):
+            waiter_chat, predicate, future = waiter
+            if future.done():
+                self._waiters.remove(waiter)
+            elif waiter_chat == chat_id and (predicate is None or predicate(method, params)):
+                self._waiters.remove(waiter)
+                future.set_result((method, params, result))
+                break
+        for observer in self.observers:
+            observer(method, params, result)
+
+    # Bot API side
+
+    def _flood_wait(self, method: str, params: dict) -> float:
+        if method not in SEND_METHODS:
+            return 0.0
+        if self.error_rate and random.random() < self.error_rate:
+            return 1.0
+        # A media group counts as one message per item
+        cost = len(params.get("media") or ()) or 1
+        chat_id = str(params.get("chat_id", ""))
+        wait = self._global.take(cost) if self._global else 0.0
+        if self.group_limit and chat_id.startswith("-"):
+            bucket = self._groups.get(chat_id)
+            if bucket is None:
+                bucket = self._groups[chat_id] = _Bucket(self.group_limit / 60, self.group_limit)
+            wait = max(wait, bucket.take(cost))
+        return wait
+
+    def _chat(self, chat_id: str) -> dict:
+        return {"id": int(chat_id), "type": "supergroup" if chat_id.startswith("-") else "private"}
+
+    def _send_message(self, params: dict, **fields) -> dict:
+        chat_id = str(params["chat_id"])
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": self._chat(chat_id),
+            "from": BOT_USER,
+            **(fields or {"text": params.get("text", "")}),
+        }
+        if params.get("reply_markup"):
+            message["reply_markup"] = params["reply_markup"]
+        self._messages[(chat_id, message["message_id"])] = message
+        return message
+
+    def _file(self, file_id: str) -> dict:
+        return {"file_id": file_id, "file_unique_id": file_id[-16:], "file_size": self.file_size}
+
+    def _media_fields(self, kind: str, file_id: str, caption: str = None) -> dict:
+        file = self._file(file_id)
+        if kind == "photo":
+            fields = {"photo": [{**file, "width": 1280, "height": 960}]}
+        elif kind == "voice":
+            fields = {"voice": {**file, "duration": 5}}
+        else:
+            fields = {"document": file}
+        if caption:
+            fields["caption"] = caption
+        return fields
+
+    def _send_media_group(self, params: dict) -> list:
+        media_group_id = str(next(self._message_ids))
+        return [
+            self._send_message(params, media_group_id=media_group_id,
+                               **self._media_fields(item["type"], item["media"], item.get("caption")))
+            for item in params["media"]
+        ]
+
+    def _edit_message_text(self, params: dict):
+        key = (params["chat_id"], int(params["message_id"]))
+        message = self._messages.get(key) or {
+            "message_id": key[1], "date": int(time.time()), "chat": self._chat(key[0]), "from": BOT_USER
+        }
+        message = {**message, "text": params["text"], "edit_date": int(time.time())}
+        message.pop("reply_markup", None)
+        if params.get("reply_markup"):
+            message["reply_markup"] = params["reply_markup"]
+        self._messages[key] = message
+        return message
+
+    async def _get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        if offset:
+            self._updates = [(update_id, u) for update_id, u in self._updates if update_id >= offset]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout=float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        updates = [u for _, u in self._updates[:int(params.get("limit") or 100)]]
+        self.updates_served += len(updates)
+        return updates
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = {}
+        if request.content_type == "application/json":
+            params = await request.json()
+        for key, value in (await request.post()).items():
+            if isinstance(value, str) and value[:1] in "{[":
+                value = json.loads(value)
+            params[key] = value
+        self.calls[method] += 1
+
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(params)})
+
+        await asyncio.sleep(random.expovariate(1 / self.latency) if self.latency else 0)
+        retry_after = self._flood_wait(method, params)
+        if retry_after:
+            self.throttled[method] += 1
+            retry_after = max(1, round(retry_after))
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {retry_after}",
+                "parameters": {"retry_after": retry_after},
+            }, status=429)
+
+        if method in SEND_METHODS and str(params.get("chat_id")) in self.blocked:
+            return web.json_response({
+                "ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user",
+            }, status=403)
+
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "sendMessage":
+            result = self._send_message(params)
+        elif method == "editMessageText":
+            result = self._edit_message_text(params)
+        elif method in MEDIA_METHODS:
+            kind = MEDIA_METHODS[method]
+            result = self._send_message(params, **self._media_fields(kind, params[kind], params.get("caption")))
+        elif method == "sendMediaGroup":
+            result = self._send_media_group(params)
+        elif method == "getFile":
+            result = {**self._file(params["file_id"]), "file_path": f"files/{params['file_id']}"}
+        else:
+            result = True
+        self._deliver(method, params, result)
+        return web.json_response({"ok": True, "result": result})
+
+    async def download(self, request: web.Request) -> web.StreamResponse:
+        self.calls["download"] += 1
+        response = web.StreamResponse(headers={"Content-Length": str(self.file_size)})
+        await response.prepare(request)
+        chunk = b"\0" * (1 << 16)
+        for start in range(0, self.file_size, len(chunk)):
+            await response.write(chunk[:self.file_size - start])
+        await response.write_eof()
+        return response
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> web.AppRunner:
+        """Serve on host:port (0 picks a free port, see self.url)"""
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/file/bot{token}/{path:.+}", self.download)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        port = runner.addresses[0][1]
+        self.url = f"http://{host}:{port}"
+        return runner
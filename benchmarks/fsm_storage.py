@@ -0,0 +1,137 @@
+"""
+FSM storage checks.
+
+shared: two processes, each with its own Dispatcher and PostgresStorage,
+walk the same users through the report flow - process A selects the report
+type, process B receives the report text and must see A's state and data.
+
+bench: cost of the FSM work done for one update (get_state, get_data,
+update_data, set_state) for each backend.
+
+    python -m benchmarks.fsm_storage shared --users 200
+    python -m benchmarks.fsm_storage bench --updates 5000 [--redis]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import time
+
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Update
+
+from db import queries
+from db.migrate import ensure_schema
+from handlers.fsm_storage import PostgresStorage
+from handlers.user import ReportStates
+
+BOT_ID = 1
+BENCH_USER_BASE = 10 ** 15
+
+def make_update(update_id: int, user_id: int, text: str) -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "bench"},
+            "text": text,
+        },
+    })
+
+def make_dispatcher(results: list) -> Dispatcher:
+    """Dispatcher with a two-step copy of the report flow (no Telegram calls)"""
+    router = Router()
+
+    @router.message(F.text == "type")
+    async def select_type(message, state: FSMContext):
+        await state.update_data(report_type=f"type-{message.from_user.id}")
+        await state.set_state(ReportStates.waiting_for_message)
+
+    @router.message(ReportStates.waiting_for_message)
+    async def report_text(message, state: FSMContext):
+        data = await state.get_data()
+        results.append((message.from_user.id, data.get("report_type")))
+        await state.clear()
+
+    dp = Dispatcher(storage=PostgresStorage())
+    dp.include_router(router)
+    return dp
+
+def run_worker(step: str, users: int, output):
+    async def work():
+        await queries.init_pool()
+        results = []
+        dp = make_dispatcher(results)
+        bot = Bot(f"{BOT_ID}:bench")
+        for i in range(users):
+            user_id = BENCH_USER_BASE + i
+            await dp.feed_update(bot, make_update(i + 1, user_id, "type" if step == "A" else "text"))
+        await dp.storage.close()
+        await bot.session.close()
+        await queries.close_pool()
+        output.put(results)
+
+    asyncio.run(work())
+
+def shared(users: int):
+    output = multiprocessing.Queue()
+    for step in ("A", "B"):
+        process = multiprocessing.Process(target=run_worker, args=(step, users, output))
+        process.start()
+        results = output.get()
+        process.join()
+
+    missing = [(user_id, t) for user_id, t in results if t != f"type-{user_id}"]
+    assert len(results) == users, f"process B handled {len(results)} of {users} users"
+    assert not missing, f"process B didn't see state of {len(missing)} users: {missing[:5]}"
+    print(f"OK: {users} users continued their flow in another process")
+
+async def bench_storage(name: str, storage, updates: int):
+    start = time.perf_counter()
+    for i in range(updates):
+        key = StorageKey(bot_id=BOT_ID, chat_id=BENCH_USER_BASE + i % 100, user_id=BENCH_USER_BASE + i % 100)
+        await storage.get_state(key)
+        await storage.get_data(key)
+        await storage.update_data(key, {"report_type": "Персонал", "step": i})
+        await storage.set_state(key, ReportStates.waiting_for_message)
+    await storage.close()
+    elapsed = time.perf_counter() - start
+    print(f"{name:>22}: {elapsed / updates * 1e6:.0f} µs per update")
+
+async def bench(updates: int, redis: bool):
+    await queries.init_pool()
+    await ensure_schema()
+    try:
+        await bench_storage("memory", MemoryStorage(), updates)
+        await bench_storage("postgres write-behind", PostgresStorage(), updates)
+        await bench_storage("postgres write-through", PostgresStorage(flush_interval=0), updates)
+        if redis:
+            from aiogram.fsm.storage.redis import RedisStorage
+            from config import REDIS_URL
+            await bench_storage("redis", RedisStorage.from_url(REDIS_URL), updates)
+    finally:
+        async with queries.get_connection() as conn:
+            await conn.execute("DELETE FROM fsm_storage WHERE key LIKE $1", f"fsm:{BOT_ID}:{BENCH_USER_BASE // 100}%")
+        await queries.close_pool()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    shared_parser = sub.add_parser("shared")
+    shared_parser.add_argument("--users", type=int, default=200)
+    bench_parser = sub.add_parser("bench")
+    bench_parser.add_argument("--updates", type=int, default=5000)
+    bench_parser.add_argument("--redis", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "shared":
+        shared(args.users)
+    else:
+        asyncio.run(bench(args.updates, args.redis))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+History list benchmark: /my_work, /user_<id> and /recent pages and counts.
+
+Fills the reports table with a synthetic history (rows are removed at the
+end), vacuums it so index-only scans can skip the table, then for each
+list times the first page and the following --pages pages, the count the
+list header shows (estimate) and an exact COUNT(*) for comparison, and
+prints the scan nodes of the first page's plan with their heap fetches.
+Run against a scratch database:
+
+    python -m benchmarks.history --rows 1000000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from db import queries
+from db.migrate import ensure_schema
+from benchmarks.stats import print_latencies
+
+BENCH_USER_BASE = 10 ** 15
+WORKERS = 20
+USERS = 1999
+
+NAMES = ["Иван Петров", "Мария Иванова", "Алексей Смирнов", "Ольга Кузнецова", "Дмитрий Попов"]
+TYPES = ["Помещение/оборудование", "Учебный процесс", "Персонал", "Предложение", "Обратная связь"]
+
+CASES = [
+    ("recent", {}),
+    ("recent, completed, 30 days", {'status': 'completed', 'days': 30}),
+    ("recent, pending", {'status': 'pending'}),
+    ("worker", {'worker_id': BENCH_USER_BASE}),
+    ("worker, type, 90 days", {'worker_id': BENCH_USER_BASE, 'report_type': TYPES[1], 'days': 90}),
+    ("user", {'user_id': BENCH_USER_BASE + WORKERS}),
+    ("user, completed", {'user_id': BENCH_USER_BASE + WORKERS, 'status': 'completed'}),
+]
+
+async def fill(rows: int):
+    """Reports over the last rows minutes: 2% pending, 3% in progress, the rest completed"""
+    async with queries.get_connection() as conn, conn.transaction():
+        await conn.execute('SET LOCAL statement_timeout = 0')
+        await conn.execute('''
+            INSERT INTO reports (user_id, user_name, report_type, report_text, status,
+                                 responsible_user_id, responsible_user_name, created_at, taken_at, completed_at)
+            SELECT $1::bigint + $4 + (g * 7919) % $5,
+                   ($2::text[])[1 + g % array_length($2, 1)],
+                   ($3::text[])[1 + (g / 7) % array_length($3, 1)],
+                   'Синтетическое обращение ' || g,
+                   CASE WHEN g % 100 < 2 THEN 'pending' WHEN g % 100 < 5 THEN 'in_progress' ELSE 'completed' END,
+                   CASE WHEN g % 100 >= 2 THEN $1::bigint + (g / 3) % $4 END,
+                   CASE WHEN g % 100 >= 2 THEN 'Сотрудник ' || (g / 3) % $4 END,
+                   NOW() - make_interval(mins => g),
+                   CASE WHEN g % 100 >= 2 THEN NOW() - make_interval(mins => g) + INTERVAL '10 minutes' END,
+                   CASE WHEN g % 100 >= 5 THEN NOW() - make_interval(mins => g) + INTERVAL '1 hour' END
+            FROM generate_series(1, $6) g
+        ''', BENCH_USER_BASE, NAMES, TYPES, WORKERS, USERS, rows)
+    async with queries.get_connection() as conn:
+        # Sets the visibility map: index-only scans don't need the table for these pages
+        await conn.execute('VACUUM ANALYZE reports')
+
+async def scan_nodes(filters: dict) -> list:
+    """(node type, relation, heap fetches) of the scans in the first page's plan"""
+    table, where, args = queries._history_where(**filters)
+    async with queries.get_connection() as conn:
+        plan = await conn.fetchval(f'''
+            EXPLAIN (ANALYZE, FORMAT JSON)
+            SELECT {queries.HISTORY_COLUMNS} FROM {table} WHERE {where}
+            ORDER BY created_at DESC, id DESC LIMIT 16
+        ''', *args)
+    nodes, stack = [], [json.loads(plan)[0]['Plan']]
+    while stack:
+        node = stack.pop()
+        if node['Node Type'].endswith('Scan') and node.get('Actual Loops'):
+            nodes.append((node['Node Type'], node.get('Index Name') or node.get('Relation Name'),
+                          node.get('Heap Fetches')))
+        stack.extend(node.get('Plans', ()))
+    return nodes
+
+async def exact_count(filters: dict) -> int:
+    table, where, args = queries._history_where(**filters)
+    async with queries.get_connection() as conn:
+        return await conn.fetchval(f'SELECT COUNT(*) FROM {table} WHERE {where}', *args)
+
+async def run_case(name: str, filters: dict, pages: int, repeat: int):
+    page_ms, count_ms, exact_ms = [], [], []
+    for _ in range(repeat):
+        cursor = None
+        for _ in range(pages + 1):
+            start = time.perf_counter()
+            page = await queries.get_report_history(**filters, cursor=cursor, limit=15)
+            page_ms.append((time.perf_counter() - start) * 1000)
+            if not page.has_next:
+                break
+            cursor = page.last_cursor
+        start = time.perf_counter()
+        count, exact = await queries.count_report_history(**filters)
+        count_ms.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        actual = await exact_count(filters)
+        exact_ms.append((time.perf_counter() - start) * 1000)
+
+    print(f"{name}: {'' if exact else '≈'}{count} shown, {actual} actual")
+    print_latencies("page", page_ms)
+    print_latencies("estimate", count_ms)
+    print_latencies("count(*)", exact_ms)
+    for node_type, relation, heap_fetches in await scan_nodes(filters):
+        print(f"{'':>12}{node_type} on {relation}" + (f", heap fetches {heap_fetches}" if heap_fetches is not None else ""))
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--pages", type=int, default=5, help="pages to follow after the first one")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    await queries.init_pool()
+    await ensure_schema()
+    try:
+        start = time.perf_counter()
+        await fill(args.rows)
+        print(f"inserted {args.rows} reports in {time.perf_counter() - start:.0f}s")
+        for name, filters in CASES:
+            await run_case(name, filters, args.pages, args.repeat)
+    finally:
+        async with queries.get_connection() as conn, conn.transaction():
+            await conn.execute('SET LOCAL statement_timeout = 0')
+            await conn.execute('DELETE FROM reports WHERE user_id >= $1', BENCH_USER_BASE)
+        await queries.close_pool()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,318 @@
+"""
+Load test: virtual parents and admins against the real bot and a fake Bot API.
+
+Creates a scratch database <DB_NAME>_load (dropped afterwards unless
+--keep-db), starts the fake Telegram server from benchmarks/fake_telegram.py
+and runs main.py against both in a subprocess, so the whole bot is
+exercised: handlers, FSM storage, the send queue, digests and the database.
+
+Each virtual user goes through the report flow (/start → "Сообщить о
+проблеме" → type → text) and waits for every answer; users start evenly
+within --ramp seconds. Admins take reports from the admin group and
+complete them. Prints throughput, latency percentiles per step and error
+rates; the bot's log goes to --log.
+
+    python -m benchmarks.load --users 1000 --admins 10 --ramp 30
+"""
+import argparse
+import asyncio
+import os
+import random
+import re
+import signal
+import socket
+import sys
+import time
+from collections import defaultdict
+
+import aiohttp
+import asyncpg
+
+from config import DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME
+from benchmarks.fake_telegram import FakeTelegram
+from benchmarks.stats import print_latencies
+
+ADMIN_GROUP_ID = -1001000000001
+USER_ID_BASE = 5_000_000
+ADMIN_ID_BASE = 9_000_000
+REPORT_TYPES = ("type_facility", "type_education", "type_staff")
+TEXTS = [
+    "В кабинете 204 не работает проектор",
+    "Учитель опаздывает на занятия уже третий раз",
+    "Холодно в классе, не работает отопление",
+    "Прошу перенести родительское собрание на вечер",
+]
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)  # step -> ms
+        self.timeouts = defaultdict(int)  # step -> count
+        self.flows_ok = 0
+
+    def record(self, step: str, started: float):
+        self.latencies[step].append((time.perf_counter() - started) * 1000)
+
+class LoadTest:
+    def __init__(self, api: FakeTelegram, args):
+        self.api = api
+        self.args = args
+        self.stats = Stats()
+        self.accepted_at = {}  # report_id -> perf_counter when the user got the confirmation
+        self.notified_at = {}  # report_id -> perf_counter when it appeared in the admin group
+        self.to_take = asyncio.Queue()  # (report_id, group message)
+        self.completed = set()
+        api.observers.append(self.on_api_call)
+
+    def on_api_call(self, method: str, params: dict, result):
+        """Watch the admin group for take buttons of new reports"""
+        if str(params.get("chat_id")) != str(ADMIN_GROUP_ID) or not isinstance(result, dict):
+            return
+        for row in (params.get("reply_markup") or {}).get("inline_keyboard", []):
+            for button in row:
+                match = re.fullmatch(r"take_request_(\d+)", button.get("callback_data", ""))
+                if match and int(match.group(1)) not in self.notified_at:
+                    report_id = int(match.group(1))
+                    self.notified_at[report_id] = time.perf_counter()
+                    self.to_take.put_nowait((report_id, result))
+
+    async def step(self, name: str, future: asyncio.Future, started: float):
+        """Wait for the bot's answer; None on timeout"""
+        try:
+            answer = await asyncio.wait_for(future, self.args.timeout)
+        except asyncio.TimeoutError:
+            self.stats.timeouts[name] += 1
+            return None
+        self.stats.record(name, started)
+        return answer
+
+    async def think(self):
+        await asyncio.sleep(random.uniform(0, 2 * self.args.think))
+
+    async def user(self, number: int):
+        await asyncio.sleep(self.args.ramp * number / max(1, self.args.users))
+        user_id = USER_ID_BASE + number
+        user = {"id": user_id, "is_bot": False, "first_name": f"Родитель {number}"}
+        chat = {"id": user_id, "type": "private"}
+        api = self.api
+
+        started = time.perf_counter()
+        future = api.expect(user_id, lambda method, params: method == "sendMessage")
+        api.push_message(user, chat, "/start")
+        answer = await self.step("start", future, started)
+        if answer is None:
+            return
+        menu = answer[2]
+
+        await self.think()
+        started = time.perf_counter()
+        future = api.expect(user_id, lambda method, params: method == "editMessageText")
+        api.push_callback(user, menu, "report_problem")
+        answer = await self.step("category", future, started)
+        if answer is None:
+            return
+
+        await self.think()
+        started = time.perf_counter()
+        future = api.expect(user_id, lambda method, params: method == "editMessageText")
+        api.push_callback(user, answer[2], random.choice(REPORT_TYPES))
+        if await self.step("type", future, started) is None:
+            return
+
+        await self.think()
+        started = time.perf_counter()
+        future = api.expect(user_id, lambda method, params: "принято" in params.get("text", ""))
+        api.push_message(user, chat, f"{random.choice(TEXTS)} (#{number})")
+        answer = await self.step("text", future, started)
+        if answer is None:
+            return
+        report_id = int(re.search(r"#(\d+)", answer[1]["text"]).group(1))
+        self.accepted_at[report_id] = time.perf_counter()
+        self.stats.flows_ok += 1
+
+    async def admin(self, number: int):
+        admin_id = ADMIN_ID_BASE + number
+        admin = {"id": admin_id, "is_bot": False, "first_name": f"Админ {number}"}
+        chat = {"id": admin_id, "type": "private"}
+        api = self.api
+        while True:
+            report_id, group_message = await self.to_take.get()
+            await self.think()
+
+            started = time.perf_counter()
+            callback_id = None
+            future = api.expect("", lambda method, params: params.get("callback_query_id") == callback_id)
+            callback_id = api.push_callback(admin, group_message, f"take_request_{report_id}")
+            if await self.step("take", future, started) is None:
+                continue
+
+            await self.think()
+            started = time.perf_counter()
+            future = api.expect(admin_id, lambda method, params: f"Обращение #{report_id}" in params.get("text", ""))
+            api.push_message(admin, chat, f"/complete_{report_id} Проблема решена")
+            if await self.step("complete", future, started) is not None:
+                self.completed.add(report_id)
+
+    async def run(self) -> float:
+        admins = [asyncio.create_task(self.admin(i)) for i in range(self.args.admins)]
+        start = time.perf_counter()
+        await asyncio.gather(*(self.user(i) for i in range(self.args.users)))
+        users_done = time.perf_counter() - start
+
+        # Let admins work off what is queued
+        deadline = time.perf_counter() + self.args.drain
+        while len(self.completed) < len(self.accepted_at) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.2)
+        for task in admins:
+            task.cancel()
+
+        for report_id, accepted in self.accepted_at.items():
+            if report_id in self.notified_at:
+                self.stats.latencies["notify"].append(max(0.0, self.notified_at[report_id] - accepted) * 1000)
+        return users_done
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def admin_connect():
+    return await asyncpg.connect(host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASSWORD, database="postgres")
+
+async def create_database(name: str):
+    """Fresh scratch database; the bot applies migrations on start"""
+    conn = await admin_connect()
+    try:
+        await conn.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+        await conn.execute(f'CREATE DATABASE "{name}"')
+    finally:
+        await conn.close()
+
+async def drop_database(name: str):
+    conn = await admin_connect()
+    try:
+        await conn.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+    finally:
+        await conn.close()
+
+async def start_bot(api: FakeTelegram, database: str, metrics_port: int, log_path: str, **extra_env):
+    """Run main.py against the fake API and the scratch database; extra_env overrides settings"""
+    env = {
+        **os.environ,
+        "BOT_TOKEN": "123456:load-test",
+        "ADMIN_GROUP_ID": str(ADMIN_GROUP_ID),
+        "BOT_MODE": "polling",
+        "TELEGRAM_API_URL": api.url,
+        "DB_NAME": database,
+        "METRICS_HOST": "127.0.0.1",
+        "METRICS_PORT": str(metrics_port),
+        **extra_env,
+    }
+    log = open(log_path, "wb")
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "main.py",
+        env=env, stdout=log, stderr=log,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    # Ready once it polls for updates
+    deadline = time.monotonic() + 120
+    while not api.calls["getUpdates"]:
+        if process.returncode is not None or time.monotonic() > deadline:
+            raise RuntimeError(f"Bot didn't start, see {log_path}")
+        await asyncio.sleep(0.1)
+    return process
+
+async def stop_bot(process):
+    process.send_signal(signal.SIGINT)
+    try:
+        await asyncio.wait_for(process.wait(), 30)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+
+async def scrape_metrics(port: int) -> dict:
+    """Sum of each bot_* counter over all labels"""
+    totals = defaultdict(float)
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+            for line in (await response.text()).splitlines():
+                if line.startswith("bot_") and not line.startswith("#"):
+                    name, _, value = line.rpartition(" ")
+                    totals[name.split("{")[0]] += float(value)
+    return totals
+
+async def count_reports(database: str) -> dict:
+    conn = await asyncpg.connect(
+        host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASSWORD, database=database
+    )
+    try:
+        return dict(await conn.fetchrow('''
+            SELECT count(*) AS total, count(*) FILTER (WHERE status = 'completed') AS completed FROM reports
+        '''))
+    finally:
+        await conn.close()
+
+def print_report(test: LoadTest, api: FakeTelegram, users_done: float, total: float,
+                 metrics: dict, reports: dict):
+    args, stats = test.args, test.stats
+    failed = args.users - stats.flows_ok
+    print(f"users: {args.users}, admins: {args.admins}, flows ok: {stats.flows_ok}, "
+          f"failed: {failed} ({failed / max(1, args.users):.1%})")
+    print(f"user flows: {users_done:.1f}s, {stats.flows_ok / users_done:.1f} reports/s; "
+          f"total {total:.1f}s, {api.updates_served / total:.0f} updates/s, "
+          f"{sum(api.calls.values()) / total:.0f} API calls/s")
+    print("latency per step (notify = confirmation → take button in the admin group):")
+    for step in ("start", "category", "type", "text", "notify", "take", "complete"):
+        if stats.latencies[step]:
+            print_latencies(step, stats.latencies[step])
+    if stats.timeouts:
+        print("timeouts: " + ", ".join(f"{step} {count}" for step, count in stats.timeouts.items()))
+    print("429 from the API: " + (", ".join(f"{m} {c}" for m, c in api.throttled.items()) or "none"))
+    print(
+        f"bot: handler errors {metrics.get('bot_handler_errors_total', 0):.0f}, "
+        f"send retries {metrics.get('bot_send_retries_total', 0):.0f}, "
+        f"send failures {metrics.get('bot_send_failures_total', 0):.0f}"
+    )
+    print(f"reports in db: {reports['total']}, completed: {reports['completed']} "
+          f"(admins completed {len(test.completed)} of {len(test.accepted_at)} accepted)")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--admins", type=int, default=10)
+    parser.add_argument("--ramp", type=float, default=30, help="seconds over which users start")
+    parser.add_argument("--think", type=float, default=1.0, help="mean pause between a user's steps, seconds")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for one answer")
+    parser.add_argument("--drain", type=float, default=60, help="seconds admins get after the last user")
+    parser.add_argument("--api-latency", type=float, default=40, help="mean Bot API latency, ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of random 429 answers")
+    parser.add_argument("--global-limit", type=float, default=30, help="messages/s before 429 (0 = off)")
+    parser.add_argument("--group-limit", type=float, default=20, help="messages/min per group before 429 (0 = off)")
+    parser.add_argument("--database", default=f"{DB_NAME}_load")
+    parser.add_argument("--keep-db", action="store_true")
+    parser.add_argument("--log", default="load_bot.log")
+    args = parser.parse_args()
+
+    api = FakeTelegram(args.api_latency, args.error_rate, args.global_limit, args.group_limit)
+    runner = await api.start()
+    metrics_port = free_port()
+    await create_database(args.database)
+    process = None
+    try:
+        process = await start_bot(api, args.database, metrics_port, args.log)
+        test = LoadTest(api, args)
+        start = time.perf_counter()
+        users_done = await test.run()
+        total = time.perf_counter() - start
+        metrics = await scrape_metrics(metrics_port)
+        await stop_bot(process)
+        process = None
+        print_report(test, api, users_done, total, metrics, await count_reports(args.database))
+    finally:
+        if process is not None:
+            await stop_bot(process)
+        await runner.cleanup()
+        if not args.keep_db:
+            await drop_database(args.database)
+
+if __name__ == "__main__":
+    asyncio.run(main())
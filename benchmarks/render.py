@@ -0,0 +1,76 @@
+"""
+Render cost per message: report cards, list pages, splitting and keyboards.
+
+Needs no database. Times each render function on a typical report, a
+/pending page, splitting a long report card, and the inline keyboards
+rebuilt per call vs the shared prebuilt ones (including the JSON the Bot
+API request is made of).
+
+    python -m benchmarks.render --iterations 20000
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import render
+from db.queries import Page
+from keyboards import inline_kb
+
+def make_report(report_id: int, text_length: int = 300) -> dict:
+    now = datetime.now()
+    return {
+        'id': report_id,
+        'user_id': 100000 + report_id,
+        'user_name': "Мария Иванова",
+        'report_type': "Помещение/оборудование",
+        'report_text': ("В кабинете 204 не работает проектор, " * 20)[:text_length],
+        'status': 'completed',
+        'responsible_user_id': 42,
+        'responsible_user_name': "Алексей Смирнов",
+        'admin_response': "Заменили лампу проектора",
+        'created_at': now - timedelta(hours=5),
+        'taken_at': now - timedelta(hours=4),
+        'completed_at': now,
+        'reminder_tier': 1,
+        'tier': 1,
+        'snippet': "не работает [проектор]",
+    }
+
+def bench(name: str, function, iterations: int):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    elapsed = time.perf_counter() - start
+    print(f"{name:>28}: {elapsed / iterations * 1e6:8.2f} µs")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+    n = args.iterations
+
+    report = make_report(1)
+    long_report = make_report(2, text_length=4000)
+    page = Page([make_report(i) for i in range(20)], False, True)
+    now = datetime.now()
+
+    print("Report cards:")
+    bench("new_report", lambda: render.new_report(report, "maria", now), n)
+    bench("taken_dm", lambda: render.taken_dm(report), n)
+    bench("completed_user", lambda: render.completed_user(report), n)
+    bench("admin_details", lambda: render.admin_details(report), n)
+    bench("reminder", lambda: render.reminder(report, 3, "5ч 0м"), n)
+    bench("digest_entry", lambda: render.digest_entry(report), n)
+
+    print("Lists and splitting:")
+    bench("/pending page (20 rows)", lambda: render.fit_page("⏳ Ожидающие обращения:\n\n", page, render.pending_item), n // 10)
+    bench("split admin_details 4k", lambda: render.split_text(render.admin_details(long_report)), n)
+
+    print("Keyboards:")
+    bench("main menu, built per call", inline_kb._build_main_menu, n // 10)
+    bench("main menu, prebuilt", inline_kb.get_main_menu, n)
+    bench("main menu, built + JSON", lambda: inline_kb._build_main_menu().model_dump_json(exclude_none=True), n // 10)
+    bench("main menu, prebuilt + JSON", lambda: inline_kb.get_main_menu().model_dump_json(exclude_none=True), n // 10)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Repeated admin lookups with and without the report cache.
+
+Simulated admins open /report_<id> for a skewed set of report IDs (most
+lookups hit a few hot reports) while a small share of requests take
+reports, which invalidates them. Prints lookup latency and hit rate.
+
+    python -m benchmarks.report_cache --reports 500 --lookups 20000 --admins 20
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from db import cache, queries
+from db.migrate import ensure_schema
+from benchmarks.stats import print_latencies
+
+BENCH_USER_BASE = 10 ** 15
+
+def cache_hit_rate() -> float:
+    values = cache.CACHE_REQUESTS._values
+    hits = values.get(("report", "hit"), 0)
+    misses = values.get(("report", "miss"), 0)
+    return hits / max(1, hits + misses)
+
+async def run(name: str, report_ids: list, lookups: int, admins: int, write_ratio: float):
+    cache.CACHE_REQUESTS._values.clear()
+    rng = random.Random(42)
+    # Zipf-like: a few reports get most of the lookups
+    weights = [1 / (rank + 1) for rank in range(len(report_ids))]
+    plan = rng.choices(report_ids, weights, k=lookups)
+    latencies = []
+
+    async def admin(worker: int):
+        for i in range(worker, lookups, admins):
+            if rng.random() < write_ratio:
+                await queries.take_report(plan[i], BENCH_USER_BASE + worker, f"admin-{worker}")
+                continue
+            start = time.perf_counter()
+            await queries.get_report(plan[i])
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(admin(worker) for worker in range(admins)))
+    elapsed = time.perf_counter() - start
+    print_latencies(name, latencies)
+    print(f"{'':>10}  {len(latencies) / elapsed:.0f} lookups/s, hit rate {cache_hit_rate():.0%}")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reports", type=int, default=500)
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--admins", type=int, default=20)
+    parser.add_argument("--write-ratio", type=float, default=0.01)
+    args = parser.parse_args()
+
+    await queries.init_pool()
+    await ensure_schema()
+    try:
+        report_ids = [
+            await queries.save_report(BENCH_USER_BASE + i % 50, "bench", "Персонал", f"cache test {i}")
+            for i in range(args.reports)
+        ]
+
+        maxsize = cache.report_cache.maxsize
+        cache.report_cache.maxsize = 0
+        await run("no cache", report_ids, args.lookups, args.admins, args.write_ratio)
+        cache.report_cache.maxsize = maxsize
+        cache.clear_all()
+        await run("cache", report_ids, args.lookups, args.admins, args.write_ratio)
+    finally:
+        async with queries.get_connection() as conn:
+            await conn.execute('DELETE FROM reports WHERE user_id >= $1', BENCH_USER_BASE)
+        await queries.close_pool()
+
+if __name__ == "__main__":
+    asyncio.run(main())
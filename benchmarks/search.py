@@ -0,0 +1,89 @@
+"""
+Search benchmark: ranked full-text search vs the old ILIKE scan.
+
+Fills the reports table with a synthetic corpus (rows are removed at the
+end) and times both queries for a set of search terms.
+Run against a scratch database:
+
+    python -m benchmarks.search --rows 1000000
+"""
+import argparse
+import asyncio
+import time
+
+from db import queries
+from db.migrate import ensure_schema
+from benchmarks.stats import print_latencies
+
+BENCH_USER_BASE = 10 ** 15
+
+WORDS = [
+    "проектор", "кабинет", "учитель", "занятие", "расписание", "отопление",
+    "окно", "дверь", "туалет", "столовая", "обед", "домашнее", "задание",
+    "оценка", "родитель", "собрание", "охрана", "парковка", "компьютер",
+    "интернет", "доска", "мел", "парта", "стул", "свет", "лампа", "холодно",
+    "жарко", "сломался", "не", "работает", "опаздывает", "грубит", "шумно",
+]
+NAMES = ["Иван Петров", "Мария Иванова", "Алексей Смирнов", "Ольга Кузнецова", "Дмитрий Попов"]
+TYPES = ["Помещение/оборудование", "Учебный процесс", "Персонал", "Предложение", "Обратная связь"]
+TERMS = ["сломался проектор", "холодно в кабинете", "учитель опаздывает", "Петров", "столовая обед"]
+
+async def ilike_search(search_text: str) -> list:
+    """The previous implementation"""
+    pattern = f'%{search_text}%'
+    return await queries._fetch('''
+        SELECT * FROM reports
+        WHERE report_text ILIKE $1
+           OR user_name ILIKE $1
+           OR report_type ILIKE $1
+        ORDER BY created_at DESC
+        LIMIT 50
+    ''', pattern)
+
+async def fill(rows: int):
+    async with queries.get_connection() as conn, conn.transaction():
+        await conn.execute('SET LOCAL statement_timeout = 0')
+        await conn.execute('''
+            INSERT INTO reports (user_id, user_name, report_type, report_text, created_at)
+            SELECT $1::bigint + g % 10000,
+                   ($2::text[])[1 + g % array_length($2, 1)],
+                   ($3::text[])[1 + g % array_length($3, 1)],
+                   (SELECT string_agg(($4::text[])[1 + ((g * 7919 + w * 104729) % array_length($4, 1))], ' ')
+                    FROM generate_series(1, 8 + g % 20) w),
+                   NOW() - make_interval(mins => g)
+            FROM generate_series(1, $5) g
+        ''', BENCH_USER_BASE, NAMES, TYPES, WORDS, rows)
+    async with queries.get_connection() as conn:
+        await conn.execute('ANALYZE reports')
+
+async def time_queries(name: str, search, repeat: int):
+    latencies = []
+    for _ in range(repeat):
+        for term in TERMS:
+            start = time.perf_counter()
+            await search(term)
+            latencies.append((time.perf_counter() - start) * 1000)
+    print_latencies(name, latencies)
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    await queries.init_pool()
+    await ensure_schema()
+    try:
+        start = time.perf_counter()
+        await fill(args.rows)
+        print(f"inserted {args.rows} reports in {time.perf_counter() - start:.0f}s")
+        await time_queries("ilike", ilike_search, args.repeat)
+        await time_queries("fulltext", queries.search_reports, args.repeat)
+    finally:
+        async with queries.get_connection() as conn, conn.transaction():
+            await conn.execute('SET LOCAL statement_timeout = 0')
+            await conn.execute('DELETE FROM reports WHERE user_id >= $1', BENCH_USER_BASE)
+        await queries.close_pool()
+
+if __name__ == "__main__":
+    asyncio.run(main())
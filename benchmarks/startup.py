@@ -0,0 +1,147 @@
+"""
+Startup time: imports and initialization measured separately.
+
+Imports: `python -X importtime -c "import main"`, the total and the
+heaviest modules main imports directly (best of --runs).
+
+Initialization: starts main.py against the fake Bot API and a scratch
+database <DB_NAME>_startup and, from the moment the process is spawned,
+times the first getUpdates and the answers to a /start and a "Мои
+обращения" press pushed before the bot is up (both wait for the database:
+the FSM state lives there). The bot's own "Startup:" log lines give the
+phases inside the process. Runs once on an empty database (migrations are
+applied during startup) and --runs times on the migrated one.
+
+    python -m benchmarks.startup --runs 3
+"""
+import argparse
+import asyncio
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from config import DB_NAME
+from benchmarks.fake_telegram import FakeTelegram
+from benchmarks.load import ADMIN_GROUP_ID, create_database, drop_database, stop_bot
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USER = {"id": 5_000_001, "is_bot": False, "first_name": "Родитель"}
+CHAT = {"id": USER["id"], "type": "private"}
+
+def bot_env(**overrides) -> dict:
+    return {
+        **os.environ,
+        "BOT_TOKEN": "123456:startup-test",
+        "ADMIN_GROUP_ID": str(ADMIN_GROUP_ID),
+        "BOT_MODE": "polling",
+        "METRICS_PORT": "0",
+        **overrides,
+    }
+
+def measure_imports() -> tuple:
+    """(total seconds, [(module, seconds), ...]) of importing main"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT, env=bot_env(), capture_output=True, text=True, check=True
+    )
+    # A module's line comes after the lines of what it imports: collect the
+    # children of each top-level import until it turns out to be main
+    children = []
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)", line)
+        if not match:
+            continue
+        cumulative, depth, name = int(match.group(1)) / 1e6, len(match.group(2)), match.group(3)
+        if depth == 3:
+            children.append((name, cumulative))
+        elif depth == 1:
+            if name == "main":
+                return cumulative, sorted(children, key=lambda item: -item[1])
+            children = []
+    raise RuntimeError("main not found in -X importtime output")
+
+async def wait_for(predicate, timeout: float) -> float:
+    """perf_counter when predicate() became true"""
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > deadline:
+            raise TimeoutError
+        await asyncio.sleep(0.002)
+    return time.perf_counter()
+
+async def answered(future: asyncio.Future, timeout: float) -> float:
+    await asyncio.wait_for(future, timeout)
+    return time.perf_counter()
+
+async def measure_start(database: str, log_path: str, timeout: float) -> dict:
+    """Seconds from spawning main.py to each milestone, plus the bot's own Startup: lines"""
+    api = FakeTelegram(latency_ms=0, global_limit=0, group_limit=0)
+    runner = await api.start()
+    # Waiting in the queue before the bot starts, like updates during a restart
+    start_answer = api.expect(USER["id"], lambda method, params: method == "sendMessage")
+    api.push_message(USER, CHAT, "/start")
+    callback_id = None
+    list_answer = api.expect("", lambda method, params: params.get("callback_query_id") == callback_id)
+    callback_id = api.push_callback(USER, {"message_id": 1, "date": 0, "chat": CHAT}, "my_requests")
+
+    log = open(log_path, "wb")
+    spawned = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "main.py", cwd=ROOT, stdout=log, stderr=log,
+        env=bot_env(TELEGRAM_API_URL=api.url, DB_NAME=database)
+    )
+    try:
+        polling, start, listed = await asyncio.gather(
+            wait_for(lambda: api.calls["getUpdates"] > 0, timeout),
+            answered(start_answer, timeout),
+            answered(list_answer, timeout),
+        )
+    finally:
+        await stop_bot(process)
+        await runner.cleanup()
+        log.close()
+    result = {
+        "first getUpdates": polling - spawned,
+        "/start answered": start - spawned,
+        "my_requests answered": listed - spawned,
+    }
+    with open(log_path, encoding="utf-8") as f:
+        for match in re.finditer(r"Startup: (.+?) (?:after|in) (\d+) ms", f.read()):
+            result[f"  bot: {match.group(1)}"] = int(match.group(2)) / 1000
+    return result
+
+def print_runs(title: str, runs: list):
+    print(title)
+    for name in runs[0]:
+        values = [run[name] for run in runs if name in run]
+        print(f"  {name:<34} {statistics.median(values) * 1000:8.0f} ms"
+              + (f"  (min {min(values) * 1000:.0f})" if len(values) > 1 else ""))
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for each milestone")
+    parser.add_argument("--database", default=f"{DB_NAME}_startup")
+    parser.add_argument("--log", default="load_bot.log")
+    args = parser.parse_args()
+
+    imports = [measure_imports() for _ in range(args.runs)]
+    total, direct = min(imports, key=lambda item: item[0])
+    print(f"Imports: {total * 1000:.0f} ms for `import main` (best of {args.runs})")
+    for name, seconds in direct[:8]:
+        print(f"  {name:<34} {seconds * 1000:8.0f} ms")
+
+    await create_database(args.database)
+    try:
+        print_runs("Empty database (migrations applied on start):",
+                   [await measure_start(args.database, args.log, args.timeout)])
+        print_runs(f"Migrated database (median of {args.runs}):",
+                   [await measure_start(args.database, args.log, args.timeout) for _ in range(args.runs)])
+    finally:
+        await drop_database(args.database)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,16 @@
+import statistics
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile of a sorted list"""
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+def print_latencies(name: str, latencies: list):
+    """Print p50/p95/p99/mean of latencies in milliseconds"""
+    latencies = sorted(latencies)
+    print(
+        f"{name:>10}: n={len(latencies)} "
+        f"p50={percentile(latencies, 0.50):.1f}ms "
+        f"p95={percentile(latencies, 0.95):.1f}ms "
+        f"p99={percentile(latencies, 0.99):.1f}ms "
+        f"mean={statistics.mean(latencies):.1f}ms"
+    )
@@ -0,0 +1,61 @@
+"""
+Concurrency check for report state transitions.
+
+Many simulated admins call take_report() for the same report at once;
+exactly one must win and every loser must see the winner's name.
+Then all admins race complete_report(): only the winner may complete it.
+
+Run against a scratch database:
+    python -m benchmarks.take_race --admins 50 --rounds 20
+"""
+import argparse
+import asyncio
+
+from db import queries
+from db.migrate import ensure_schema
+
+BENCH_USER_BASE = 10 ** 15
+
+async def race(admins: int):
+    report_id = await queries.save_report(BENCH_USER_BASE, "bench", "Персонал", "race test")
+    worker_ids = [BENCH_USER_BASE + 1 + i for i in range(admins)]
+
+    taken = await asyncio.gather(*(
+        queries.take_report(report_id, worker_id, f"admin-{worker_id}")
+        for worker_id in worker_ids
+    ))
+    winners = [result for result in taken if result.ok]
+    assert len(winners) == 1, f"report #{report_id}: {len(winners)} admins took it"
+    winner = winners[0].report
+    for result in taken:
+        assert result.report['responsible_user_id'] == winner['responsible_user_id'], (
+            f"report #{report_id}: loser saw stale row {result.report}"
+        )
+
+    completed = await asyncio.gather(*(
+        queries.complete_report(report_id, worker_id, "done")
+        for worker_id in worker_ids + [winner['responsible_user_id']] * 3
+    ))
+    completed_ok = [result for result in completed if result.ok]
+    assert len(completed_ok) == 1, f"report #{report_id}: completed {len(completed_ok)} times"
+    assert completed_ok[0].report['responsible_user_id'] == winner['responsible_user_id']
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--admins", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    await queries.init_pool()
+    await ensure_schema()
+    try:
+        for _ in range(args.rounds):
+            await race(args.admins)
+        print(f"OK: {args.rounds} rounds x {args.admins} admins, exactly one winner each time")
+    finally:
+        async with queries.get_connection() as conn:
+            await conn.execute('DELETE FROM reports WHERE user_id >= $1', BENCH_USER_BASE)
+        await queries.close_pool()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+"""
+Replay recorded Telegram updates into the webhook endpoint.
+
+Input is a JSON array or JSON-lines file of Update objects (as returned by
+getUpdates). Each update is posted --repeat times with a fresh update_id,
+--concurrency requests at a time, and the script reports updates/second
+and request latency. Start the bot with WEBHOOK_HANDLE_IN_BACKGROUND=false
+to make request latency equal end-to-end handler latency; in background
+mode the script also waits on /health until all updates are processed.
+
+    python -m benchmarks.webhook_replay updates.jsonl \\
+        --url http://localhost:8080/webhook --secret $WEBHOOK_SECRET --repeat 100
+"""
+import argparse
+import asyncio
+import copy
+import json
+import time
+from urllib.parse import urljoin
+
+import aiohttp
+
+from benchmarks.stats import print_latencies
+
+def load_updates(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        content = f.read().strip()
+    if content.startswith("["):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+async def wait_drained(session: aiohttp.ClientSession, health_url: str):
+    while True:
+        async with session.get(health_url) as response:
+            if (await response.json())["inflight"] == 0:
+                return
+        await asyncio.sleep(0.05)
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("updates", help="JSON or JSONL file with recorded updates")
+    parser.add_argument("--url", default="http://localhost:8080/webhook")
+    parser.add_argument("--secret", required=True)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=40)
+    args = parser.parse_args()
+
+    recorded = load_updates(args.updates)
+    updates = []
+    for i in range(args.repeat):
+        for update in recorded:
+            update = copy.deepcopy(update)
+            update["update_id"] = len(updates) + 1
+            updates.append(update)
+
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    errors = 0
+
+    async with aiohttp.ClientSession(headers=headers) as session:
+        async def post(update):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                async with session.post(args.url, json=update) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(post(update) for update in updates))
+        accepted = time.perf_counter() - start
+        await wait_drained(session, urljoin(args.url, "/health"))
+        processed = time.perf_counter() - start
+
+    print(f"updates: {len(updates)}, errors: {errors}")
+    print(f"accepted: {len(updates) / accepted:.0f} updates/s, processed: {len(updates) / processed:.0f} updates/s")
+    print_latencies("request", latencies)
+
+if __name__ == "__main__":
+    asyncio.run(main())
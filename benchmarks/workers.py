@@ -0,0 +1,88 @@
+"""
+Throughput of supervisor mode with 1, 2, 4… workers.
+
+For each worker count starts main.py with BOT_MODE=supervisor against the
+fake Bot API (flood limits off, the bot's own send limits raised so they
+don't cap the result) and a scratch database <DB_NAME>_workers, warms the
+workers up with a few users, then starts --users users at once with no
+think time and measures how fast their report flows complete. Every flow
+waits for each answer before the next step, so a flow only completes if
+the user's updates were processed in order.
+
+    python -m benchmarks.workers --workers 1 2 4 --users 500
+"""
+import argparse
+import asyncio
+
+from config import DB_NAME
+from benchmarks.fake_telegram import FakeTelegram
+from benchmarks.load import LoadTest, create_database, drop_database, start_bot, stop_bot, free_port
+from benchmarks.stats import print_latencies
+
+# Report flow: /start, category, type, text
+UPDATES_PER_FLOW = 4
+
+def flow_args(users: int, timeout: float, offset: int = 0) -> argparse.Namespace:
+    return argparse.Namespace(users=users, admins=0, ramp=0, think=0, timeout=timeout, drain=0, offset=offset)
+
+class _Users(LoadTest):
+    """LoadTest whose user numbers start at args.offset, so runs don't share users"""
+
+    async def user(self, number: int):
+        await super().user(number + self.args.offset)
+
+async def run(workers: int, args) -> tuple:
+    api = FakeTelegram(args.api_latency, 0.0, 0, 0)
+    runner = await api.start()
+    await create_database(args.database)
+    process = None
+    try:
+        process = await start_bot(
+            api, args.database, 0, args.log,
+            BOT_MODE="supervisor",
+            WORKERS=str(workers),
+            WORKER_BASE_PORT=str(free_port()),
+            SEND_GLOBAL_RATE="100000",
+            SEND_GROUP_RATE="1000000",
+        )
+        # Workers start after the supervisor polls; the warmup waits for all of them
+        await _Users(api, flow_args(args.warmup, 120)).run()
+        test = _Users(api, flow_args(args.users, args.timeout, offset=args.warmup))
+        elapsed = await test.run()
+        return test.stats, elapsed
+    finally:
+        if process is not None:
+            await stop_bot(process)
+        await runner.cleanup()
+        await drop_database(args.database)
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=50, help="users before the measured run")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for one answer")
+    parser.add_argument("--api-latency", type=float, default=40, help="mean Bot API latency, ms")
+    parser.add_argument("--database", default=f"{DB_NAME}_workers")
+    parser.add_argument("--log", default="load_bot.log")
+    args = parser.parse_args()
+
+    results = []
+    for workers in args.workers:
+        stats, elapsed = await run(workers, args)
+        results.append((workers, stats, elapsed))
+        print(f"{workers} workers: {stats.flows_ok}/{args.users} flows in {elapsed:.1f}s")
+        for step in ("start", "category", "type", "text"):
+            if stats.latencies[step]:
+                print_latencies(step, stats.latencies[step])
+
+    print()
+    base = None
+    for workers, stats, elapsed in results:
+        rate = stats.flows_ok * UPDATES_PER_FLOW / elapsed
+        base = base or rate
+        print(f"{workers:>3} workers: {rate:7.0f} updates/s  x{rate / base:.2f}  "
+              f"failed flows {args.users - stats.flows_ok}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,196 @@
+"""
+Announcements from the admin group to the authors of reports (/broadcast).
+
+A broadcast goes to every user with a report in reports_all matching its
+filters, except users in blocked_users. Recipients are read in user_id
+order, BROADCAST_BATCH_SIZE per query (keyset over the user history
+indexes), and handed to the sender at PRIORITY_BROADCAST with at most
+BROADCAST_WINDOW sends outstanding. The sender's shared rate limit and its
+SEND_CONCURRENCY parallel deliveries set the throughput, and everything
+else the bot sends overtakes the broadcast.
+
+Every BROADCAST_CHECKPOINT_INTERVAL seconds the runner saves the counters
+and the user_id up to which all sends are finished, and renews its lease.
+If the process dies, another one (or this one after a restart) claims the
+broadcast when the lease runs out and continues after the checkpoint: a
+few users may get the message twice, none is skipped. Users Telegram
+reports as unreachable (bot blocked, account deleted) go to blocked_users
+and later broadcasts leave them out.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Optional
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.methods import EditMessageText, SendMessage
+from config import (
+    BROADCAST_WINDOW,
+    BROADCAST_BATCH_SIZE,
+    BROADCAST_CHECKPOINT_INTERVAL,
+    BROADCAST_PROGRESS_INTERVAL,
+    BROADCAST_LEASE,
+)
+from db.queries import checkpoint_broadcast, claim_broadcast, get_broadcast_recipients
+from keyboards.inline_kb import get_broadcast_stop_keyboard
+from metrics import BROADCAST_MESSAGES, BROADCASTS_RUNNING
+from sender import send, PRIORITY_ADMIN, PRIORITY_BROADCAST
+import render
+
+# broadcast_id -> runner task of broadcasts sent by this process
+_running = {}
+
+def unreachable_reason(error: Exception) -> Optional[str]:
+    """Why a failed send means the user can't get messages from the bot, None for other failures"""
+    if isinstance(error, TelegramForbiddenError):
+        # Bot blocked by the user, user deactivated
+        return error.message
+    if isinstance(error, TelegramBadRequest) and "chat not found" in error.message.lower():
+        return error.message
+    return None
+
+class _Progress:
+    """Counters since the last checkpoint and the progress message state"""
+
+    def __init__(self, broadcast: dict):
+        self.broadcast = broadcast
+        self.checkpoint = broadcast['last_user_id']
+        self.sent = self.failed = 0
+        self.blocked = []
+        self.started = time.monotonic()
+        # Deliveries finished by this run, for the rate
+        self.finished = 0
+        self.shown = None
+
+    def record(self, user_id: int, future: asyncio.Future):
+        error = future.exception()
+        if error is None:
+            self.sent += 1
+            BROADCAST_MESSAGES.inc(result="sent")
+        else:
+            reason = unreachable_reason(error)
+            if reason is not None:
+                self.blocked.append((user_id, reason))
+                BROADCAST_MESSAGES.inc(result="blocked")
+            else:
+                self.failed += 1
+                BROADCAST_MESSAGES.inc(result="failed")
+                logging.warning(f"Broadcast {self.broadcast['id']} to {user_id} failed: {error!r}")
+        self.checkpoint = user_id
+        self.finished += 1
+
+    async def save(self, done: bool = False) -> dict:
+        """Write the checkpoint, renew the lease; the broadcast as stored"""
+        self.broadcast = await checkpoint_broadcast(
+            self.broadcast['id'], self.checkpoint, self.sent, self.failed, self.blocked, BROADCAST_LEASE, done
+        )
+        self.sent = self.failed = 0
+        self.blocked = []
+        return self.broadcast
+
+    def show(self):
+        """Edit the progress message (skipped when its text wouldn't change)"""
+        broadcast = self.broadcast
+        if broadcast['progress_message_id'] is None:
+            return
+        elapsed = time.monotonic() - self.started
+        text = render.broadcast_progress(broadcast, self.finished / elapsed if elapsed > 0 else None)
+        if text == self.shown:
+            return
+        self.shown = text
+        running = broadcast['status'] == 'running'
+        send(EditMessageText(
+            chat_id=broadcast['chat_id'], message_id=broadcast['progress_message_id'], text=text,
+            reply_markup=get_broadcast_stop_keyboard(broadcast['id']) if running else None
+        ), PRIORITY_ADMIN)
+
+async def run_broadcast(broadcast: dict):
+    """Send a broadcast held by this process from its checkpoint to the end or until it is stopped"""
+    progress = _Progress(broadcast)
+    # Sends in user_id order with their futures, and recipients read but not queued yet
+    window = deque()
+    recipients = deque()
+    after = broadcast['last_user_id']
+    exhausted = stopped = False
+    next_checkpoint = time.monotonic() + BROADCAST_CHECKPOINT_INTERVAL
+    next_progress = time.monotonic() + BROADCAST_PROGRESS_INTERVAL
+
+    while True:
+        while not stopped and len(window) < BROADCAST_WINDOW:
+            if not recipients:
+                if exhausted:
+                    break
+                batch = await get_broadcast_recipients(broadcast['filters'], after, BROADCAST_BATCH_SIZE)
+                exhausted = len(batch) < BROADCAST_BATCH_SIZE
+                if not batch:
+                    break
+                after = batch[-1]
+                recipients.extend(batch)
+            user_id = recipients.popleft()
+            future = send(SendMessage(chat_id=user_id, text=broadcast['text']), PRIORITY_BROADCAST, log_failure=False)
+            # Outcomes are read in order; don't warn about ones left behind on shutdown
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            window.append((user_id, future))
+        if not window:
+            break
+
+        await asyncio.wait([window[0][1]], timeout=max(0.0, next_checkpoint - time.monotonic()))
+        # Only a finished prefix moves the checkpoint: a send still queued
+        # (e.g. waiting out flood control) holds back the ones after it
+        while window and window[0][1].done():
+            user_id, future = window.popleft()
+            progress.record(user_id, future)
+
+        now = time.monotonic()
+        if now >= next_checkpoint:
+            next_checkpoint = now + BROADCAST_CHECKPOINT_INTERVAL
+            if (await progress.save())['status'] != 'running' and not stopped:
+                # Stopped from the progress message: the queued sends still go out
+                stopped = True
+                logging.info(f"Broadcast {broadcast['id']} stopped, {len(window)} messages still queued")
+            if now >= next_progress:
+                next_progress = now + BROADCAST_PROGRESS_INTERVAL
+                progress.show()
+
+    broadcast = await progress.save(done=True)
+    progress.show()
+    logging.info(
+        f"Broadcast {broadcast['id']} {broadcast['status']}: {broadcast['sent']} sent, "
+        f"{broadcast['blocked']} unreachable, {broadcast['failed']} failed of {broadcast['total']}"
+    )
+
+async def _run(broadcast: dict):
+    try:
+        await run_broadcast(broadcast)
+    except Exception:
+        # Resumed from the checkpoint once the lease runs out
+        logging.exception(f"Broadcast {broadcast['id']} failed")
+    finally:
+        _running.pop(broadcast['id'], None)
+
+def start_broadcast(broadcast: dict) -> asyncio.Task:
+    """Run a broadcast this process holds the lease of (created or claimed by it)"""
+    task = asyncio.create_task(_run(broadcast))
+    _running[broadcast['id']] = task
+    return task
+
+async def _claim_loop():
+    try:
+        while True:
+            try:
+                while (broadcast := await claim_broadcast(BROADCAST_LEASE)) is not None:
+                    if broadcast['id'] in _running:
+                        continue
+                    logging.info(f"Resuming broadcast {broadcast['id']} after user {broadcast['last_user_id']}")
+                    start_broadcast(broadcast)
+            except Exception:
+                logging.exception("Failed to claim broadcasts")
+            await asyncio.sleep(BROADCAST_LEASE / 2)
+    finally:
+        for task in list(_running.values()):
+            task.cancel()
+
+def start_broadcasts() -> asyncio.Task:
+    """Resume broadcasts left by stopped processes; cancelling the task stops this process's broadcasts"""
+    BROADCASTS_RUNNING.set_function(lambda: len(_running))
+    return asyncio.create_task(_claim_loop())
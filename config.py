@@ -28,6 +28,145 @@ DB_PASSWORD = os.getenv("DB_PASSWORD", "")
 # Build PostgreSQL connection string
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+# Connection pool settings
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", "5"))  # seconds
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "5000"))  # milliseconds
+# The bot takes updates before the pool is up and the schema checked; queries
+# wait for that up to DB_READY_TIMEOUT seconds
+DB_READY_TIMEOUT = float(os.getenv("DB_READY_TIMEOUT", "30"))
+
+# In-process cache of report lookups
+CACHE_TTL = float(os.getenv("CACHE_TTL", "30"))  # seconds
+CACHE_MAX_REPORTS = int(os.getenv("CACHE_MAX_REPORTS", "10000"))
+CACHE_MAX_USERS = int(os.getenv("CACHE_MAX_USERS", "5000"))
+# Open reports loaded into the cache at startup, 0 to disable
+CACHE_WARM_REPORTS = int(os.getenv("CACHE_WARM_REPORTS", "1000"))
+# Invalidate on changes made by other bot processes (PostgreSQL LISTEN/NOTIFY)
+CACHE_LISTEN = os.getenv("CACHE_LISTEN", "true").lower() == "true"
+
+# Apply pending schema migrations on startup (otherwise run: python -m db.migrate)
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "true").lower() == "true"
+
+# Reminder escalation tiers: hours after creation for a still pending report
+REMINDER_TIERS_HOURS = [float(h) for h in os.getenv("REMINDER_TIERS_HOURS", "1,4,24").split(",")]
+
+# Report guard (middlewares/report_guard.py): each user may send
+# REPORT_RATE_LIMIT reports per REPORT_RATE_PERIOD seconds; a report whose
+# text is at least DUPLICATE_THRESHOLD similar (estimated Jaccard of character
+# shingles) to one of the user's DUPLICATE_HISTORY latest reports within
+# DUPLICATE_WINDOW seconds is merged into it. State for up to
+# REPORT_GUARD_MAX_USERS users is kept in memory.
+REPORT_RATE_LIMIT = int(os.getenv("REPORT_RATE_LIMIT", "5"))
+REPORT_RATE_PERIOD = float(os.getenv("REPORT_RATE_PERIOD", "600"))
+DUPLICATE_THRESHOLD = float(os.getenv("DUPLICATE_THRESHOLD", "0.8"))  # 0 disables duplicate merging
+DUPLICATE_WINDOW = float(os.getenv("DUPLICATE_WINDOW", "86400"))
+DUPLICATE_HISTORY = int(os.getenv("DUPLICATE_HISTORY", "5"))
+REPORT_GUARD_MAX_USERS = int(os.getenv("REPORT_GUARD_MAX_USERS", "10000"))
+
+# Assignment of new reports (assignment.py): staff, their skills (report
+# types) and working hours are listed in ASSIGNMENT_STAFF_FILE (JSON, empty
+# disables assignment). A report goes to the on-shift staff member with the
+# fewest open reports; the admin group gets it only if they don't take it
+# within ASSIGNMENT_SLA seconds. Nobody gets more than ASSIGNMENT_MAX_OPEN
+# open reports (0 = no limit). Open report counts are re-read from the
+# database every ASSIGNMENT_REFRESH_INTERVAL seconds.
+ASSIGNMENT_STAFF_FILE = os.getenv("ASSIGNMENT_STAFF_FILE", "")
+ASSIGNMENT_SLA = float(os.getenv("ASSIGNMENT_SLA", "900"))
+ASSIGNMENT_MAX_OPEN = int(os.getenv("ASSIGNMENT_MAX_OPEN", "0"))
+ASSIGNMENT_REFRESH_INTERVAL = float(os.getenv("ASSIGNMENT_REFRESH_INTERVAL", "60"))
+
+# Report attachments (attachments.py): album parts arriving within
+# ALBUM_WAIT seconds of the first make one report. With
+# ATTACHMENT_ARCHIVE_DIR set, files are also downloaded there in the
+# background, ATTACHMENT_DOWNLOAD_CONCURRENCY at a time.
+ALBUM_WAIT = float(os.getenv("ALBUM_WAIT", "1.0"))
+ATTACHMENT_ARCHIVE_DIR = os.getenv("ATTACHMENT_ARCHIVE_DIR", "")
+ATTACHMENT_DOWNLOAD_CONCURRENCY = int(os.getenv("ATTACHMENT_DOWNLOAD_CONCURRENCY", "2"))
+ATTACHMENT_DOWNLOAD_ATTEMPTS = int(os.getenv("ATTACHMENT_DOWNLOAD_ATTEMPTS", "5"))
+
+# Completed reports older than ARCHIVE_AFTER_DAYS move to reports_archive (0 disables)
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "3600"))  # seconds between archive runs
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))  # reports moved per transaction
+ARCHIVE_BATCH_PAUSE = float(os.getenv("ARCHIVE_BATCH_PAUSE", "0.5"))  # seconds between batches
+
+# /export documents larger than this are sent in parts (Telegram bots can upload up to 50 MB)
+EXPORT_DOCUMENT_SIZE_MB = float(os.getenv("EXPORT_DOCUMENT_SIZE_MB", "45"))
+
+# Admin group digests: "burst" sends reports one by one until more than
+# DIGEST_BURST_THRESHOLD arrive within DIGEST_WINDOW, then merges them;
+# "window" always merges per window; "off" sends every report separately
+DIGEST_MODE = os.getenv("DIGEST_MODE", "burst")
+DIGEST_WINDOW = float(os.getenv("DIGEST_WINDOW", "30"))  # seconds
+DIGEST_BURST_THRESHOLD = int(os.getenv("DIGEST_BURST_THRESHOLD", "5"))
+DIGEST_MAX_REPORTS = int(os.getenv("DIGEST_MAX_REPORTS", "10"))  # reports per digest message
+
+# Outgoing message rate limits (Telegram: ~30 msg/s overall, 20 msg/min per group)
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))  # messages per second
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE", "20"))  # messages per minute per group
+SEND_PRIVATE_RATE = float(os.getenv("SEND_PRIVATE_RATE", "1"))  # messages per second per private chat
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "10"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "5"))
+SEND_MAX_FLOOD_RETRIES = int(os.getenv("SEND_MAX_FLOOD_RETRIES", "10"))  # RetryAfter answers before giving up
+
+# Notification outbox (outbox.py): rows delivered per batch, seconds a claimed
+# row waits for delivery before it is claimed again, attempts before it is
+# marked failed, days delivered rows are kept
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))  # seconds, picks up retries and other processes' rows
+OUTBOX_LEASE = float(os.getenv("OUTBOX_LEASE", "300"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_KEEP_DAYS = int(os.getenv("OUTBOX_KEEP_DAYS", "7"))
+
+# Broadcasts (/broadcast): messages per second, below SEND_GLOBAL_RATE to leave room for
+# handlers that answer directly; sends queued at a time, recipients read per query,
+# seconds between progress saves and progress message edits
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_WINDOW = int(os.getenv("BROADCAST_WINDOW", "100"))
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "1000"))
+BROADCAST_CHECKPOINT_INTERVAL = float(os.getenv("BROADCAST_CHECKPOINT_INTERVAL", "2"))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "10"))
+# Seconds without a saved checkpoint after which another process resumes a broadcast
+BROADCAST_LEASE = float(os.getenv("BROADCAST_LEASE", "60"))
+
+# FSM storage: "postgres" (shared with the reports DB), "redis" or "memory"
+FSM_STORAGE = os.getenv("FSM_STORAGE", "postgres")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", str(24 * 3600)))  # seconds until an abandoned state is dropped
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "0.05"))  # seconds to batch writes, 0 = write-through
+
+# Update delivery: "polling" or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Supervisor mode (BOT_MODE=supervisor): one process receives updates
+# (SUPERVISOR_INGRESS "polling" or "webhook") and routes them by user to
+# WORKERS bot processes listening on 127.0.0.1:WORKER_BASE_PORT+i
+WORKERS = int(os.getenv("WORKERS") or os.cpu_count() or 2)
+SUPERVISOR_INGRESS = os.getenv("SUPERVISOR_INGRESS", "polling")
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8100"))
+# Set by the supervisor for each worker process
+WORKER_ID = int(os.getenv("WORKER_ID", "0"))
+WORKER_SECRET = os.getenv("WORKER_SECRET", "")
+# Bot API server base URL, empty for api.telegram.org (a local Bot API server or the load test's fake one)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # public base URL, e.g. https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+# Answer Telegram right away and process the update in a task (false: answer after the handler)
+WEBHOOK_HANDLE_IN_BACKGROUND = os.getenv("WEBHOOK_HANDLE_IN_BACKGROUND", "true").lower() == "true"
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))  # seconds
+
+# Prometheus metrics endpoint (0 disables it)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+# Sampling profiler for slow updates, can also be switched on at runtime via POST /debug/profiler
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() == "true"
+PROFILER_INTERVAL = float(os.getenv("PROFILER_INTERVAL", "0.005"))  # seconds between stack samples
+PROFILER_KEEP = int(os.getenv("PROFILER_KEEP", "20"))  # slowest updates to keep
+
 # Validate required configuration
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN is required! Please set it in .env file")
@@ -35,3 +174,16 @@ if not ADMIN_GROUP_ID:
     raise ValueError("ADMIN_GROUP_ID is required! Please set it in .env file")
 if not DB_PASSWORD:
     raise ValueError("DB_PASSWORD is required! Please set it in .env file")
+if FSM_STORAGE not in ("postgres", "redis", "memory"):
+    raise ValueError("FSM_STORAGE must be 'postgres', 'redis' or 'memory'")
+if DIGEST_MODE not in ("burst", "window", "off"):
+    raise ValueError("DIGEST_MODE must be 'burst', 'window' or 'off'")
+if BOT_MODE not in ("polling", "webhook", "supervisor", "worker"):
+    raise ValueError("BOT_MODE must be 'polling', 'webhook', 'supervisor' or 'worker'")
+if SUPERVISOR_INGRESS not in ("polling", "webhook"):
+    raise ValueError("SUPERVISOR_INGRESS must be 'polling' or 'webhook'")
+if WORKERS < 1:
+    raise ValueError("WORKERS must be at least 1")
+if (BOT_MODE == "webhook" or (BOT_MODE == "supervisor" and SUPERVISOR_INGRESS == "webhook")) \
+        and not (WEBHOOK_URL and WEBHOOK_SECRET):
+    raise ValueError("WEBHOOK_URL and WEBHOOK_SECRET are required in webhook mode! Please set them in .env file")
@@ -0,0 +1,207 @@
+"""
+Bulk export and import of reports.
+
+Export streams rows with COPY ... TO STDOUT straight into the output, so
+memory use doesn't depend on the table size. Parquet (needs pyarrow) is
+written in record batches from a server-side cursor. Import loads the file
+into a temporary table with COPY FROM and inserts the rows that aren't in
+reports or the archive yet, keeping their ids.
+
+    python -m db.bulk export reports.csv --status completed --since 2024-09-01
+    python -m db.bulk export reports.jsonl --until 2025-01-01
+    python -m db.bulk import old_reports.csv
+"""
+import argparse
+import asyncio
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+from db.queries import init_pool, close_pool, get_connection, REPORT_COLUMNS
+
+FORMATS = ("csv", "jsonl", "parquet")
+
+# Columns in file order
+COLUMNS = [column.strip() for column in REPORT_COLUMNS.split(",")]
+
+# Rows per Parquet record batch
+PARQUET_BATCH_ROWS = 10000
+
+# JSONL lines go through COPY as single-column CSV with quote/delimiter
+# characters that never occur in row_to_json output (control characters are
+# escaped there), so each line comes out byte for byte, without quoting
+_JSONL_COPY_OPTIONS = {"format": "csv", "quote": "\x01", "delimiter": "\x02"}
+
+def format_from_path(path: str) -> str:
+    suffix = Path(path).suffix.lstrip(".").lower()
+    if suffix not in FORMATS:
+        raise ValueError(f"Unknown format '{suffix}', expected one of {', '.join(FORMATS)}")
+    return suffix
+
+def _filters(since: Optional[datetime], until: Optional[datetime], status: Optional[str], report_type: Optional[str]):
+    conditions, args = [], []
+    for condition, value in (
+        ("created_at >= ${}", since),
+        ("created_at < ${}", until),
+        ("status = ${}", status),
+        ("report_type = ${}", report_type),
+    ):
+        if value is not None:
+            args.append(value)
+            conditions.append(condition.format(len(args)))
+    return " AND ".join(conditions) or "TRUE", args
+
+async def export_reports(
+    output,
+    fmt: str = "csv",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    status: Optional[str] = None,
+    report_type: Optional[str] = None,
+) -> int:
+    """Write matching reports to output (path, binary file or async callback taking bytes).
+
+    Returns the number of exported rows.
+    """
+    where, args = _filters(since, until, status, report_type)
+    query = f"SELECT {REPORT_COLUMNS} FROM reports_all WHERE {where} ORDER BY id"
+
+    async with get_connection() as conn:
+        async with conn.transaction():
+            await conn.execute("SET LOCAL statement_timeout = 0")
+            if fmt == "csv":
+                result = await conn.copy_from_query(query, *args, output=output, format="csv", header=True)
+            elif fmt == "jsonl":
+                result = await conn.copy_from_query(
+                    f"SELECT row_to_json(r)::text FROM ({query}) r", *args,
+                    output=output, **_JSONL_COPY_OPTIONS
+                )
+            elif fmt == "parquet":
+                return await _export_parquet(conn, query, args, output)
+            else:
+                raise ValueError(f"Unknown format '{fmt}'")
+    # COPY status is "COPY <rows>"
+    return int(result.split()[-1])
+
+async def _export_parquet(conn, query: str, args: list, output) -> int:
+    # Optional dependency: pip install pyarrow
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("id", pa.int32()), ("user_id", pa.int64()), ("user_name", pa.string()),
+        ("report_type", pa.string()), ("report_text", pa.string()), ("status", pa.string()),
+        ("responsible_user_id", pa.int64()), ("responsible_user_name", pa.string()),
+        ("admin_response", pa.string()), ("created_at", pa.timestamp("us")),
+        ("taken_at", pa.timestamp("us")), ("completed_at", pa.timestamp("us")),
+        ("reminder_tier", pa.int16()), ("duplicate_count", pa.int32()),
+        ("assigned_user_id", pa.int64()), ("attachment_count", pa.int16()),
+    ])
+    rows = 0
+    with pq.ParquetWriter(output, schema) as writer:
+        batch = []
+        async for record in conn.cursor(query, *args, prefetch=PARQUET_BATCH_ROWS):
+            batch.append(dict(record))
+            if len(batch) >= PARQUET_BATCH_ROWS:
+                writer.write_batch(pa.RecordBatch.from_pylist(batch, schema))
+                rows += len(batch)
+                batch = []
+        if batch:
+            writer.write_batch(pa.RecordBatch.from_pylist(batch, schema))
+            rows += len(batch)
+    return rows
+
+async def import_reports(source, fmt: str = "csv") -> int:
+    """Load reports from source (path or binary file) exported by export_reports.
+
+    Rows whose id already exists are skipped. Returns the number of inserted rows.
+    """
+    columns = ", ".join(COLUMNS)
+    async with get_connection() as conn:
+        async with conn.transaction():
+            await conn.execute("SET LOCAL statement_timeout = 0")
+            await conn.execute(f'''
+                CREATE TEMP TABLE reports_import ON COMMIT DROP AS
+                SELECT {columns} FROM reports WITH NO DATA
+            ''')
+
+            if fmt == "csv":
+                await conn.copy_to_table("reports_import", source=source, columns=COLUMNS, format="csv", header=True)
+            elif fmt == "jsonl":
+                await conn.execute("CREATE TEMP TABLE reports_import_json (line jsonb) ON COMMIT DROP")
+                await conn.copy_to_table("reports_import_json", source=source, **_JSONL_COPY_OPTIONS)
+                await conn.execute(f'''
+                    INSERT INTO reports_import
+                    SELECT {columns} FROM reports_import_json,
+                         jsonb_populate_record(NULL::reports_import, line)
+                ''')
+            elif fmt == "parquet":
+                # Optional dependency: pip install pyarrow
+                import pyarrow.parquet as pq
+                parquet = pq.ParquetFile(source)
+                for batch in parquet.iter_batches(batch_size=PARQUET_BATCH_ROWS, columns=COLUMNS):
+                    records = zip(*(batch.column(name).to_pylist() for name in COLUMNS))
+                    await conn.copy_records_to_table("reports_import", records=records, columns=COLUMNS)
+            else:
+                raise ValueError(f"Unknown format '{fmt}'")
+
+            await conn.execute('''
+                DELETE FROM reports_import i USING reports_all r WHERE r.id = i.id
+            ''')
+            result = await conn.execute(f'''
+                INSERT INTO reports ({columns}) SELECT {columns} FROM reports_import
+            ''')
+            # Statistics: the trigger counts inserts, taken/completed
+            # durations of historical rows are recorded here
+            await conn.execute('''
+                DO $$
+                BEGIN
+                    PERFORM report_stats_record('taken', r)
+                    FROM reports r JOIN reports_import USING (id) WHERE r.taken_at IS NOT NULL;
+                    PERFORM report_stats_record('completed', r)
+                    FROM reports r JOIN reports_import USING (id) WHERE r.completed_at IS NOT NULL;
+                END
+                $$
+            ''')
+            # Imported ids must not be handed out again
+            await conn.execute('''
+                SELECT setval(pg_get_serial_sequence('reports', 'id'), MAX(id))
+                FROM reports_import
+                HAVING MAX(id) >= nextval(pg_get_serial_sequence('reports', 'id'))
+            ''')
+    # INSERT status is "INSERT 0 <rows>"
+    return int(result.split()[-1])
+
+def _parse_date(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = sub.add_parser("export", help="export reports to a file")
+    export_parser.add_argument("path", help="output file (.csv, .jsonl or .parquet)")
+    export_parser.add_argument("--format", choices=FORMATS, help="defaults to the file extension")
+    export_parser.add_argument("--since", type=_parse_date, help="created at or after (ISO date)")
+    export_parser.add_argument("--until", type=_parse_date, help="created before (ISO date)")
+    export_parser.add_argument("--status", choices=("pending", "in_progress", "completed"))
+    export_parser.add_argument("--type", dest="report_type")
+
+    import_parser = sub.add_parser("import", help="import reports from a file")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--format", choices=FORMATS, help="defaults to the file extension")
+    args = parser.parse_args()
+
+    fmt = args.format or format_from_path(args.path)
+    await init_pool()
+    try:
+        if args.command == "export":
+            rows = await export_reports(args.path, fmt, args.since, args.until, args.status, args.report_type)
+            print(f"Exported {rows} reports to {args.path}")
+        else:
+            rows = await import_reports(args.path, fmt)
+            print(f"Imported {rows} reports from {args.path}")
+    finally:
+        await close_pool()
+
+if __name__ == "__main__":
+    asyncio.run(main())
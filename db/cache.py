@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+import asyncpg
+from config import DATABASE_URL, CACHE_TTL, CACHE_MAX_REPORTS, CACHE_MAX_USERS
+from metrics import CACHE_REQUESTS
+
+# Channel of the reports_notify_change trigger (db/migrations/008_report_notify.sql)
+CHANNEL = "report_changes"
+
+# Seconds between reconnect attempts of the LISTEN connection
+RECONNECT_DELAY = 5
+
+class TTLCache:
+    """LRU cache whose entries also expire after ttl seconds.
+
+    Reads that race with a write are handled with a generation counter:
+    take generation() before querying the database and pass it to put(), the
+    value is dropped if anything was invalidated in between.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._generation = 0
+
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, key):
+        """Cached value or None"""
+        entry = self._data.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._data.move_to_end(key)
+            CACHE_REQUESTS.inc(cache=self.name, result="hit")
+            return entry[1]
+        if entry is not None:
+            del self._data[key]
+        CACHE_REQUESTS.inc(cache=self.name, result="miss")
+        return None
+
+    def put(self, key, value, generation: int):
+        if generation != self._generation or self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._generation += 1
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._generation += 1
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+# report_id -> report dict (get_report)
+report_cache = TTLCache("report", CACHE_MAX_REPORTS, CACHE_TTL)
+# user_id -> first page of the user's reports (get_user_reports)
+user_reports_cache = TTLCache("user_reports", CACHE_MAX_USERS, CACHE_TTL)
+
+def invalidate_report(report_id: int, user_id: int = None):
+    """Forget a changed report and, if known, its author's list"""
+    report_cache.invalidate(report_id)
+    if user_id is not None:
+        user_reports_cache.invalidate(user_id)
+
+def clear_all():
+    report_cache.clear()
+    user_reports_cache.clear()
+
+def _on_notify(connection, pid, channel, payload: str):
+    report_id, _, user_id = payload.partition(":")
+    invalidate_report(int(report_id), int(user_id) if user_id else None)
+
+async def _listen():
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(DATABASE_URL)
+            closed = asyncio.Event()
+            conn.add_termination_listener(lambda _: closed.set())
+            await conn.add_listener(CHANNEL, _on_notify)
+            # Changes made while we weren't listening are unknown
+            clear_all()
+            logging.info(f"Listening for report changes on '{CHANNEL}'")
+            await closed.wait()
+            logging.warning("Report change listener disconnected")
+        except asyncio.CancelledError:
+            if conn is not None:
+                await conn.close()
+            raise
+        except Exception:
+            logging.exception("Report change listener failed")
+        await asyncio.sleep(RECONNECT_DELAY)
+
+def start_cache_listener() -> asyncio.Task:
+    """Keep caches consistent with writes of other bot processes"""
+    return asyncio.create_task(_listen())
@@ -0,0 +1,159 @@
+"""
+Versioned schema migrations.
+
+Migrations are numbered SQL files in db/migrations (NNN_name.sql) applied in
+order, each recorded in schema_migrations. A file is applied in one
+transaction unless its first line is "-- migrate: no-transaction", then its
+statements (separated by ";" at the end of a line) run one by one, which is
+required for CREATE INDEX CONCURRENTLY.
+
+    python -m db.migrate            # apply pending migrations
+    python -m db.migrate --dry-run  # list pending migrations and their SQL
+    python -m db.migrate --check    # exit with 1 if migrations are pending
+"""
+import argparse
+import asyncio
+import logging
+import re
+import sys
+from pathlib import Path
+from typing import List, NamedTuple
+import asyncpg
+from config import DATABASE_URL, DB_AUTO_MIGRATE
+from db.queries import get_pool
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+NO_TRANSACTION_MARKER = "-- migrate: no-transaction"
+
+# Key of the advisory lock held while migrating, so two starting bots don't race
+MIGRATION_LOCK_ID = 7_142_001
+# Seconds between attempts to take it
+MIGRATION_LOCK_POLL = 0.5
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    sql: str
+
+    @property
+    def transactional(self) -> bool:
+        return not self.sql.startswith(NO_TRANSACTION_MARKER)
+
+    def statements(self) -> List[str]:
+        """Statements of a no-transaction migration"""
+        parts = re.split(r";\s*\n", self.sql)
+        return [part.strip() for part in parts if _strip_comments(part)]
+
+def _strip_comments(sql: str) -> str:
+    return "\n".join(line for line in sql.splitlines() if not line.strip().startswith("--")).strip()
+
+def load_migrations() -> List[Migration]:
+    """Migrations from MIGRATIONS_DIR sorted by version"""
+    migrations = []
+    for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+        version, _, name = path.stem.partition("_")
+        migrations.append(Migration(int(version), name, path.read_text(encoding="utf-8")))
+
+    versions = [m.version for m in migrations]
+    if len(set(versions)) != len(versions):
+        raise RuntimeError(f"Duplicate migration versions in {MIGRATIONS_DIR}")
+    return migrations
+
+async def get_schema_version(conn) -> int:
+    """Latest applied migration version, 0 for an empty database"""
+    try:
+        return await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    except asyncpg.UndefinedTableError:
+        return 0
+
+async def _apply(conn, migration: Migration):
+    logging.info(f"Applying migration {migration.version:03d}_{migration.name}")
+    if migration.transactional:
+        async with conn.transaction():
+            await conn.execute(migration.sql)
+            await conn.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+                migration.version, migration.name
+            )
+        return
+
+    # Statements must be idempotent (IF NOT EXISTS): if one fails, the
+    # migration is not recorded and runs again from the start
+    for statement in migration.statements():
+        await conn.execute(statement)
+    await conn.execute(
+        "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+        migration.version, migration.name
+    )
+
+async def migrate(dry_run: bool = False) -> List[Migration]:
+    """Apply pending migrations, return them"""
+    migrations = load_migrations()
+    # Own connection: migrations must not be cut off by the pool's statement_timeout
+    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        # Polled rather than waited for: a session blocked in pg_advisory_lock()
+        # is a transaction that CREATE INDEX CONCURRENTLY in the migrating
+        # session would wait for, a deadlock
+        while not await conn.fetchval("SELECT pg_try_advisory_lock($1)", MIGRATION_LOCK_ID):
+            await asyncio.sleep(MIGRATION_LOCK_POLL)
+        try:
+            current = await get_schema_version(conn)
+            pending = [m for m in migrations if m.version > current]
+            if pending and not dry_run:
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INT PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                    )
+                ''')
+                for migration in pending:
+                    await _apply(conn, migration)
+            return pending
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+    finally:
+        await conn.close()
+
+async def ensure_schema():
+    """Startup check: one query when the schema is up to date
+
+    Pending migrations are applied if DB_AUTO_MIGRATE is on, otherwise the
+    bot refuses to start until `python -m db.migrate` is run.
+    """
+    latest = max((m.version for m in load_migrations()), default=0)
+    # Runs before the readiness gate opens: straight from the pool
+    async with get_pool().acquire() as conn:
+        current = await get_schema_version(conn)
+    if current >= latest:
+        return
+
+    if not DB_AUTO_MIGRATE:
+        raise RuntimeError("Database schema is out of date, run: python -m db.migrate")
+    applied = await migrate()
+    logging.info(f"Applied {len(applied)} migrations")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--dry-run", action="store_true", help="show pending migrations without applying them")
+    mode.add_argument("--check", action="store_true", help="exit with code 1 if migrations are pending")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    pending = await migrate(dry_run=args.dry_run or args.check)
+
+    if not pending:
+        print("Schema is up to date")
+        return
+    for migration in pending:
+        suffix = "" if migration.transactional else " (no transaction)"
+        print(f"{'Pending' if args.dry_run or args.check else 'Applied'}: {migration.version:03d}_{migration.name}{suffix}")
+        if args.dry_run:
+            print(migration.sql)
+    if args.check:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,31 @@
+CREATE TABLE IF NOT EXISTS reports (
+    id SERIAL PRIMARY KEY,
+
+    -- User info
+    user_id BIGINT NOT NULL,
+    user_name TEXT NOT NULL,
+
+    -- Report details
+    report_type TEXT NOT NULL,
+    report_text TEXT NOT NULL,
+
+    -- Status tracking
+    status TEXT DEFAULT 'pending',
+
+    -- Responsible person
+    responsible_user_id BIGINT,
+    responsible_user_name TEXT,
+
+    -- Response
+    admin_response TEXT,
+
+    -- Timestamps
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    taken_at TIMESTAMP,
+    completed_at TIMESTAMP
+);
+
+-- Indexes for faster queries
+CREATE INDEX IF NOT EXISTS idx_reports_user_id ON reports(user_id);
+CREATE INDEX IF NOT EXISTS idx_reports_status ON reports(status);
+CREATE INDEX IF NOT EXISTS idx_reports_responsible ON reports(responsible_user_id);
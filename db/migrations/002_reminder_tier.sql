@@ -0,0 +1,2 @@
+-- Highest reminder tier already sent for a pending report
+ALTER TABLE reports ADD COLUMN IF NOT EXISTS reminder_tier SMALLINT NOT NULL DEFAULT 0;
@@ -0,0 +1,9 @@
+-- Full-text search: weighted Russian tsvector kept up to date by PostgreSQL
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE reports ADD COLUMN IF NOT EXISTS search_vector tsvector
+GENERATED ALWAYS AS (
+    setweight(to_tsvector('russian', coalesce(report_type, '')), 'A') ||
+    setweight(to_tsvector('russian', coalesce(user_name, '')), 'B') ||
+    setweight(to_tsvector('russian', coalesce(report_text, '')), 'C')
+) STORED;
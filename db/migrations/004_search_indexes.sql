@@ -0,0 +1,4 @@
+-- migrate: no-transaction
+-- Search indexes, plus trigram index for fuzzy name matches
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reports_search ON reports USING GIN (search_vector);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reports_user_name_trgm ON reports USING GIN (user_name gin_trgm_ops);
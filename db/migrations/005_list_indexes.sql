@@ -0,0 +1,6 @@
+-- migrate: no-transaction
+-- Composite indexes for keyset-paginated lists
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reports_status_created
+ON reports(status, created_at DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reports_user_created
+ON reports(user_id, created_at DESC, id DESC);
@@ -0,0 +1,105 @@
+-- Counters and hourly rollups maintained by a trigger on reports, so /stats
+-- reads a few small rows instead of scanning the whole table
+CREATE TABLE IF NOT EXISTS report_status_counts (
+    status TEXT PRIMARY KEY,
+    total BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS report_stats_hourly (
+    hour TIMESTAMP NOT NULL,
+    report_type TEXT NOT NULL,
+    worker_id BIGINT NOT NULL,  -- 0 for 'created' counts
+    worker_name TEXT,
+    created INT NOT NULL DEFAULT 0,
+    taken INT NOT NULL DEFAULT 0,
+    completed INT NOT NULL DEFAULT 0,
+    take_hist INT[] NOT NULL DEFAULT array_fill(0, ARRAY[15]),
+    complete_hist INT[] NOT NULL DEFAULT array_fill(0, ARRAY[15]),
+    PRIMARY KEY (hour, report_type, worker_id)
+);
+
+-- 1-based histogram bucket of a duration
+CREATE OR REPLACE FUNCTION report_stats_bucket(d INTERVAL) RETURNS INT
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT width_bucket(
+        EXTRACT(EPOCH FROM d) / 60,
+        ARRAY[1, 2, 5, 10, 15, 30, 60, 120, 240, 480, 1440, 2880, 4320, 10080]::float8[]
+    ) + 1
+$$;
+
+CREATE OR REPLACE FUNCTION report_stats_record(kind TEXT, r reports) RETURNS void
+LANGUAGE plpgsql AS $$
+DECLARE
+    b INT;
+BEGIN
+    IF kind = 'created' THEN
+        INSERT INTO report_stats_hourly (hour, report_type, worker_id, created)
+        VALUES (date_trunc('hour', r.created_at), r.report_type, 0, 1)
+        ON CONFLICT (hour, report_type, worker_id)
+        DO UPDATE SET created = report_stats_hourly.created + 1;
+    ELSIF kind = 'taken' THEN
+        b := report_stats_bucket(r.taken_at - r.created_at);
+        INSERT INTO report_stats_hourly (hour, report_type, worker_id, worker_name, taken)
+        VALUES (date_trunc('hour', r.taken_at), r.report_type, r.responsible_user_id, r.responsible_user_name, 1)
+        ON CONFLICT (hour, report_type, worker_id)
+        DO UPDATE SET taken = report_stats_hourly.taken + 1, worker_name = EXCLUDED.worker_name;
+        UPDATE report_stats_hourly SET take_hist[b] = take_hist[b] + 1
+        WHERE hour = date_trunc('hour', r.taken_at)
+          AND report_type = r.report_type AND worker_id = r.responsible_user_id;
+    ELSIF kind = 'completed' THEN
+        b := report_stats_bucket(r.completed_at - r.created_at);
+        INSERT INTO report_stats_hourly (hour, report_type, worker_id, worker_name, completed)
+        VALUES (date_trunc('hour', r.completed_at), r.report_type, r.responsible_user_id, r.responsible_user_name, 1)
+        ON CONFLICT (hour, report_type, worker_id)
+        DO UPDATE SET completed = report_stats_hourly.completed + 1, worker_name = EXCLUDED.worker_name;
+        UPDATE report_stats_hourly SET complete_hist[b] = complete_hist[b] + 1
+        WHERE hour = date_trunc('hour', r.completed_at)
+          AND report_type = r.report_type AND worker_id = r.responsible_user_id;
+    END IF;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION report_stats_track() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.status IS NOT DISTINCT FROM NEW.status THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP <> 'INSERT' THEN
+        UPDATE report_status_counts SET total = total - 1 WHERE status = OLD.status;
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO report_status_counts (status, total) VALUES (NEW.status, 1)
+        ON CONFLICT (status) DO UPDATE SET total = report_status_counts.total + 1;
+    END IF;
+
+    IF TG_OP = 'INSERT' THEN
+        PERFORM report_stats_record('created', NEW);
+    ELSIF TG_OP = 'UPDATE' AND NEW.status = 'in_progress' THEN
+        PERFORM report_stats_record('taken', NEW);
+    ELSIF TG_OP = 'UPDATE' AND NEW.status = 'completed' THEN
+        PERFORM report_stats_record('completed', NEW);
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS reports_stats ON reports;
+CREATE TRIGGER reports_stats
+AFTER INSERT OR DELETE OR UPDATE OF status ON reports
+FOR EACH ROW EXECUTE FUNCTION report_stats_track();
+
+-- One-time fill of counters and rollups from existing reports
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM report_status_counts) THEN
+        INSERT INTO report_status_counts (status, total)
+        SELECT status, COUNT(*) FROM reports GROUP BY status;
+
+        PERFORM report_stats_record('created', r) FROM reports r;
+        PERFORM report_stats_record('taken', r) FROM reports r WHERE taken_at IS NOT NULL;
+        PERFORM report_stats_record('completed', r) FROM reports r WHERE completed_at IS NOT NULL;
+    END IF;
+END
+$$;
@@ -0,0 +1,20 @@
+-- Tell other bot processes which report changed, so they drop it from their caches (db/cache.py)
+CREATE OR REPLACE FUNCTION reports_notify_change() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    r reports;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        r := OLD;
+    ELSE
+        r := NEW;
+    END IF;
+    PERFORM pg_notify('report_changes', r.id || ':' || r.user_id);
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS reports_notify ON reports;
+CREATE TRIGGER reports_notify
+AFTER INSERT OR UPDATE OR DELETE ON reports
+FOR EACH ROW EXECUTE FUNCTION reports_notify_change();
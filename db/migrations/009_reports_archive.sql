@@ -0,0 +1,64 @@
+-- Cold storage for completed reports moved out of the hot table by archive.py.
+-- Columns mirror reports in the same order: a migration adding a column to
+-- reports must add it here too and recreate reports_all.
+CREATE TABLE IF NOT EXISTS reports_archive (
+    LIKE reports INCLUDING DEFAULTS INCLUDING GENERATED,
+    PRIMARY KEY (id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_reports_archive_created
+ON reports_archive(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_reports_archive_user_created
+ON reports_archive(user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_reports_archive_responsible
+ON reports_archive(responsible_user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_reports_archive_search ON reports_archive USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_reports_archive_user_name_trgm ON reports_archive USING GIN (user_name gin_trgm_ops);
+
+-- Hot and archived reports for lookups by id, user, worker and search
+CREATE OR REPLACE VIEW reports_all AS
+SELECT * FROM reports
+UNION ALL
+SELECT * FROM reports_archive;
+
+-- Moving a report to the archive is not a status change: the archival
+-- transaction sets reports.archiving and the counters stay as they are
+CREATE OR REPLACE FUNCTION report_stats_track() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.status IS NOT DISTINCT FROM NEW.status THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'DELETE' AND current_setting('reports.archiving', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP <> 'INSERT' THEN
+        UPDATE report_status_counts SET total = total - 1 WHERE status = OLD.status;
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO report_status_counts (status, total) VALUES (NEW.status, 1)
+        ON CONFLICT (status) DO UPDATE SET total = report_status_counts.total + 1;
+    END IF;
+
+    IF TG_OP = 'INSERT' THEN
+        PERFORM report_stats_record('created', NEW);
+    ELSIF TG_OP = 'UPDATE' AND NEW.status = 'in_progress' THEN
+        PERFORM report_stats_record('taken', NEW);
+    ELSIF TG_OP = 'UPDATE' AND NEW.status = 'completed' THEN
+        PERFORM report_stats_record('completed', NEW);
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+-- Deleting an archived report (delete_report) updates counters and caches like a hot one
+DROP TRIGGER IF EXISTS reports_archive_stats ON reports_archive;
+CREATE TRIGGER reports_archive_stats
+AFTER DELETE ON reports_archive
+FOR EACH ROW EXECUTE FUNCTION report_stats_track();
+
+DROP TRIGGER IF EXISTS reports_archive_notify ON reports_archive;
+CREATE TRIGGER reports_archive_notify
+AFTER DELETE ON reports_archive
+FOR EACH ROW EXECUTE FUNCTION reports_notify_change();
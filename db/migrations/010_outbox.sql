@@ -0,0 +1,28 @@
+-- Notifications about report changes, written in the same statement as the
+-- change and delivered by the relay in outbox.py (at least once).
+-- idempotency_key ("report:<id>:<kind>") keeps a notification from being
+-- queued twice; report_id has no foreign key so archived reports keep theirs.
+CREATE TABLE IF NOT EXISTS outbox (
+    id BIGSERIAL PRIMARY KEY,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    report_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    payload JSONB NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'sent', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    last_error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    sent_at TIMESTAMPTZ
+);
+
+-- The relay's queue: only undelivered rows
+CREATE INDEX IF NOT EXISTS idx_outbox_due
+ON outbox(next_attempt_at, id) WHERE status = 'pending';
+
+CREATE INDEX IF NOT EXISTS idx_outbox_failed
+ON outbox(id) WHERE status = 'failed';
+
+-- Purge of delivered rows
+CREATE INDEX IF NOT EXISTS idx_outbox_sent
+ON outbox(sent_at) WHERE status = 'sent';
@@ -0,0 +1,10 @@
+-- Times the author sent the same report again; the repeats are merged into
+-- it by the report guard (middlewares/report_guard.py) instead of new rows
+ALTER TABLE reports ADD COLUMN IF NOT EXISTS duplicate_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE reports_archive ADD COLUMN IF NOT EXISTS duplicate_count INTEGER NOT NULL DEFAULT 0;
+
+-- SELECT * in a view is expanded when it is created: recreate it to pick up the column
+CREATE OR REPLACE VIEW reports_all AS
+SELECT * FROM reports
+UNION ALL
+SELECT * FROM reports_archive;
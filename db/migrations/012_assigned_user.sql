@@ -0,0 +1,10 @@
+-- Staff member a new report was routed to by assignment.py (the group sees
+-- it only if they don't take it in time); NULL when it went to the group
+ALTER TABLE reports ADD COLUMN IF NOT EXISTS assigned_user_id BIGINT;
+ALTER TABLE reports_archive ADD COLUMN IF NOT EXISTS assigned_user_id BIGINT;
+
+-- SELECT * in a view is expanded when it is created: recreate it to pick up the column
+CREATE OR REPLACE VIEW reports_all AS
+SELECT * FROM reports
+UNION ALL
+SELECT * FROM reports_archive;
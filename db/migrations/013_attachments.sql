@@ -0,0 +1,42 @@
+-- Photos, documents and voice notes sent with reports. A file is stored
+-- once per file_unique_id (the same file uploaded again reuses its row and
+-- its archived copy); report_attachments links it to reports in the order
+-- they were sent. report_id has no foreign key so archived reports keep theirs.
+CREATE TABLE IF NOT EXISTS attachments (
+    id BIGSERIAL PRIMARY KEY,
+    file_unique_id TEXT NOT NULL UNIQUE,
+    file_id TEXT NOT NULL,
+    kind TEXT NOT NULL CHECK (kind IN ('photo', 'document', 'voice')),
+    file_name TEXT,
+    mime_type TEXT,
+    file_size BIGINT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+    -- Local copy made by the archive downloader (attachments.py)
+    local_path TEXT,
+    archived_at TIMESTAMP,
+    archive_attempts INTEGER NOT NULL DEFAULT 0,
+    archive_next_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    archive_error TEXT
+);
+
+CREATE TABLE IF NOT EXISTS report_attachments (
+    report_id INTEGER NOT NULL,
+    attachment_id BIGINT NOT NULL REFERENCES attachments(id),
+    position SMALLINT NOT NULL,
+    PRIMARY KEY (report_id, attachment_id)
+);
+
+-- The downloader's queue: only files without a local copy
+CREATE INDEX IF NOT EXISTS idx_attachments_not_archived
+ON attachments(archive_next_at, id) WHERE local_path IS NULL;
+
+-- Number of attachments, shown with the report without joining
+ALTER TABLE reports ADD COLUMN IF NOT EXISTS attachment_count SMALLINT NOT NULL DEFAULT 0;
+ALTER TABLE reports_archive ADD COLUMN IF NOT EXISTS attachment_count SMALLINT NOT NULL DEFAULT 0;
+
+-- SELECT * in a view is expanded when it is created: recreate it to pick up the column
+CREATE OR REPLACE VIEW reports_all AS
+SELECT * FROM reports
+UNION ALL
+SELECT * FROM reports_archive;
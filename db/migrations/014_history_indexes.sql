@@ -0,0 +1,39 @@
+-- migrate: no-transaction
+-- Covering indexes for the admin history lists (/my_work, /user_<id>,
+-- /recent): keyed like the keyset pagination and including every column
+-- the lists show or filter by, so a page and its count are read by an
+-- index-only scan. They replace the narrower indexes with the same leading
+-- columns ("Мои обращения" and /pending, /inprogress, /completed use the
+-- user and status indexes the same way as before).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reports_responsible_history
+ON reports(responsible_user_id, created_at DESC, id DESC)
+INCLUDE (status, report_type, user_id, user_name, responsible_user_name);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reports_user_history
+ON reports(user_id, created_at DESC, id DESC)
+INCLUDE (status, report_type, user_name, responsible_user_name);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reports_created_history
+ON reports(created_at DESC, id DESC)
+INCLUDE (status, report_type, user_id, user_name, responsible_user_name);
+-- /recent filtered by status (only completed reports are archived)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reports_status_history
+ON reports(status, created_at DESC, id DESC)
+INCLUDE (report_type, user_id, user_name, responsible_user_name);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reports_archive_responsible_history
+ON reports_archive(responsible_user_id, created_at DESC, id DESC)
+INCLUDE (status, report_type, user_id, user_name, responsible_user_name);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reports_archive_user_history
+ON reports_archive(user_id, created_at DESC, id DESC)
+INCLUDE (status, report_type, user_name, responsible_user_name);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reports_archive_created_history
+ON reports_archive(created_at DESC, id DESC)
+INCLUDE (status, report_type, user_id, user_name, responsible_user_name);
+
+DROP INDEX CONCURRENTLY IF EXISTS idx_reports_user_id;
+DROP INDEX CONCURRENTLY IF EXISTS idx_reports_user_created;
+DROP INDEX CONCURRENTLY IF EXISTS idx_reports_responsible;
+DROP INDEX CONCURRENTLY IF EXISTS idx_reports_status_created;
+DROP INDEX CONCURRENTLY IF EXISTS idx_reports_status;
+DROP INDEX CONCURRENTLY IF EXISTS idx_reports_archive_user_created;
+DROP INDEX CONCURRENTLY IF EXISTS idx_reports_archive_responsible;
+DROP INDEX CONCURRENTLY IF EXISTS idx_reports_archive_created;
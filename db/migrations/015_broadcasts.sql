@@ -0,0 +1,35 @@
+-- Announcements to report authors sent by broadcast.py. Recipients are
+-- walked in user_id order and last_user_id is the checkpoint: everyone up
+-- to it is handled. A runner holds the broadcast while lease_until is in
+-- the future and renews it at each checkpoint; after a crash another
+-- process claims it and continues after last_user_id.
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id BIGSERIAL PRIMARY KEY,
+    text TEXT NOT NULL,
+    filters JSONB NOT NULL DEFAULT '{}',
+    created_by BIGINT NOT NULL,
+    -- Chat and message showing the progress
+    chat_id BIGINT NOT NULL,
+    progress_message_id BIGINT,
+    status TEXT NOT NULL DEFAULT 'running' CHECK (status IN ('running', 'done', 'cancelled')),
+    total INTEGER NOT NULL DEFAULT 0,
+    sent INTEGER NOT NULL DEFAULT 0,
+    blocked INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    last_user_id BIGINT NOT NULL DEFAULT 0,
+    lease_until TIMESTAMPTZ NOT NULL DEFAULT '-infinity',
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    finished_at TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS idx_broadcasts_running
+ON broadcasts(lease_until) WHERE status = 'running';
+
+-- Users the bot can't write to (blocked it, deleted the account), found by
+-- broadcasts and skipped by later ones. A new report from the user removes
+-- the row.
+CREATE TABLE IF NOT EXISTS blocked_users (
+    user_id BIGINT PRIMARY KEY,
+    reason TEXT NOT NULL,
+    blocked_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
@@ -1,192 +1,873 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import asyncio
+import json
+from contextlib import asynccontextmanager
 from datetime import datetime
-from config import DATABASE_URL
-
-def get_connection():
-    """Get database connection"""
-    return psycopg2.connect(DATABASE_URL)
-
-def init_db():
-    """Initialize database with tables"""
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS reports (
-                    id SERIAL PRIMARY KEY,
-                    
-                    -- User info
-                    user_id BIGINT NOT NULL,
-                    user_name TEXT NOT NULL,
-                    
-                    -- Report details
-                    report_type TEXT NOT NULL,
-                    report_text TEXT NOT NULL,
-                    
-                    -- Status tracking
-                    status TEXT DEFAULT 'pending',
-                    
-                    -- Responsible person
-                    responsible_user_id BIGINT,
-                    responsible_user_name TEXT,
-                    
-                    -- Response
-                    admin_response TEXT,
-                    
-                    -- Timestamps
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    taken_at TIMESTAMP,
-                    completed_at TIMESTAMP
-                )
-            ''')
-            
-            # Indexes for faster queries
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_reports_user_id ON reports(user_id);
-            ''')
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_reports_status ON reports(status);
-            ''')
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_reports_responsible ON reports(responsible_user_id);
-            ''')
-            
-            conn.commit()
-
-def save_report(user_id: int, user_name: str, report_type: str, report_text: str) -> int:
-    """Save new report"""
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute('''
-                INSERT INTO reports (user_id, user_name, report_type, report_text)
-                VALUES (%s, %s, %s, %s)
-                RETURNING id
-            ''', (user_id, user_name, report_type, report_text))
-            report_id = cursor.fetchone()[0]
-            conn.commit()
-            return report_id
-
-def take_report(report_id: int, worker_id: int, worker_name: str):
-    """Worker takes report and starts working on it"""
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute('''
-                UPDATE reports
-                SET status = 'in_progress',
-                    responsible_user_id = %s,
-                    responsible_user_name = %s,
-                    taken_at = CURRENT_TIMESTAMP
-                WHERE id = %s
-            ''', (worker_id, worker_name, report_id))
-            conn.commit()
-
-def complete_report(report_id: int, admin_response: str):
-    """Complete report with answer"""
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute('''
-                UPDATE reports
-                SET status = 'completed',
-                    admin_response = %s,
-                    completed_at = CURRENT_TIMESTAMP
-                WHERE id = %s
-            ''', (admin_response, report_id))
-            conn.commit()
-
-def get_report(report_id: int) -> dict:
-    """Get full report details"""
-    with get_connection() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute('SELECT * FROM reports WHERE id = %s', (report_id,))
-            return cursor.fetchone()
-
-def get_user_reports(user_id: int) -> list:
-    """Get all reports by specific user"""
-    with get_connection() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute('''
-                SELECT * FROM reports 
-                WHERE user_id = %s 
-                ORDER BY created_at DESC
-            ''', (user_id,))
-            return cursor.fetchall()
-
-def get_reports_by_status(status: str) -> list:
-    """Get all reports with specific status"""
-    with get_connection() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute('''
-                SELECT * FROM reports 
-                WHERE status = %s 
-                ORDER BY created_at DESC
-            ''', (status,))
-            return cursor.fetchall()
-
-def get_worker_reports(worker_id: int) -> list:
-    """Get all reports assigned to specific worker"""
-    with get_connection() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute('''
-                SELECT * FROM reports 
-                WHERE responsible_user_id = %s 
-                ORDER BY created_at DESC
-            ''', (worker_id,))
-            return cursor.fetchall()
-
-def get_all_reports(limit: int = 50) -> list:
-    """Get all reports with limit"""
-    with get_connection() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute('''
-                SELECT * FROM reports 
-                ORDER BY created_at DESC
-                LIMIT %s
-            ''', (limit,))
-            return cursor.fetchall()
-
-def get_report_stats() -> dict:
-    """Get statistics about reports"""
-    with get_connection() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute('''
-                SELECT 
-                    COUNT(*) as total,
-                    COUNT(CASE WHEN status = 'pending' THEN 1 END) as pending,
-                    COUNT(CASE WHEN status = 'in_progress' THEN 1 END) as in_progress,
-                    COUNT(CASE WHEN status = 'completed' THEN 1 END) as completed
-                FROM reports
-            ''')
-            return cursor.fetchone()
-
-def delete_report(report_id: int) -> bool:
+from typing import NamedTuple, Optional
+import asyncpg
+from config import (
+    DATABASE_URL,
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_ACQUIRE_TIMEOUT,
+    DB_STATEMENT_TIMEOUT,
+    DB_READY_TIMEOUT,
+)
+from metrics import timed, DB_QUERY_SECONDS, DB_QUERY_ERRORS
+from db.cache import report_cache, user_reports_cache, invalidate_report
+
+# Shared connection pool, created in main.py for the bot's lifetime
+_pool = None
+# Readiness gate: set once the pool is up and the schema checked, queries wait for it
+_ready = asyncio.Event()
+
+# Callbacks fired after a report changes state: callback(event, report)
+# event is one of 'created', 'taken', 'completed', 'deleted'
+_report_listeners = []
+
+def add_report_listener(callback):
+    """Subscribe to report state changes"""
+    _report_listeners.append(callback)
+
+def _notify(event: str, report: dict):
+    invalidate_report(report['id'], report['user_id'])
+    for callback in _report_listeners:
+        callback(event, report)
+
+async def init_pool(ready: bool = True):
+    """Create database connection pool
+
+    ready=False keeps queries waiting until set_ready() (the bot checks the
+    schema first).
+    """
+    global _pool
+    _pool = await asyncpg.create_pool(
+        DATABASE_URL,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        server_settings={'statement_timeout': str(DB_STATEMENT_TIMEOUT)}
+    )
+    if ready:
+        set_ready()
+    return _pool
+
+def set_ready():
+    """Open the readiness gate: let queries through"""
+    _ready.set()
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+async def close_pool():
+    """Close database connection pool"""
+    global _pool
+    _ready.clear()
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+def get_pool():
+    """Get database connection pool"""
+    if _pool is None:
+        raise RuntimeError("Database pool is not initialized, call init_pool() first")
+    return _pool
+
+# Duration and errors of every query function, labelled with its name
+_timed = timed(DB_QUERY_SECONDS, DB_QUERY_ERRORS)
+
+@asynccontextmanager
+async def get_connection():
+    """Acquire connection from the pool (use with 'async with') once the database is ready"""
+    if not _ready.is_set():
+        try:
+            await asyncio.wait_for(_ready.wait(), DB_READY_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise RuntimeError("Database is not ready") from None
+    async with get_pool().acquire(timeout=DB_ACQUIRE_TIMEOUT) as conn:
+        yield conn
+
+async def _fetchrow(query: str, *args):
+    async with get_connection() as conn:
+        row = await conn.fetchrow(query, *args)
+        return dict(row) if row else None
+
+async def _fetch(query: str, *args) -> list:
+    async with get_connection() as conn:
+        rows = await conn.fetch(query, *args)
+        return [dict(row) for row in rows]
+
+# Upper bounds (minutes) of time-to-take / time-to-complete histogram buckets,
+# the last bucket is everything above 7 days. Must match report_stats_bucket()
+# in db/migrations/007_report_stats.sql
+DURATION_BUCKETS_MINUTES = [1, 2, 5, 10, 15, 30, 60, 120, 240, 480, 1440, 2880, 4320, 10080]
+HISTOGRAM_SIZE = len(DURATION_BUCKETS_MINUTES) + 1
+
+# All report columns except the derived search_vector
+REPORT_COLUMNS = '''
+    id, user_id, user_name, report_type, report_text, status,
+    responsible_user_id, responsible_user_name, admin_response,
+    created_at, taken_at, completed_at, reminder_tier, duplicate_count,
+    assigned_user_id, attachment_count
+'''
+
+# Queues the notifications {kind: payload} passed as JSON in parameter $N
+# for the report(s) returned by CTE "source" (see outbox.py). A payload with
+# "delay" is delivered that many seconds later.
+_QUEUE_OUTBOX = '''
+    queued AS (
+        INSERT INTO outbox (idempotency_key, report_id, kind, payload, next_attempt_at)
+        SELECT 'report:' || source.id || ':' || n.key, source.id, n.key, n.value,
+               NOW() + make_interval(secs => COALESCE((n.value->>'delay')::float8, 0))
+        FROM {source} source, jsonb_each(${param}::jsonb) n
+        ON CONFLICT (idempotency_key) DO NOTHING
+    )
+'''
+
+# Stores the attachments passed as a JSON array in parameter $N (dicts
+# with file_unique_id, file_id, kind, file_name, mime_type, file_size;
+# unique by file_unique_id) and links them to the report of CTE "created".
+# A file stored before keeps its row and gets the latest file_id.
+_LINK_ATTACHMENTS = '''
+    files AS (
+        INSERT INTO attachments (file_unique_id, file_id, kind, file_name, mime_type, file_size)
+        SELECT file_unique_id, file_id, kind, file_name, mime_type, file_size
+        FROM jsonb_to_recordset(${param}::jsonb) AS f(
+            file_unique_id TEXT, file_id TEXT, kind TEXT, file_name TEXT, mime_type TEXT, file_size BIGINT
+        )
+        ON CONFLICT (file_unique_id) DO UPDATE SET file_id = EXCLUDED.file_id
+        RETURNING id, file_unique_id
+    ),
+    linked AS (
+        INSERT INTO report_attachments (report_id, attachment_id, position)
+        SELECT created.id, files.id, f.position
+        FROM created, files
+        JOIN jsonb_array_elements(${param}::jsonb) WITH ORDINALITY AS f(value, position)
+          ON f.value->>'file_unique_id' = files.file_unique_id
+    )
+'''
+
+@_timed
+async def save_report(user_id: int, user_name: str, report_type: str, report_text: str,
+                      notifications: dict = None, assigned_user_id: int = None,
+                      attachments: list = None) -> int:
+    """Save new report with its attachments (see _LINK_ATTACHMENTS)
+
+    notifications {kind: payload} go to the outbox in the same statement.
+    """
+    report = await _fetchrow(f'''
+        WITH created AS (
+            INSERT INTO reports (user_id, user_name, report_type, report_text, assigned_user_id, attachment_count)
+            VALUES ($1, $2, $3, $4, $6, jsonb_array_length($7::jsonb))
+            RETURNING {REPORT_COLUMNS}
+        ),
+        {_QUEUE_OUTBOX.format(source='created', param=5)},
+        {_LINK_ATTACHMENTS.format(param=7)},
+        -- Writing to the bot again means broadcasts reach them again
+        unblocked AS (DELETE FROM blocked_users WHERE user_id = $1)
+        SELECT * FROM created
+    ''', user_id, user_name, report_type, report_text, json.dumps(notifications or {}), assigned_user_id,
+        json.dumps(attachments or []))
+    _notify('created', report)
+    return report['id']
+
+@_timed
+async def merge_duplicate_report(report_id: int, user_id: int) -> Optional[dict]:
+    """Count a repeat of the user's report, unless it is completed (or gone)
+
+    Returns the updated report, None if a new report should be created instead.
+    """
+    report = await _fetchrow(f'''
+        UPDATE reports SET duplicate_count = duplicate_count + 1
+        WHERE id = $1 AND user_id = $2 AND status <> 'completed'
+        RETURNING {REPORT_COLUMNS}
+    ''', report_id, user_id)
+    if report is not None:
+        invalidate_report(report['id'], report['user_id'])
+    return report
+
+class TransitionResult(NamedTuple):
+    """Result of a status transition.
+
+    ok=True: report is the updated row.
+    ok=False: report is the current row (e.g. already taken by someone else),
+    or None if the report doesn't exist.
+    """
+    ok: bool
+    report: Optional[dict]
+
+async def _transition(query: str, *args) -> TransitionResult:
+    """Run conditional UPDATE ... RETURNING and fall back to the current row
+
+    FOR SHARE on the fallback makes a losing concurrent UPDATE read the
+    winner's committed row instead of the pre-statement snapshot.
+    """
+    row = await _fetchrow(query, *args)
+    if row is None:
+        return TransitionResult(False, None)
+    applied = row.pop('applied')
+    return TransitionResult(applied, row)
+
+@_timed
+async def take_report(report_id: int, worker_id: int, worker_name: str) -> TransitionResult:
+    """Worker takes report and starts working on it (only if still pending)"""
+    result = await _transition(f'''
+        WITH updated AS (
+            UPDATE reports
+            SET status = 'in_progress',
+                responsible_user_id = $2,
+                responsible_user_name = $3,
+                taken_at = CURRENT_TIMESTAMP
+            WHERE id = $1 AND status = 'pending'
+            RETURNING {REPORT_COLUMNS}
+        )
+        SELECT updated.*, TRUE AS applied FROM updated
+        UNION ALL
+        SELECT * FROM (
+            SELECT {REPORT_COLUMNS}, FALSE AS applied FROM reports
+            WHERE id = $1 AND NOT EXISTS (SELECT 1 FROM updated)
+            FOR SHARE
+        ) current_row
+    ''', report_id, worker_id, worker_name)
+    if result.ok:
+        _notify('taken', result.report)
+    return result
+
+@_timed
+async def complete_report(report_id: int, worker_id: int, admin_response: str,
+                          notifications: dict = None) -> TransitionResult:
+    """Complete report with answer (only by the responsible worker)
+
+    notifications {kind: payload} go to the outbox if the report is completed.
+    """
+    result = await _transition(f'''
+        WITH updated AS (
+            UPDATE reports
+            SET status = 'completed',
+                admin_response = $3,
+                completed_at = CURRENT_TIMESTAMP
+            WHERE id = $1 AND status = 'in_progress' AND responsible_user_id = $2
+            RETURNING {REPORT_COLUMNS}
+        ),
+        {_QUEUE_OUTBOX.format(source='updated', param=4)}
+        SELECT updated.*, TRUE AS applied FROM updated
+        UNION ALL
+        SELECT * FROM (
+            SELECT {REPORT_COLUMNS}, FALSE AS applied FROM reports
+            WHERE id = $1 AND NOT EXISTS (SELECT 1 FROM updated)
+            FOR SHARE
+        ) current_row
+    ''', report_id, worker_id, admin_response, json.dumps(notifications or {}))
+    if result.ok:
+        _notify('completed', result.report)
+    return result
+
+# Attachments of reports $1 in the order they were sent
+_ATTACHMENTS_QUERY = '''
+    SELECT ra.report_id, a.id, a.kind, a.file_id, a.file_name, a.local_path
+    FROM report_attachments ra
+    JOIN attachments a ON a.id = ra.attachment_id
+    WHERE ra.report_id = ANY($1::int[])
+    ORDER BY ra.report_id, ra.position
+'''
+
+@_timed
+async def get_report_attachments(report_id: int) -> list:
+    """Attachments of a report (kind, file_id, file_name, local_path) in the order they were sent"""
+    return await _fetch(_ATTACHMENTS_QUERY, [report_id])
+
+@_timed
+async def get_report(report_id: int) -> dict:
+    """Get full report details (cached)"""
+    report = report_cache.get(report_id)
+    if report is None:
+        generation = report_cache.generation()
+        report = await _fetchrow(f'SELECT {REPORT_COLUMNS} FROM reports_all WHERE id = $1', report_id)
+        if report is None:
+            return None
+        report_cache.put(report_id, report, generation)
+    return dict(report)
+
+@_timed
+async def warm_report_cache(limit: int) -> int:
+    """Load up to limit open reports (the ones admins look up) into the report cache"""
+    generation = report_cache.generation()
+    reports = await _fetch(f'''
+        SELECT {REPORT_COLUMNS} FROM reports
+        WHERE status <> 'completed'
+        ORDER BY id DESC
+        LIMIT $1
+    ''', limit)
+    for report in reversed(reports):
+        report_cache.put(report['id'], report, generation)
+    return len(reports)
+
+# Columns needed to render a report in a list (no full text or response)
+LIST_COLUMNS = '''
+    id, user_name, report_type, left(report_text, 100) AS report_text, status,
+    responsible_user_name, created_at, taken_at, completed_at
+'''
+
+class Page(NamedTuple):
+    """One page of a keyset-paginated list, newest first"""
+    rows: list
+    has_prev: bool
+    has_next: bool
+
+    @property
+    def first_cursor(self):
+        return (self.rows[0]['created_at'], self.rows[0]['id']) if self.rows else None
+
+    @property
+    def last_cursor(self):
+        return (self.rows[-1]['created_at'], self.rows[-1]['id']) if self.rows else None
+
+async def _fetch_page(where: str, args: tuple, cursor=None, direction: str = 'next', limit: int = 10,
+                      table: str = 'reports', columns: str = LIST_COLUMNS) -> Page:
+    """Fetch a page ordered by (created_at, id) DESC
+
+    cursor is (created_at, id) of the row to continue from: 'next' goes to
+    older rows after it, 'prev' goes to newer rows before it. table is
+    'reports' or 'reports_all' for lists that include archived reports.
+    """
+    n = len(args)
+    if cursor is None:
+        rows = await _fetch(f'''
+            SELECT {columns} FROM {table}
+            WHERE {where}
+            ORDER BY created_at DESC, id DESC
+            LIMIT ${n + 1}
+        ''', *args, limit + 1)
+        return Page(rows[:limit], False, len(rows) > limit)
+
+    if direction == 'prev':
+        rows = await _fetch(f'''
+            SELECT {columns} FROM {table}
+            WHERE {where} AND (created_at, id) > (${n + 1}, ${n + 2})
+            ORDER BY created_at ASC, id ASC
+            LIMIT ${n + 3}
+        ''', *args, cursor[0], cursor[1], limit + 1)
+        return Page(rows[:limit][::-1], len(rows) > limit, True)
+
+    rows = await _fetch(f'''
+        SELECT {columns} FROM {table}
+        WHERE {where} AND (created_at, id) < (${n + 1}, ${n + 2})
+        ORDER BY created_at DESC, id DESC
+        LIMIT ${n + 3}
+    ''', *args, cursor[0], cursor[1], limit + 1)
+    return Page(rows[:limit], True, len(rows) > limit)
+
+@_timed
+async def get_user_reports(user_id: int, cursor=None, direction: str = 'next', limit: int = 10) -> Page:
+    """Get a page of reports by specific user (the first page is cached)"""
+    if cursor is not None or limit != 10:
+        return await _fetch_page('user_id = $1', (user_id,), cursor, direction, limit, 'reports_all')
+
+    page = user_reports_cache.get(user_id)
+    if page is None:
+        generation = user_reports_cache.generation()
+        page = await _fetch_page('user_id = $1', (user_id,), cursor, direction, limit, 'reports_all')
+        user_reports_cache.put(user_id, page, generation)
+    return page
+
+@_timed
+async def get_reports_by_status(status: str, cursor=None, direction: str = 'next', limit: int = 20) -> Page:
+    """Get a page of reports with specific status"""
+    # Only completed reports are archived
+    table = 'reports_all' if status == 'completed' else 'reports'
+    return await _fetch_page('status = $1', (status,), cursor, direction, limit, table)
+
+# Columns of the admin history lists, all in the covering indexes of
+# migration 014: a page is read without touching the table
+HISTORY_COLUMNS = '''
+    id, created_at, status, report_type, user_id, user_name, responsible_user_name
+'''
+
+# A count estimated below this is replaced by an exact one (cheap at that size)
+EXACT_COUNT_LIMIT = 1000
+
+def _history_where(user_id: int = None, worker_id: int = None, status: str = None,
+                   report_type: str = None, days: int = None) -> tuple:
+    """(table, WHERE clause, args) of a history list; None filters are left out"""
+    conditions, args = [], []
+    for condition, value in (
+        ('user_id = ${}', user_id),
+        ('responsible_user_id = ${}', worker_id),
+        ('status = ${}', status),
+        ('report_type = ${}', report_type),
+        ('created_at >= LOCALTIMESTAMP - make_interval(days => ${})', days),
+    ):
+        if value is not None:
+            args.append(value)
+            conditions.append(condition.format(len(args)))
+    # Only completed reports are archived
+    table = 'reports' if status in ('pending', 'in_progress') else 'reports_all'
+    return table, ' AND '.join(conditions) or 'TRUE', tuple(args)
+
+@_timed
+async def get_report_history(user_id: int = None, worker_id: int = None, status: str = None,
+                             report_type: str = None, days: int = None,
+                             cursor=None, direction: str = 'next', limit: int = 20) -> Page:
+    """Get a page of reports by author, worker or all, filtered by status, type and age in days"""
+    table, where, args = _history_where(user_id, worker_id, status, report_type, days)
+    return await _fetch_page(where, args, cursor, direction, limit, table, HISTORY_COLUMNS)
+
+@_timed
+async def count_report_history(user_id: int = None, worker_id: int = None, status: str = None,
+                               report_type: str = None, days: int = None) -> tuple:
+    """(count, exact) of reports get_report_history lists
+
+    Large counts are the planner's estimate (EXPLAIN, no rows read), as
+    fresh as the table statistics; up to EXACT_COUNT_LIMIT rows are counted.
+    """
+    table, where, args = _history_where(user_id, worker_id, status, report_type, days)
+    async with get_connection() as conn:
+        plan = await conn.fetchval(f'EXPLAIN (FORMAT JSON) SELECT 1 FROM {table} WHERE {where}', *args)
+        estimate = round(json.loads(plan)[0]['Plan']['Plan Rows'])
+        if estimate > EXACT_COUNT_LIMIT:
+            return estimate, False
+        count = await conn.fetchval(f'''
+            SELECT COUNT(*) FROM (SELECT 1 FROM {table} WHERE {where} LIMIT {EXACT_COUNT_LIMIT + 1}) matched
+        ''', *args)
+    # More rows than the statistics said: an estimate after all
+    return count, count <= EXACT_COUNT_LIMIT
+
+@_timed
+async def get_report_stats() -> dict:
+    """Get report counts by status (from trigger-maintained counters)"""
+    rows = await _fetch('SELECT status, total FROM report_status_counts')
+    stats = {'pending': 0, 'in_progress': 0, 'completed': 0}
+    stats.update({row['status']: row['total'] for row in rows})
+    stats['total'] = sum(stats.values())
+    return stats
+
+@_timed
+async def get_duration_histograms(group_by: str, days: int = 30) -> dict:
+    """Summed time-to-take / time-to-complete histograms for the last days
+
+    group_by is 'report_type' or 'worker_id'. Returns
+    {key: {'name', 'taken', 'completed', 'take_hist', 'complete_hist'}}.
+    """
+    if group_by not in ('report_type', 'worker_id'):
+        raise ValueError(f"Unsupported grouping: {group_by}")
+    rows = await _fetch(f'''
+        SELECT {group_by} AS key, max(worker_name) AS name, 'take' AS kind,
+               u.i AS bucket, SUM(u.v) AS total
+        FROM report_stats_hourly, unnest(take_hist) WITH ORDINALITY AS u(v, i)
+        WHERE hour >= LOCALTIMESTAMP - make_interval(days => $1) AND worker_id <> 0
+        GROUP BY 1, u.i
+        UNION ALL
+        SELECT {group_by}, max(worker_name), 'complete', u.i, SUM(u.v)
+        FROM report_stats_hourly, unnest(complete_hist) WITH ORDINALITY AS u(v, i)
+        WHERE hour >= LOCALTIMESTAMP - make_interval(days => $1) AND worker_id <> 0
+        GROUP BY 1, u.i
+    ''', days)
+
+    groups = {}
+    for row in rows:
+        group = groups.setdefault(row['key'], {
+            'name': row['name'],
+            'taken': 0,
+            'completed': 0,
+            'take_hist': [0] * HISTOGRAM_SIZE,
+            'complete_hist': [0] * HISTOGRAM_SIZE,
+        })
+        group[f"{row['kind']}_hist"][row['bucket'] - 1] = row['total']
+        group['taken' if row['kind'] == 'take' else 'completed'] += row['total']
+    return groups
+
+@_timed
+async def get_report_trends() -> dict:
+    """Created/completed counts for the last 7 and 30 days and the periods before them"""
+    return await _fetchrow('''
+        SELECT
+            COALESCE(SUM(created) FILTER (WHERE hour >= LOCALTIMESTAMP - INTERVAL '7 days'), 0) AS created_7d,
+            COALESCE(SUM(created) FILTER (WHERE hour < LOCALTIMESTAMP - INTERVAL '7 days'
+                                            AND hour >= LOCALTIMESTAMP - INTERVAL '14 days'), 0) AS created_prev_7d,
+            COALESCE(SUM(completed) FILTER (WHERE hour >= LOCALTIMESTAMP - INTERVAL '7 days'), 0) AS completed_7d,
+            COALESCE(SUM(completed) FILTER (WHERE hour < LOCALTIMESTAMP - INTERVAL '7 days'
+                                              AND hour >= LOCALTIMESTAMP - INTERVAL '14 days'), 0) AS completed_prev_7d,
+            COALESCE(SUM(created) FILTER (WHERE hour >= LOCALTIMESTAMP - INTERVAL '30 days'), 0) AS created_30d,
+            COALESCE(SUM(created) FILTER (WHERE hour < LOCALTIMESTAMP - INTERVAL '30 days'), 0) AS created_prev_30d,
+            COALESCE(SUM(completed) FILTER (WHERE hour >= LOCALTIMESTAMP - INTERVAL '30 days'), 0) AS completed_30d,
+            COALESCE(SUM(completed) FILTER (WHERE hour < LOCALTIMESTAMP - INTERVAL '30 days'), 0) AS completed_prev_30d
+        FROM report_stats_hourly
+        WHERE hour >= LOCALTIMESTAMP - INTERVAL '60 days'
+    ''')
+
+@_timed
+async def delete_report(report_id: int) -> bool:
     """Delete report by ID (admin only)"""
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute('DELETE FROM reports WHERE id = %s', (report_id,))
-            conn.commit()
-            return cursor.rowcount > 0
-
-def search_reports(search_text: str) -> list:
-    """Search reports by text"""
-    with get_connection() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute('''
-                SELECT * FROM reports 
-                WHERE report_text ILIKE %s 
-                   OR user_name ILIKE %s
-                   OR report_type ILIKE %s
-                ORDER BY created_at DESC
-                LIMIT 50
-            ''', (f'%{search_text}%', f'%{search_text}%', f'%{search_text}%'))
-            return cursor.fetchall()
-def get_old_pending_reports(hours: int = 1) -> list:
-    """Get pending reports older than specified hours"""
-    with get_connection() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute('''
-                SELECT * FROM reports 
-                WHERE status = 'pending'
-                AND created_at < NOW() - INTERVAL '%s hours'
-                ORDER BY created_at ASC
-            ''', (hours,))
-            return cursor.fetchall()
+    # The report and its attachment links go together or not at all
+    async with get_connection() as conn, conn.transaction():
+        report = await conn.fetchrow(f'DELETE FROM reports WHERE id = $1 RETURNING {REPORT_COLUMNS}', report_id)
+        if report is None:
+            report = await conn.fetchrow(f'DELETE FROM reports_archive WHERE id = $1 RETURNING {REPORT_COLUMNS}', report_id)
+        if report is None:
+            return False
+        # The files stay: other reports may share them
+        await conn.execute('DELETE FROM report_attachments WHERE report_id = $1', report_id)
+    report = dict(report)
+    _notify('deleted', report)
+    return True
+
+@_timed
+async def search_reports(search_text: str, page: int = 0, limit: int = 10) -> Page:
+    """Full-text search ranked by relevance, with highlighted snippets
+
+    Matches words in type, author and text (Russian stemming) or fuzzy author name.
+    """
+    rows = await _fetch('''
+        WITH q AS (SELECT websearch_to_tsquery('russian', $1) AS query)
+        SELECT id, user_name, report_type, status, created_at,
+               ts_headline('russian', report_text, q.query,
+                           'StartSel=«, StopSel=», MaxWords=25, MinWords=10, MaxFragments=2') AS snippet
+        FROM (
+            SELECT id, user_name, report_type, status, created_at, report_text,
+                   ts_rank_cd(search_vector, q.query) + similarity(user_name, $1) AS rank
+            FROM reports_all, q
+            WHERE search_vector @@ q.query OR user_name % $1
+            ORDER BY rank DESC, id DESC
+            LIMIT $2 OFFSET $3
+        ) hits, q
+        ORDER BY rank DESC, id DESC
+    ''', search_text, limit + 1, page * limit)
+    return Page(rows[:limit], page > 0, len(rows) > limit)
+
+@_timed
+async def get_pending_deadlines(report_ids: list = None) -> list:
+    """Get id, age in seconds (by the database clock) and last sent reminder tier of pending reports
+
+    All of them or those of report_ids.
+    """
+    if report_ids is not None:
+        return await _fetch('''
+            SELECT id, EXTRACT(EPOCH FROM NOW() - created_at)::float8 AS age, reminder_tier FROM reports
+            WHERE status = 'pending' AND id = ANY($1::int[])
+        ''', report_ids)
+    return await _fetch('''
+        SELECT id, EXTRACT(EPOCH FROM NOW() - created_at)::float8 AS age, reminder_tier FROM reports
+        WHERE status = 'pending'
+    ''')
+
+@_timed
+async def get_assignment_load(worker_ids: list, window: float) -> tuple:
+    """Open reports of the workers: ({worker_id: reports in progress}, reserved)
+
+    reserved are pending reports routed to one of them less than window
+    seconds ago (id, assigned_user_id, age in seconds by the database clock), oldest first.
+    """
+    async with get_connection() as conn:
+        in_progress = await conn.fetch('''
+            SELECT responsible_user_id, COUNT(*) AS open FROM reports
+            WHERE status = 'in_progress' AND responsible_user_id = ANY($1::bigint[])
+            GROUP BY responsible_user_id
+        ''', worker_ids)
+        reserved = await conn.fetch('''
+            SELECT id, assigned_user_id, EXTRACT(EPOCH FROM NOW() - created_at)::float8 AS age FROM reports
+            WHERE status = 'pending' AND assigned_user_id = ANY($1::bigint[])
+              AND created_at > CURRENT_TIMESTAMP - make_interval(secs => $2)
+            ORDER BY created_at, id
+        ''', worker_ids, window)
+    return {row['responsible_user_id']: row['open'] for row in in_progress}, [dict(row) for row in reserved]
+
+@_timed
+async def claim_reminders(items: list) -> list:
+    """Mark reminder tiers as sent for [(report_id, tier), ...] in one statement
+
+    Returns the reports whose tier wasn't sent before, each with its 'tier'
+    and 'age' in seconds by the database clock.
+    """
+    if not items:
+        return []
+    ids, tiers = zip(*items)
+    columns = ', '.join(f'r.{c.strip()}' for c in REPORT_COLUMNS.split(','))
+    reports = await _fetch(f'''
+        UPDATE reports r
+        SET reminder_tier = t.tier
+        FROM unnest($1::int[], $2::int[]) AS t(id, tier)
+        WHERE r.id = t.id AND r.status = 'pending' AND r.reminder_tier < t.tier
+        RETURNING {columns}, t.tier, EXTRACT(EPOCH FROM NOW() - r.created_at)::float8 AS age
+    ''', list(ids), list(tiers))
+    for report in reports:
+        invalidate_report(report['id'])
+    return reports
+
+@_timed
+async def archive_completed_reports(older_than_days: int, limit: int) -> int:
+    """Move up to limit reports completed more than older_than_days ago to reports_archive
+
+    Returns the number of moved reports.
+    """
+    async with get_connection() as conn:
+        async with conn.transaction():
+            # Not a status change for the statistics trigger
+            await conn.execute("SET LOCAL reports.archiving = 'on'")
+            result = await conn.execute(f'''
+                WITH moved AS (
+                    DELETE FROM reports
+                    WHERE id IN (
+                        SELECT id FROM reports
+                        WHERE status = 'completed'
+                          AND completed_at < LOCALTIMESTAMP - make_interval(days => $1)
+                        ORDER BY id
+                        LIMIT $2
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING {REPORT_COLUMNS}
+                )
+                INSERT INTO reports_archive ({REPORT_COLUMNS})
+                SELECT {REPORT_COLUMNS} FROM moved
+            ''', older_than_days, limit)
+    # INSERT status is "INSERT 0 <rows>"
+    return int(result.split()[-1])
+
+@_timed
+async def claim_outbox(limit: int, lease: float) -> list:
+    """Take up to limit due outbox rows for lease seconds
+
+    Returns the rows (payload decoded) oldest first, each with its 'report'
+    (None if the report was deleted). A row that isn't marked sent or
+    failed before the lease runs out is claimed again.
+    """
+    async with get_connection() as conn:
+        rows = await conn.fetch('''
+            UPDATE outbox
+            SET attempts = attempts + 1,
+                next_attempt_at = NOW() + make_interval(secs => $2)
+            WHERE id IN (
+                SELECT id FROM outbox
+                WHERE status = 'pending' AND next_attempt_at <= NOW()
+                ORDER BY next_attempt_at, id
+                LIMIT $1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, report_id, kind, payload, attempts, created_at
+        ''', limit, lease)
+        if not rows:
+            return []
+        reports = await conn.fetch(f'''
+            SELECT {REPORT_COLUMNS} FROM reports_all WHERE id = ANY($1::int[])
+        ''', list({row['report_id'] for row in rows}))
+        reports = {report['id']: dict(report) for report in reports}
+        for report in reports.values():
+            report['attachments'] = []
+        with_files = [report['id'] for report in reports.values() if report['attachment_count']]
+        if with_files:
+            for attachment in await conn.fetch(_ATTACHMENTS_QUERY, with_files):
+                reports[attachment['report_id']]['attachments'].append(dict(attachment))
+    return sorted((
+        {**row, 'payload': json.loads(row['payload']), 'report': reports.get(row['report_id'])}
+        for row in rows
+    ), key=lambda row: row['id'])
+
+@_timed
+async def mark_outbox_sent(ids: list):
+    await _fetch('''
+        UPDATE outbox SET status = 'sent', sent_at = NOW(), last_error = NULL
+        WHERE id = ANY($1::bigint[])
+    ''', ids)
+
+@_timed
+async def retry_outbox(items: list):
+    """Reschedule [(id, error, delay seconds or None to give up), ...]"""
+    if not items:
+        return
+    ids, errors, delays = zip(*items)
+    await _fetch('''
+        UPDATE outbox o
+        SET status = CASE WHEN f.delay IS NULL THEN 'failed' ELSE 'pending' END,
+            next_attempt_at = NOW() + make_interval(secs => COALESCE(f.delay, 0)),
+            last_error = f.error
+        FROM unnest($1::bigint[], $2::text[], $3::float8[]) AS f(id, error, delay)
+        WHERE o.id = f.id
+    ''', list(ids), list(errors), list(delays))
+
+@_timed
+async def get_failed_outbox(limit: int = 100) -> list:
+    return await _fetch('''
+        SELECT id, idempotency_key, attempts, last_error, created_at FROM outbox
+        WHERE status = 'failed'
+        ORDER BY id
+        LIMIT $1
+    ''', limit)
+
+@_timed
+async def replay_outbox(ids: list = None) -> int:
+    """Queue failed outbox rows (all, or those in ids) for delivery again, returns their number"""
+    rows = await _fetch('''
+        UPDATE outbox
+        SET status = 'pending', attempts = 0, next_attempt_at = NOW()
+        WHERE status = 'failed' AND ($1::bigint[] IS NULL OR id = ANY($1::bigint[]))
+        RETURNING id
+    ''', ids)
+    return len(rows)
+
+@_timed
+async def purge_outbox(older_than_days: int) -> int:
+    """Delete outbox rows delivered more than older_than_days ago"""
+    async with get_connection() as conn:
+        result = await conn.execute('''
+            DELETE FROM outbox WHERE status = 'sent' AND sent_at < NOW() - make_interval(days => $1)
+        ''', older_than_days)
+    return int(result.split()[-1])
+
+
+@_timed
+async def claim_attachment_downloads(limit: int, lease: float, max_attempts: int) -> list:
+    """Take up to limit attachments without a local copy for lease seconds, oldest first"""
+    return await _fetch('''
+        UPDATE attachments
+        SET archive_attempts = archive_attempts + 1,
+            archive_next_at = NOW() + make_interval(secs => $2)
+        WHERE id IN (
+            SELECT id FROM attachments
+            WHERE local_path IS NULL AND archive_next_at <= NOW() AND archive_attempts < $3
+            ORDER BY archive_next_at, id
+            LIMIT $1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, file_unique_id, file_id, kind, file_name, mime_type, archive_attempts
+    ''', limit, lease, max_attempts)
+
+@_timed
+async def mark_attachment_archived(attachment_id: int, local_path: str):
+    async with get_connection() as conn:
+        await conn.execute('''
+            UPDATE attachments
+            SET local_path = $2, archived_at = CURRENT_TIMESTAMP, archive_error = NULL
+            WHERE id = $1
+        ''', attachment_id, local_path)
+
+@_timed
+async def retry_attachment_download(attachment_id: int, error: str, delay: Optional[float]):
+    """Record a failed download: retry after delay seconds, or never (delay None)"""
+    async with get_connection() as conn:
+        await conn.execute('''
+            UPDATE attachments
+            SET archive_error = $2,
+                archive_next_at = CASE WHEN $3::float8 IS NULL THEN 'infinity'
+                                       ELSE NOW() + make_interval(secs => $3::float8) END
+            WHERE id = $1
+        ''', attachment_id, error, delay)
+
+# Columns of a broadcast as the runner and the progress message use them
+BROADCAST_COLUMNS = '''
+    id, text, filters, created_by, chat_id, progress_message_id, status,
+    total, sent, blocked, failed, last_user_id, created_at, finished_at
+'''
+
+def _broadcast(row) -> Optional[dict]:
+    if row is None:
+        return None
+    broadcast = dict(row)
+    broadcast['filters'] = json.loads(broadcast['filters'])
+    return broadcast
+
+def _recipient_where(filters: dict, first: int = 1) -> tuple:
+    """(WHERE clause, args) over reports_all for the recipients of a broadcast
+
+    filters: status, type, since, until (ISO dates); placeholders start at
+    $first. Users in blocked_users are left out.
+    """
+    conditions = ['NOT EXISTS (SELECT 1 FROM blocked_users b WHERE b.user_id = reports_all.user_id)']
+    args = []
+    for condition, value in (
+        ('status = ${}', filters.get('status')),
+        ('report_type = ${}', filters.get('type')),
+        ('created_at >= ${}', filters.get('since')),
+        ('created_at < ${}', filters.get('until')),
+    ):
+        if value is not None:
+            if condition.startswith('created_at'):
+                value = datetime.fromisoformat(value)
+            args.append(value)
+            conditions.append(condition.format(first + len(args) - 1))
+    return ' AND '.join(conditions), tuple(args)
+
+@_timed
+async def count_broadcast_recipients(filters: dict) -> int:
+    """Number of distinct authors of reports matching filters, not blocked"""
+    where, args = _recipient_where(filters)
+    async with get_connection() as conn:
+        return await conn.fetchval(f'SELECT COUNT(DISTINCT user_id) FROM reports_all WHERE {where}', *args)
+
+@_timed
+async def create_broadcast(text: str, filters: dict, created_by: int, chat_id: int, lease: float) -> dict:
+    """Create a running broadcast held by the caller for lease seconds, with its recipient count"""
+    where, args = _recipient_where(filters, first=6)
+    return _broadcast(await _fetchrow(f'''
+        INSERT INTO broadcasts (text, filters, created_by, chat_id, lease_until, total)
+        VALUES ($1, $2::jsonb, $3, $4, NOW() + make_interval(secs => $5),
+                (SELECT COUNT(DISTINCT user_id) FROM reports_all WHERE {where}))
+        RETURNING {BROADCAST_COLUMNS}
+    ''', text, json.dumps(filters), created_by, chat_id, lease, *args))
+
+@_timed
+async def set_broadcast_message(broadcast_id: int, message_id: int):
+    async with get_connection() as conn:
+        await conn.execute('UPDATE broadcasts SET progress_message_id = $2 WHERE id = $1', broadcast_id, message_id)
+
+@_timed
+async def claim_broadcast(lease: float) -> Optional[dict]:
+    """Take over a running broadcast whose runner's lease ran out (it died), None if there is none"""
+    return _broadcast(await _fetchrow(f'''
+        UPDATE broadcasts SET lease_until = NOW() + make_interval(secs => $1)
+        WHERE id = (
+            SELECT id FROM broadcasts
+            WHERE status = 'running' AND lease_until < NOW()
+            ORDER BY id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING {BROADCAST_COLUMNS}
+    ''', lease))
+
+@_timed
+async def get_broadcast_recipients(filters: dict, after: int, limit: int) -> list:
+    """Next limit recipient user_ids after the given one, in order"""
+    where, args = _recipient_where(filters, first=3)
+    rows = await _fetch(f'''
+        SELECT DISTINCT user_id FROM reports_all
+        WHERE user_id > $1 AND {where}
+        ORDER BY user_id
+        LIMIT $2
+    ''', after, limit, *args)
+    return [row['user_id'] for row in rows]
+
+@_timed
+async def checkpoint_broadcast(broadcast_id: int, last_user_id: int, sent: int, failed: int,
+                               blocked: list, lease: float, done: bool = False) -> dict:
+    """Record progress up to last_user_id and renew the lease, in one statement
+
+    sent and failed are counts since the previous checkpoint, blocked is
+    [(user_id, reason), ...] of users found unreachable (they go to
+    blocked_users). done finishes a running broadcast. Returns the
+    broadcast: status 'cancelled' means it was stopped meanwhile.
+    """
+    user_ids = [user_id for user_id, _ in blocked]
+    reasons = [reason for _, reason in blocked]
+    return _broadcast(await _fetchrow(f'''
+        WITH unreachable AS (
+            INSERT INTO blocked_users (user_id, reason)
+            SELECT * FROM unnest($5::bigint[], $6::text[])
+            ON CONFLICT (user_id) DO UPDATE SET reason = EXCLUDED.reason, blocked_at = NOW()
+        )
+        UPDATE broadcasts SET
+            last_user_id = GREATEST(last_user_id, $2),
+            sent = sent + $3,
+            failed = failed + $4,
+            blocked = blocked + cardinality($5::bigint[]),
+            lease_until = NOW() + make_interval(secs => $7),
+            status = CASE WHEN $8 AND status = 'running' THEN 'done' ELSE status END,
+            finished_at = CASE WHEN $8 AND status = 'running' THEN NOW() ELSE finished_at END
+        WHERE id = $1
+        RETURNING {BROADCAST_COLUMNS}
+    ''', broadcast_id, last_user_id, sent, failed, user_ids, reasons, lease, done))
+
+@_timed
+async def cancel_broadcast(broadcast_id: int) -> Optional[dict]:
+    """Stop a running broadcast (its runner notices at the next checkpoint), None if it isn't running"""
+    return _broadcast(await _fetchrow(f'''
+        UPDATE broadcasts SET status = 'cancelled', finished_at = NOW()
+        WHERE id = $1 AND status = 'running'
+        RETURNING {BROADCAST_COLUMNS}
+    ''', broadcast_id))
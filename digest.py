@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from aiogram.methods import EditMessageText
+from aiogram.types import Message
+from config import (
+    ADMIN_GROUP_ID,
+    DIGEST_MODE,
+    DIGEST_WINDOW,
+    DIGEST_BURST_THRESHOLD,
+    DIGEST_MAX_REPORTS,
+)
+from keyboards.inline_kb import get_admin_action_keyboard, get_digest_keyboard
+from render import digest_entry
+from sender import send, send_message, PRIORITY_ADMIN
+
+# Sent digests remembered for take buttons; older ones are rebuilt from the message
+MAX_TRACKED_DIGESTS = 500
+
+class _Digest:
+    """Current text and not yet taken reports of a sent digest message"""
+    __slots__ = ('text', 'open_ids')
+
+    def __init__(self, text: str, open_ids: list):
+        self.text = text
+        self.open_ids = open_ids
+
+# Arrival times of new reports within the last DIGEST_WINDOW seconds
+_recent = deque()
+# New reports waiting for the next digest, and futures of their notifications
+_buffer = []
+_buffer_futures = []
+_flush_task = None
+# (chat_id, message_id) -> _Digest
+_digests = OrderedDict()
+
+def _remember(future: asyncio.Future, report_ids: list):
+    if future.cancelled() or future.exception() is not None:
+        return
+    message = future.result()
+    _digests[(message.chat.id, message.message_id)] = _Digest(message.text, list(report_ids))
+    while len(_digests) > MAX_TRACKED_DIGESTS:
+        _digests.popitem(last=False)
+
+def send_digest(header: str, entries: list, priority: int = PRIORITY_ADMIN) -> list:
+    """Send [(report_id, text), ...] to the admin group as digests with a take button per report
+
+    Returns the futures of the digest messages.
+    """
+    futures = []
+    for start in range(0, len(entries), DIGEST_MAX_REPORTS):
+        chunk = entries[start:start + DIGEST_MAX_REPORTS]
+        report_ids = [report_id for report_id, _ in chunk]
+        text = f"{header} ({len(chunk)})\n\n" + "\n\n".join(entry for _, entry in chunk)
+        future = send_message(ADMIN_GROUP_ID, text, priority=priority, reply_markup=get_digest_keyboard(report_ids))
+        future.add_done_callback(lambda f, ids=report_ids: _remember(f, ids))
+        futures.append(future)
+    return futures
+
+def _resolve(future: asyncio.Future, waiters: list):
+    """Pass the outcome of future on to waiters"""
+    for waiter in waiters:
+        if waiter.done():
+            continue
+        if future.cancelled():
+            waiter.cancel()
+        elif future.exception() is not None:
+            waiter.set_exception(future.exception())
+        else:
+            waiter.set_result(future.result())
+
+def flush_new_reports():
+    """Send buffered new reports now"""
+    global _buffer, _buffer_futures, _flush_task
+    if _flush_task is not None and _flush_task is not asyncio.current_task():
+        _flush_task.cancel()
+    _flush_task = None
+    if not _buffer:
+        return
+    entries = [(report['id'], digest_entry(report)) for report in _buffer]
+    waiters = _buffer_futures
+    _buffer, _buffer_futures = [], []
+    futures = send_digest("🔔 НОВЫЕ ОБРАЩЕНИЯ", entries)
+    for start, future in zip(range(0, len(waiters), DIGEST_MAX_REPORTS), futures):
+        chunk = waiters[start:start + DIGEST_MAX_REPORTS]
+        future.add_done_callback(lambda f, chunk=chunk: _resolve(f, chunk))
+
+async def _flush_later():
+    await asyncio.sleep(DIGEST_WINDOW)
+    flush_new_reports()
+
+def notify_new_report(report: dict, text: str) -> asyncio.Future:
+    """Notify the admin group about a new report: alone (text) or in the next digest
+
+    The returned future is done once the message carrying the report is sent.
+    """
+    now = time.monotonic()
+    _recent.append(now)
+    while _recent and _recent[0] <= now - DIGEST_WINDOW:
+        _recent.popleft()
+
+    batching = DIGEST_MODE == "window" or (
+        DIGEST_MODE == "burst" and (_buffer or len(_recent) > DIGEST_BURST_THRESHOLD)
+    )
+    if not batching:
+        return send_message(
+            ADMIN_GROUP_ID, text, priority=PRIORITY_ADMIN, reply_markup=get_admin_action_keyboard(report['id'])
+        )
+
+    global _flush_task
+    future = asyncio.get_running_loop().create_future()
+    # Failures are logged by the sender
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    _buffer.append(report)
+    _buffer_futures.append(future)
+    if len(_buffer) >= DIGEST_MAX_REPORTS:
+        flush_new_reports()
+    elif _flush_task is None:
+        _flush_task = asyncio.create_task(_flush_later())
+    return future
+
+def _find_digest(message: Message):
+    key = (message.chat.id, message.message_id)
+    digest = _digests.get(key)
+    if digest is None and message.reply_markup is not None:
+        # Not remembered (e.g. sent before a restart): rebuild from the message
+        open_ids = [
+            int(button.callback_data.split("_")[2])
+            for row in message.reply_markup.inline_keyboard
+            for button in row
+            if button.text.startswith("✅ #") and button.callback_data.startswith("take_request_")
+        ]
+        if open_ids:
+            digest = _digests[key] = _Digest(message.text, open_ids)
+    return digest
+
+def mark_taken(message: Message, report_id: int, worker_name: str) -> bool:
+    """Drop the report's button from a digest; False if message is not a digest"""
+    digest = _find_digest(message)
+    if digest is None:
+        return False
+    if report_id not in digest.open_ids:
+        return True
+
+    digest.open_ids.remove(report_id)
+    digest.text += f"\n✅ #{report_id} — {worker_name}"
+    if not digest.open_ids:
+        _digests.pop((message.chat.id, message.message_id), None)
+
+    send(EditMessageText(
+        chat_id=message.chat.id,
+        message_id=message.message_id,
+        text=digest.text,
+        reply_markup=get_digest_keyboard(digest.open_ids)
+    ), PRIORITY_ADMIN)
+    return True
+
+def stop_digest():
+    """Send what is buffered (before the sender stops)"""
+    if _buffer:
+        logging.info(f"Sending digest of {len(_buffer)} buffered reports")
+    flush_new_reports()
@@ -1,66 +1,78 @@
-from aiogram import Router, F, Bot
+import asyncio
+import logging
+import os
+import tempfile
+from datetime import datetime
+from aiogram import Router, F
+from aiogram.methods import SendDocument
+from aiogram.types import FSInputFile
 from aiogram.types import CallbackQuery, Message
-from aiogram.filters import StateFilter
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from db.queries import take_report, complete_report, get_report, get_reports_by_status
+from db.queries import (
+    take_report, complete_report, get_report, get_report_attachments, get_reports_by_status, search_reports,
+    get_report_history, count_report_history, get_report_stats, get_duration_histograms, get_report_trends,
+    count_broadcast_recipients, create_broadcast, set_broadcast_message, cancel_broadcast,
+    DURATION_BUCKETS_MINUTES
+)
+from keyboards.inline_kb import (
+    get_pagination_keyboard, parse_page_callback, get_page_number_keyboard,
+    HistoryView, get_history_keyboard, parse_history_callback,
+    get_broadcast_confirm_keyboard, get_broadcast_abort_keyboard, get_broadcast_stop_keyboard,
+)
+from db.bulk import export_reports, FORMATS
+from config import ADMIN_GROUP_ID, EXPORT_DOCUMENT_SIZE_MB, BROADCAST_LEASE
+from sender import send, send_message, PRIORITY_ADMIN
+from digest import mark_taken
+from attachments import send_attachments
+from broadcast import start_broadcast
+from outbox import COMPLETED
+import render
 
 router = Router()
 
 # States for admin response flow
 class AdminStates(StatesGroup):
     waiting_for_response = State()
+    waiting_for_broadcast = State()
 
 @router.callback_query(F.data.startswith("take_request_"))
 async def take_request(callback: CallbackQuery, state: FSMContext):
     """Admin takes responsibility for report"""
     report_id = int(callback.data.split("_")[2])
     
-    # Get report details
-    report = get_report(report_id)
+    # Assign admin to report (status check and update in one statement)
+    result = await take_report(
+        report_id=report_id,
+        worker_id=callback.from_user.id,
+        worker_name=callback.from_user.full_name
+    )
+    report = result.report
     
     if not report:
         await callback.answer("❌ Обращение не найдено", show_alert=True)
         return
     
-    if report['status'] != 'pending':
+    if not result.ok:
+        # Stale button on a digest: drop it
+        mark_taken(callback.message, report_id, report['responsible_user_name'])
         await callback.answer(
             f"⚠️ Обращение уже взято в работу: {report['responsible_user_name']}",
             show_alert=True
         )
         return
     
-    # Assign admin to report
-    take_report(
-        report_id=report_id,
-        worker_id=callback.from_user.id,
-        worker_name=callback.from_user.full_name
-    )
-    
-    # Update message in group
-    await callback.message.edit_text(
-        callback.message.text + f"\n\n✅ Взял(а) в работу: {callback.from_user.full_name}\n"
-        f"🕐 Время: {callback.message.date.strftime('%d.%m.%Y %H:%M')}",
-        reply_markup=None
-    )
+    # Update message in group; a digest loses only this report's button
+    if not mark_taken(callback.message, report_id, callback.from_user.full_name):
+        footer = render.taken_footer(callback.from_user.full_name, callback.message.date)
+        await callback.message.edit_text(
+            render.fit_text(callback.message.text, render.MESSAGE_LIMIT - len(footer)) + footer,
+            reply_markup=None
+        )
     
     # Send to admin in PM
-    await callback.bot.send_message(
-        chat_id=callback.from_user.id,
-        text=(
-            f"✅ Вы взяли обращение #{report_id} в работу\n\n"
-            f"👤 От: {report['user_name']}\n"
-            f"🆔 User ID: {report['user_id']}\n"
-            f"📌 Тип: {report['report_type']}\n"
-            f"💬 Сообщение:\n{report['report_text']}\n\n"
-            f"📊 Статус: В работе\n"
-            f"⏰ Создано: {report['created_at'].strftime('%d.%m.%Y %H:%M')}\n\n"
-            f"Когда выполните работу, отправьте ответ:\n"
-            f"/complete_{report_id} [ваш ответ]\n\n"
-            f"Пример:\n"
-            f"/complete_{report_id} Проблема решена, заменили оборудование"
-        )
-    )
+    send_message(callback.from_user.id, render.taken_dm(report), priority=PRIORITY_ADMIN)
     
     await callback.answer("✅ Обращение назначено вам")
 
@@ -72,65 +84,31 @@ async def complete_command(message: Message, state: FSMContext):
         report_id = int(parts[0].split("_")[1])
         
         if len(parts) < 2:
-            await message.answer(
-                "❌ Укажите ответ после команды:\n\n"
-                f"Формат:\n"
-                f"/complete_{report_id} [ваш ответ]\n\n"
-                f"Пример:\n"
-                f"/complete_{report_id} Проблема решена, заменили оборудование"
-            )
+            await message.answer(render.complete_usage(report_id))
             return
         
         admin_response = parts[1]
         
-        # Get report
-        report = get_report(report_id)
+        # Complete report (status and ownership check in one statement), the
+        # answer to the user is queued in the outbox by the same statement
+        result = await complete_report(
+            report_id, message.from_user.id, admin_response, notifications={COMPLETED: {}}
+        )
+        report = result.report
         
         if not report:
             await message.answer("❌ Обращение не найдено")
             return
         
-        if report['status'] == 'completed':
-            await message.answer(
-                f"⚠️ Обращение #{report_id} уже завершено\n"
-                f"Завершил: {report['responsible_user_name']}\n"
-                f"Время: {report['completed_at'].strftime('%d.%m.%Y %H:%M')}"
-            )
+        if not result.ok:
+            if report['status'] == 'completed':
+                await message.answer(render.already_completed(report))
+            else:
+                await message.answer(render.not_responsible(report))
             return
         
-        if report['responsible_user_id'] != message.from_user.id:
-            await message.answer(
-                f"❌ Вы не ответственный за это обращение\n"
-                f"Ответственный: {report['responsible_user_name']}"
-            )
-            return
-        
-        # Complete report
-        complete_report(report_id, admin_response)
-        
         # Notify admin
-        await message.answer(
-            f"✅ Обращение #{report_id} завершено!\n\n"
-            f"📌 Тип: {report['report_type']}\n"
-            f"👤 От: {report['user_name']}\n"
-            f"💬 Проблема: {report['report_text'][:100]}...\n\n"
-            f"🔧 Ваш ответ: {admin_response}\n\n"
-            "Пользователь получил уведомление. ✉️"
-        )
-        
-        # Notify user
-        await message.bot.send_message(
-            chat_id=report['user_id'],
-            text=(
-                f"✅ Ваше обращение #{report_id} выполнено!\n\n"
-                f"📌 Тип: {report['report_type']}\n"
-                f"⏰ Создано: {report['created_at'].strftime('%d.%m.%Y %H:%M')}\n"
-                f"✓ Завершено: Сейчас\n\n"
-                f"💬 Ваше сообщение:\n{report['report_text']}\n\n"
-                f"🔧 Ответ ({report['responsible_user_name']}):\n{admin_response}\n\n"
-                "Спасибо за обращение! 🙏"
-            )
-        )
+        await render.answer(message, render.completed_admin(report))
         
     except (IndexError, ValueError) as e:
         await message.answer(
@@ -139,119 +117,429 @@ async def complete_command(message: Message, state: FSMContext):
             "/complete_[ID] [ваш ответ]"
         )
 
+# status -> (header, empty text, page size, item formatter)
+STATUS_LISTS = {
+    'pending': ("⏳ Ожидающие обращения", "✅ Нет ожидающих обращений", 20, render.pending_item),
+    'in_progress': ("🔄 В работе", "ℹ️ Нет обращений в работе", 20, render.in_progress_item),
+    'completed': ("✅ Завершено", "ℹ️ Нет завершенных обращений", 15, render.completed_item),
+}
+
+async def _status_list(status: str, cursor=None, direction: str = 'next'):
+    """Build text and keyboard for one page of reports with given status"""
+    header, empty_text, page_size, format_item = STATUS_LISTS[status]
+    page = await get_reports_by_status(status, cursor, direction, limit=page_size)
+    
+    if not page.rows:
+        return empty_text, None
+    
+    # Rows that don't fit into one message move to the next page
+    text, page = render.fit_page(f"{header}:\n\n", page, format_item)
+    return text, get_pagination_keyboard(f"list:{status}", page)
+
 @router.message(F.text == "/pending")
 async def show_pending_reports(message: Message):
     """Show all pending reports (admin command)"""
-    pending = get_reports_by_status('pending')
-    
-    if not pending:
-        await message.answer("✅ Нет ожидающих обращений")
-        return
-    
-    text = f"⏳ Ожидающие обращения ({len(pending)}):\n\n"
-    
-    for report in pending[:20]:  # Show max 20
-        text += (
-            f"📋 #{report['id']} - {report['report_type']}\n"
-            f"👤 {report['user_name']}\n"
-            f"⏰ {report['created_at'].strftime('%d.%m %H:%M')}\n"
-            f"💬 {report['report_text'][:50]}...\n\n"
-        )
-    
-    await message.answer(text)
+    text, keyboard = await _status_list('pending')
+    await message.answer(text, reply_markup=keyboard)
 
 @router.message(F.text == "/inprogress")
 async def show_inprogress_reports(message: Message):
     """Show all in-progress reports (admin command)"""
-    in_progress = get_reports_by_status('in_progress')
-    
-    if not in_progress:
-        await message.answer("ℹ️ Нет обращений в работе")
-        return
-    
-    text = f"🔄 В работе ({len(in_progress)}):\n\n"
-    
-    for report in in_progress[:20]:
-        text += (
-            f"📋 #{report['id']} - {report['report_type']}\n"
-            f"👤 Пользователь: {report['user_name']}\n"
-            f"👨‍💼 Ответственный: {report['responsible_user_name']}\n"
-            f"🕐 Взято: {report['taken_at'].strftime('%d.%m %H:%M')}\n\n"
-        )
-    
-    await message.answer(text)
+    text, keyboard = await _status_list('in_progress')
+    await message.answer(text, reply_markup=keyboard)
 
 @router.message(F.text == "/completed")
 async def show_completed_reports(message: Message):
     """Show recently completed reports (admin command)"""
-    completed = get_reports_by_status('completed')
-    
-    if not completed:
-        await message.answer("ℹ️ Нет завершенных обращений")
+    text, keyboard = await _status_list('completed')
+    await message.answer(text, reply_markup=keyboard)
+
+@router.callback_query(F.data.startswith("list:"))
+async def status_list_page(callback: CallbackQuery):
+    """Switch page of /pending, /inprogress or /completed list"""
+    status = callback.data.split(":")[1]
+    if status not in STATUS_LISTS:
+        await callback.answer()
         return
     
-    text = f"✅ Завершено ({len(completed)}):\n\n"
-    
-    for report in completed[:15]:  # Show last 15
-        text += (
-            f"📋 #{report['id']} - {report['report_type']}\n"
-            f"👤 Пользователь: {report['user_name']}\n"
-            f"👨‍💼 Выполнил: {report['responsible_user_name']}\n"
-            f"✓ {report['completed_at'].strftime('%d.%m %H:%M')}\n\n"
-        )
-    
-    await message.answer(text)
+    direction, cursor = parse_page_callback(callback.data)
+    text, keyboard = await _status_list(status, cursor, direction)
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
 
 @router.message(F.text.startswith("/report_"))
 async def view_report(message: Message):
     """View specific report details (admin command)"""
     try:
         report_id = int(message.text.split("_")[1])
-        report = get_report(report_id)
+        report = await get_report(report_id)
         
         if not report:
             await message.answer("❌ Обращение не найдено")
             return
         
-        status_emoji = {
-            'pending': '⏳',
-            'in_progress': '🔄',
-            'completed': '✅'
-        }.get(report['status'], '❓')
-        
-        status_text = {
-            'pending': 'Ожидает',
-            'in_progress': 'В работе',
-            'completed': 'Завершено'
-        }.get(report['status'], 'Неизвестно')
+        await render.answer(message, render.admin_details(report))
+        if report['attachment_count']:
+            send_attachments(message.chat.id, report_id, await get_report_attachments(report_id), PRIORITY_ADMIN)
         
-        details = (
-            f"{status_emoji} Обращение #{report['id']}\n\n"
-            f"👤 От: {report['user_name']}\n"
-            f"🆔 User ID: {report['user_id']}\n"
-            f"📌 Тип: {report['report_type']}\n"
-            f"📊 Статус: {status_text}\n"
-            f"⏰ Создано: {report['created_at'].strftime('%d.%m.%Y %H:%M')}\n\n"
-            f"💬 Сообщение:\n{report['report_text']}\n"
+    except (IndexError, ValueError):
+        await message.answer("❌ Используйте: /report_[ID]")
+
+# History list scope -> (title, page size)
+HISTORY_SCOPES = {
+    'w': ("🗂 Моя работа", 15),
+    'u': ("🗂 Обращения пользователя {target}", 15),
+    'r': ("🗂 Последние обращения", 15),
+}
+
+async def _history_list(view: HistoryView, cursor=None, direction: str = 'next'):
+    """Build text and keyboard for one page of /my_work, /user_<id> or /recent"""
+    title, page_size = HISTORY_SCOPES[view.scope]
+    filters = {
+        'user_id': view.target if view.scope == 'u' else None,
+        'worker_id': view.target if view.scope == 'w' else None,
+        'status': None if view.status == "-" else view.status,
+        'report_type': view.report_type,
+        'days': view.days or None,
+    }
+    page = await get_report_history(**filters, cursor=cursor, direction=direction, limit=page_size)
+    if cursor is None and not page.has_next:
+        # The whole list is on this page
+        count, exact = len(page.rows), True
+    else:
+        count, exact = await count_report_history(**filters)
+
+    header = render.history_header(title.format(target=view.target), count, exact)
+    if not page.rows:
+        # The filters stay so they can be changed
+        return header + "ℹ️ Нет обращений с такими фильтрами", get_history_keyboard(view, page)
+    text, page = render.fit_page(header, page, lambda report: render.history_item(report, author=view.scope != 'u'))
+    return text, get_history_keyboard(view, page)
+
+@router.message(F.text == "/my_work")
+async def my_work_command(message: Message):
+    """Show reports the admin took, newest first (admin command)"""
+    text, keyboard = await _history_list(HistoryView('w', message.from_user.id))
+    await message.answer(text, reply_markup=keyboard)
+
+@router.message(F.text.startswith("/user_"), F.chat.id == int(ADMIN_GROUP_ID))
+async def user_history_command(message: Message):
+    """Show all reports of one author (admin group only)"""
+    try:
+        user_id = int(message.text.split()[0].split("_")[1])
+    except (IndexError, ValueError):
+        await message.answer("❌ Используйте: /user_[ID пользователя]")
+        return
+    text, keyboard = await _history_list(HistoryView('u', user_id))
+    await message.answer(text, reply_markup=keyboard)
+
+@router.message(F.text == "/recent", F.chat.id == int(ADMIN_GROUP_ID))
+async def recent_command(message: Message):
+    """Show all reports, newest first (admin group only)"""
+    text, keyboard = await _history_list(HistoryView('r'))
+    await message.answer(text, reply_markup=keyboard)
+
+@router.callback_query(F.data.startswith("h:"))
+async def history_page(callback: CallbackQuery):
+    """Change filters or page of /my_work, /user_<id> or /recent"""
+    try:
+        view, direction, cursor = parse_history_callback(callback.data)
+    except (KeyError, ValueError):
+        await callback.answer()
+        return
+    # Lists of other people's reports stay in the admin group
+    if view.scope not in HISTORY_SCOPES or (view.scope != 'w' and callback.message.chat.id != int(ADMIN_GROUP_ID)):
+        await callback.answer()
+        return
+
+    text, keyboard = await _history_list(view, cursor, direction)
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
+
+async def _search_page(query: str, page_number: int):
+    """Build text and keyboard for one page of search results"""
+    page = await search_reports(query, page_number)
+    
+    if not page.rows:
+        return f"🔎 По запросу «{query}» ничего не найдено", None
+    
+    text = f"🔎 Результаты поиска «{query}» (стр. {page_number + 1}):\n\n"
+    text += "".join(render.search_item(report) for report in page.rows)
+    
+    return render.fit_text(text), get_page_number_keyboard("search", page_number, page)
+
+@router.message(Command("search"), F.chat.id == int(ADMIN_GROUP_ID))
+async def search_command(message: Message, state: FSMContext, command: CommandObject):
+    """Full-text search over reports (admin group only)"""
+    if not command.args or not command.args.strip():
+        await message.answer(
+            "❌ Укажите текст для поиска:\n\n"
+            "/search [текст]\n\n"
+            "Пример:\n"
+            "/search сломался проектор"
         )
+        return
+    
+    query = command.args.strip()
+    # Remember the query for page buttons
+    await state.update_data(search_query=query)
+    
+    text, keyboard = await _search_page(query, 0)
+    await message.answer(text, reply_markup=keyboard)
+
+@router.callback_query(F.data.startswith("search:"), F.message.chat.id == int(ADMIN_GROUP_ID))
+async def search_page(callback: CallbackQuery, state: FSMContext):
+    """Switch page of /search results"""
+    query = (await state.get_data()).get('search_query')
+    if not query:
+        await callback.answer("⚠️ Повторите поиск командой /search", show_alert=True)
+        return
+    
+    page_number = int(callback.data.split(":")[1])
+    text, keyboard = await _search_page(query, page_number)
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
+
+def _histogram_percentile(hist: list, q: float):
+    """Approximate percentile (minutes) from duration bucket counts, None if empty"""
+    total = sum(hist)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for i, count in enumerate(hist):
+        if count and seen + count >= rank:
+            lower = DURATION_BUCKETS_MINUTES[i - 1] if i > 0 else 0
+            if i == len(DURATION_BUCKETS_MINUTES):
+                # Open last bucket: we only know it's above the last bound
+                return lower
+            upper = DURATION_BUCKETS_MINUTES[i]
+            return lower + (upper - lower) * (rank - seen) / count
+        seen += count
+    return DURATION_BUCKETS_MINUTES[-1]
+
+def _format_minutes(minutes) -> str:
+    if minutes is None:
+        return "—"
+    if minutes < 60:
+        return f"{minutes:.0f} мин"
+    if minutes < 1440:
+        return f"{minutes / 60:.1f} ч"
+    return f"{minutes / 1440:.1f} д"
+
+def _format_sla(hist: list) -> str:
+    return f"{_format_minutes(_histogram_percentile(hist, 0.5))} / {_format_minutes(_histogram_percentile(hist, 0.95))}"
+
+def _format_trend(current: int, previous: int) -> str:
+    if not previous:
+        return str(current)
+    change = (current - previous) * 100 / previous
+    return f"{current} ({change:+.0f}%)"
+
+@router.message(F.text == "/stats", F.chat.id == int(ADMIN_GROUP_ID))
+async def stats_command(message: Message):
+    """SLA dashboard: counts, time-to-take/complete and trends (admin group only)"""
+    stats = await get_report_stats()
+    trends = await get_report_trends()
+    by_type = await get_duration_histograms('report_type')
+    by_worker = await get_duration_histograms('worker_id')
+    
+    text = (
+        "📊 Статистика обращений\n\n"
+        f"⏳ Ожидают: {stats['pending']}\n"
+        f"🔄 В работе: {stats['in_progress']}\n"
+        f"✅ Завершено: {stats['completed']}\n"
+        f"📋 Всего: {stats['total']}\n\n"
+        "📈 Динамика (к предыдущему периоду):\n"
+        f"7 дней: новых {_format_trend(trends['created_7d'], trends['created_prev_7d'])}, "
+        f"закрыто {_format_trend(trends['completed_7d'], trends['completed_prev_7d'])}\n"
+        f"30 дней: новых {_format_trend(trends['created_30d'], trends['created_prev_30d'])}, "
+        f"закрыто {_format_trend(trends['completed_30d'], trends['completed_prev_30d'])}\n\n"
+        "⏱ За 30 дней, медиана / p95\n"
+        "(взятие в работу · завершение):\n\n"
+    )
+    
+    if not by_type:
+        text += "Нет данных"
+    for report_type, group in sorted(by_type.items()):
+        text += (
+            f"📂 {report_type}\n"
+            f"   {_format_sla(group['take_hist'])} · {_format_sla(group['complete_hist'])}\n"
+        )
+    
+    if by_worker:
+        text += "\n👥 По сотрудникам:\n"
+    for group in sorted(by_worker.values(), key=lambda g: -g['completed']):
+        text += (
+            f"👤 {group['name']} (взято {group['taken']}, завершено {group['completed']})\n"
+            f"   {_format_sla(group['take_hist'])} · {_format_sla(group['complete_hist'])}\n"
+        )
+    
+    await render.answer(message, text)
+
+REPORT_FILTERS = ("status", "type", "since", "until")
+
+def _parse_report_filters(args: list) -> dict:
+    """status=, type=, since= and until= arguments of /export and /broadcast; ValueError on others"""
+    filters = {}
+    for arg in args:
+        key, _, value = arg.partition("=")
+        if key not in REPORT_FILTERS or not value:
+            raise ValueError(arg)
+        if key in ("since", "until"):
+            value = datetime.fromisoformat(value)
+        elif key == "type":
+            # Spaces in a type are written as "_": type=Учебный_процесс
+            value = value.replace("_", " ")
+        filters[key] = value
+    return filters
+
+def _split_file(path: str, chunk_size: int) -> list:
+    """Split file into path.001, path.002, ... of at most chunk_size bytes"""
+    parts = []
+    with open(path, "rb") as source:
+        while True:
+            part_path = f"{path}.{len(parts) + 1:03d}"
+            written = 0
+            with open(part_path, "wb") as part:
+                while written < chunk_size:
+                    block = source.read(min(1 << 20, chunk_size - written))
+                    if not block:
+                        break
+                    part.write(block)
+                    written += len(block)
+            if not written:
+                os.remove(part_path)
+                return parts
+            parts.append(part_path)
+
+@router.message(F.text.startswith("/export"), F.chat.id == int(ADMIN_GROUP_ID))
+async def export_command(message: Message):
+    """Export reports as a document (admin group only)"""
+    # /export [csv|jsonl|parquet] [status=...] [type=...] [since=YYYY-MM-DD] [until=YYYY-MM-DD]
+    args = message.text.split()[1:]
+    fmt = next((arg for arg in args if arg in FORMATS), "csv")
+    try:
+        filters = _parse_report_filters([arg for arg in args if arg not in FORMATS])
+    except ValueError:
+        await message.answer(
+            "❌ Используйте:\n\n"
+            "/export [csv|jsonl|parquet] [status=completed] [type=Персонал] "
+            "[since=2024-09-01] [until=2024-10-01]"
+        )
+        return
+    
+    await message.answer("⏳ Готовлю выгрузку...")
+    with tempfile.TemporaryDirectory() as directory:
+        filename = f"reports_{datetime.now().strftime('%Y%m%d_%H%M')}.{fmt}"
+        path = os.path.join(directory, filename)
+        try:
+            rows = await export_reports(
+                path, fmt,
+                since=filters.get("since"),
+                until=filters.get("until"),
+                status=filters.get("status"),
+                report_type=filters.get("type")
+            )
+        except ImportError:
+            await message.answer("❌ Для формата parquet на сервере нужен пакет pyarrow")
+            return
         
-        if report['responsible_user_name']:
-            details += f"\n👨‍💼 Ответственный: {report['responsible_user_name']}\n"
-            details += f"🆔 ID: {report['responsible_user_id']}\n"
-        
-        if report['taken_at']:
-            details += f"🕐 Взято в работу: {report['taken_at'].strftime('%d.%m.%Y %H:%M')}\n"
-        
-        if report['admin_response']:
-            details += f"\n🔧 Ответ:\n{report['admin_response']}\n"
-        
-        if report['completed_at']:
-            details += f"\n✅ Завершено: {report['completed_at'].strftime('%d.%m.%Y %H:%M')}"
-        
-        await message.answer(details)
+        chunk_size = int(EXPORT_DOCUMENT_SIZE_MB * 1024 * 1024)
+        parts = [path] if os.path.getsize(path) <= chunk_size else _split_file(path, chunk_size)
+        caption = f"📦 Обращений: {rows}"
+        if len(parts) > 1:
+            caption += f"\nЧастей: {len(parts)}, соберите файл командой:\ncat {filename}.* > {filename}"
         
-    except (IndexError, ValueError):
-        await message.answer("❌ Используйте: /report_[ID]")
+        futures = [
+            send(SendDocument(
+                chat_id=message.chat.id,
+                document=FSInputFile(part, filename=os.path.basename(part)),
+                caption=caption if i == 0 else None
+            ), PRIORITY_ADMIN)
+            for i, part in enumerate(parts)
+        ]
+        # Files must stay until they are uploaded
+        results = await asyncio.gather(*futures, return_exceptions=True)
+    
+    failed = [r for r in results if isinstance(r, Exception)]
+    if failed:
+        logging.error(f"Export upload failed: {failed[0]!r}")
+        await message.answer(f"❌ Не удалось отправить {len(failed)} из {len(parts)} частей выгрузки")
+
+@router.message(F.text.startswith("/broadcast"), F.chat.id == int(ADMIN_GROUP_ID))
+async def broadcast_command(message: Message, state: FSMContext):
+    """Start a broadcast to report authors: count the recipients and ask for the text"""
+    # /broadcast [status=...] [type=...] [since=YYYY-MM-DD] [until=YYYY-MM-DD]
+    try:
+        filters = _parse_report_filters(message.text.split()[1:])
+    except ValueError:
+        await message.answer(
+            "❌ Используйте:\n\n"
+            "/broadcast [status=completed] [type=Персонал] [since=2024-09-01] [until=2024-10-01]"
+        )
+        return
+    # Stored with the broadcast as JSON
+    filters = {key: value.isoformat() if isinstance(value, datetime) else value for key, value in filters.items()}
+    
+    total = await count_broadcast_recipients(filters)
+    if not total:
+        await message.answer("ℹ️ Нет пользователей, которым можно отправить рассылку")
+        return
+    await state.set_state(AdminStates.waiting_for_broadcast)
+    await state.update_data(broadcast_filters=filters, broadcast_total=total, broadcast_text=None)
+    await message.answer(render.broadcast_ask(filters, total), reply_markup=get_broadcast_abort_keyboard())
+
+# Commands still work while the text is awaited
+@router.message(AdminStates.waiting_for_broadcast, F.chat.id == int(ADMIN_GROUP_ID), ~F.text.startswith("/"))
+async def broadcast_text(message: Message, state: FSMContext):
+    """Text of the broadcast: show it for confirmation"""
+    if not message.text:
+        await message.answer("❌ Рассылка поддерживает только текст, отправьте его сообщением")
+        return
+    data = await state.get_data()
+    await state.update_data(broadcast_text=message.text)
+    await message.answer(
+        render.broadcast_preview(data['broadcast_filters'], data['broadcast_total'], message.text),
+        reply_markup=get_broadcast_confirm_keyboard()
+    )
+
+@router.callback_query(F.data == "bc_confirm")
+async def broadcast_confirm(callback: CallbackQuery, state: FSMContext):
+    """Create the broadcast and turn the preview into its progress message"""
+    data = await state.get_data()
+    if not data.get('broadcast_text'):
+        await callback.answer("⚠️ Начните заново командой /broadcast", show_alert=True)
+        return
+    await state.clear()
+    
+    # Held by this process until the runner's first checkpoint
+    broadcast = await create_broadcast(
+        data['broadcast_text'], data['broadcast_filters'], callback.from_user.id,
+        callback.message.chat.id, BROADCAST_LEASE
+    )
+    await callback.message.edit_text(
+        render.broadcast_progress(broadcast), reply_markup=get_broadcast_stop_keyboard(broadcast['id'])
+    )
+    await set_broadcast_message(broadcast['id'], callback.message.message_id)
+    broadcast['progress_message_id'] = callback.message.message_id
+    start_broadcast(broadcast)
+    await callback.answer("📣 Рассылка запущена")
+
+@router.callback_query(F.data == "bc_abort")
+async def broadcast_abort(callback: CallbackQuery, state: FSMContext):
+    await state.clear()
+    await callback.message.edit_text("❌ Рассылка отменена", reply_markup=None)
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("bc_stop:"), F.message.chat.id == int(ADMIN_GROUP_ID))
+async def broadcast_stop(callback: CallbackQuery):
+    """Stop a running broadcast; its runner sees it at the next checkpoint"""
+    broadcast = await cancel_broadcast(int(callback.data.split(":")[1]))
+    if broadcast is None:
+        await callback.answer("ℹ️ Рассылка уже завершена", show_alert=True)
+        return
+    await callback.answer("⛔ Рассылка остановлена")
 
 @router.message(F.text == "/adminhelp")
 async def admin_help(message: Message):
@@ -262,6 +550,13 @@ async def admin_help(message: Message):
         "/inprogress - Показать обращения в работе\n"
         "/completed - Показать завершенные\n"
         "/report_[ID] - Детали обращения\n"
+        "/search [текст] - Поиск по обращениям (в группе)\n"
+        "/my_work - Обращения, которые вы брали в работу\n"
+        "/recent - Все обращения с фильтрами (в группе)\n"
+        "/user_[ID] - Все обращения пользователя (в группе)\n"
+        "/stats - Статистика и время обработки (в группе)\n"
+        "/export [csv|jsonl|parquet] [фильтры] - Выгрузка обращений\n"
+        "/broadcast [фильтры] - Рассылка авторам обращений (в группе)\n"
         "/complete_[ID] [ответ] - Завершить обращение\n"
         "/adminhelp - Эта справка\n\n"
         "💡 Взять обращение в работу можно кнопкой в группе"
@@ -0,0 +1,162 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Mapping, Optional
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from db.queries import get_connection
+from config import FSM_STORAGE, REDIS_URL, FSM_STATE_TTL, FSM_FLUSH_INTERVAL
+
+# How often expired states are deleted from the table
+CLEANUP_INTERVAL = 600
+
+class PostgresStorage(BaseStorage):
+    """FSM storage for ReportStates/AdminStates in the fsm_storage table.
+
+    Writes are buffered for flush_interval seconds and flushed in one
+    transaction for all users, reads of unflushed keys are served from the
+    buffer. States not touched for ttl seconds are treated as abandoned.
+    """
+
+    def __init__(self, ttl: int = FSM_STATE_TTL, flush_interval: float = FSM_FLUSH_INTERVAL):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._key_builder = DefaultKeyBuilder(with_destiny=True)
+        # key -> {'state': ..., 'data': ...} with only the parts that changed
+        self._dirty: Dict[str, dict] = {}
+        self._flushing: Dict[str, dict] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._last_cleanup = time.monotonic()
+
+    def _buffered(self, key: str, part: str):
+        for buffer in (self._dirty, self._flushing):
+            entry = buffer.get(key)
+            if entry is not None and part in entry:
+                return True, entry[part]
+        return False, None
+
+    async def _write(self, key: StorageKey, part: str, value):
+        self._dirty.setdefault(self._key_builder.build(key), {})[part] = value
+        if self.flush_interval <= 0:
+            await self.flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_interval)
+        self._flush_task = None
+        try:
+            await self.flush()
+        except Exception:
+            logging.exception("Failed to flush FSM storage")
+            if self._dirty and self._flush_task is None:
+                self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def flush(self):
+        """Write all buffered changes in one transaction"""
+        async with self._flush_lock:
+            if self._dirty:
+                await self._flush_batch()
+
+    async def _flush_batch(self):
+        self._flushing, self._dirty = self._dirty, {}
+        batch = self._flushing
+
+        # Finished dialogs (state.clear()) are deleted instead of stored
+        cleared = [k for k, e in batch.items() if e.get('state', 0) is None and e.get('data', 0) == {}]
+        both = [k for k, e in batch.items() if 'state' in e and 'data' in e and k not in cleared]
+        state_only = [k for k, e in batch.items() if 'data' not in e]
+        data_only = [k for k, e in batch.items() if 'state' not in e]
+
+        try:
+            async with get_connection() as conn:
+                async with conn.transaction():
+                    if cleared:
+                        await conn.execute('DELETE FROM fsm_storage WHERE key = ANY($1)', cleared)
+                    if both:
+                        await conn.execute('''
+                            INSERT INTO fsm_storage (key, state, data, updated_at)
+                            SELECT k, s, d::jsonb, NOW() FROM unnest($1::text[], $2::text[], $3::text[]) AS t(k, s, d)
+                            ON CONFLICT (key) DO UPDATE
+                            SET state = EXCLUDED.state, data = EXCLUDED.data, updated_at = NOW()
+                        ''', both, [batch[k]['state'] for k in both], [json.dumps(batch[k]['data']) for k in both])
+                    if state_only:
+                        await conn.execute('''
+                            INSERT INTO fsm_storage (key, state, updated_at)
+                            SELECT k, s, NOW() FROM unnest($1::text[], $2::text[]) AS t(k, s)
+                            ON CONFLICT (key) DO UPDATE
+                            SET state = EXCLUDED.state, updated_at = NOW()
+                        ''', state_only, [batch[k]['state'] for k in state_only])
+                    if data_only:
+                        await conn.execute('''
+                            INSERT INTO fsm_storage (key, data, updated_at)
+                            SELECT k, d::jsonb, NOW() FROM unnest($1::text[], $2::text[]) AS t(k, d)
+                            ON CONFLICT (key) DO UPDATE
+                            SET data = EXCLUDED.data, updated_at = NOW()
+                        ''', data_only, [json.dumps(batch[k]['data']) for k in data_only])
+
+                    if time.monotonic() - self._last_cleanup > CLEANUP_INTERVAL:
+                        self._last_cleanup = time.monotonic()
+                        await conn.execute(
+                            'DELETE FROM fsm_storage WHERE updated_at < NOW() - make_interval(secs => $1)',
+                            float(self.ttl)
+                        )
+        except Exception:
+            # Put the batch back, newer writes win
+            for key, entry in batch.items():
+                self._dirty[key] = {**entry, **self._dirty.get(key, {})}
+            raise
+        finally:
+            self._flushing = {}
+
+    async def _read(self, key: str, column: str):
+        async with get_connection() as conn:
+            return await conn.fetchval(f'''
+                SELECT {column} FROM fsm_storage
+                WHERE key = $1 AND updated_at > NOW() - make_interval(secs => $2)
+            ''', key, float(self.ttl))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._write(key, 'state', state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        storage_key = self._key_builder.build(key)
+        found, state = self._buffered(storage_key, 'state')
+        if found:
+            return state
+        return await self._read(storage_key, 'state')
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self._write(key, 'data', dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        storage_key = self._key_builder.build(key)
+        found, data = self._buffered(storage_key, 'data')
+        if found:
+            return dict(data)
+        data = await self._read(storage_key, 'data')
+        return json.loads(data) if data else {}
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+def create_storage() -> BaseStorage:
+    """FSM storage selected by FSM_STORAGE"""
+    if FSM_STORAGE == "postgres":
+        return PostgresStorage()
+    if FSM_STORAGE == "redis":
+        # Optional dependency: pip install redis
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(
+            REDIS_URL,
+            key_builder=DefaultKeyBuilder(with_destiny=True),
+            state_ttl=FSM_STATE_TTL,
+            data_ttl=FSM_STATE_TTL
+        )
+    return MemoryStorage()
@@ -7,10 +7,13 @@ from keyboards.inline_kb import (
     get_main_menu, 
     get_request_type_keyboard,
     get_cancel_keyboard,
-    get_admin_action_keyboard
+    get_pagination_keyboard,
+    parse_page_callback
 )
 from db.queries import save_report, get_report, get_user_reports
-from config import ADMIN_GROUP_ID
+from assignment import route_report
+from attachments import collect, message_text
+import render
 
 router = Router()
 
@@ -89,7 +92,7 @@ async def select_report_type(callback: CallbackQuery, state: FSMContext):
     
     await callback.message.edit_text(
         f"📝 Выбрано: {report_type}\n\n"
-        "Опишите проблему подробно:",
+        "Опишите проблему подробно (можно приложить фото, документ или голосовое сообщение):",
         reply_markup=get_cancel_keyboard()
     )
     await state.set_state(ReportStates.waiting_for_message)
@@ -105,91 +108,61 @@ async def cancel_report(callback: CallbackQuery, state: FSMContext):
     )
     await callback.answer()
 
-@router.message(ReportStates.waiting_for_message)
-async def process_report_message(message: Message, state: FSMContext, bot: Bot):
-    """Process user's report message"""
+@router.message(ReportStates.waiting_for_message, flags={"report_guard": True, "album": True})
+async def process_report_message(message: Message, state: FSMContext, bot: Bot, album: list = None) -> int:
+    """Process user's report: text, photos, documents or voice notes, alone or as an album
+
+    Returns the new report's ID (for the report guard).
+    """
+    messages = album or [message]
+    report_text = message_text(messages)
+    files = collect(messages)
+    if not report_text and not files:
+        await message.answer(
+            "❌ Отправьте текст обращения, фото, документ или голосовое сообщение",
+            reply_markup=get_cancel_keyboard()
+        )
+        return None
+    
     data = await state.get_data()
     report_type = data.get('report_type')
     
-    # Save to database
-    report_id = save_report(
+    # Routed to a staff member if assignment is on, else straight to the group
+    assigned_user_id, notifications = route_report(report_type, message.from_user.username)
+    
+    # Save to database; the confirmation, the assignee's message and the admin
+    # group notification (alone or merged into a digest during floods) are
+    # sent by the outbox relay
+    report_id = await save_report(
         user_id=message.from_user.id,
         user_name=message.from_user.full_name,
         report_type=report_type,
-        report_text=message.text
-    )
-    
-    # Send to user confirmation
-    await message.answer(
-        f"✅ Ваше обращение #{report_id} принято!\n\n"
-        f"📌 Тип: {report_type}\n"
-        f"📊 Статус: Ожидает обработки\n\n"
-        "Мы свяжемся с вами в ближайшее время.",
-        reply_markup=get_main_menu()
-    )
-    
-    # Send to admin group
-    admin_message = (
-        f"🔔 НОВОЕ ОБРАЩЕНИЕ #{report_id}\n\n"
-        f"👤 От: {message.from_user.full_name} (@{message.from_user.username or 'без username'})\n"
-        f"🆔 User ID: {message.from_user.id}\n"
-        f"📌 Тип: {report_type}\n"
-        f"📊 Статус: Pending\n\n"
-        f"💬 Сообщение:\n{message.text}\n\n"
-        f"⏰ Время: {message.date.strftime('%d.%m.%Y %H:%M')}"
-    )
-    
-    await bot.send_message(
-        chat_id=ADMIN_GROUP_ID,
-        text=admin_message,
-        reply_markup=get_admin_action_keyboard(report_id)
+        report_text=report_text,
+        notifications=notifications,
+        assigned_user_id=assigned_user_id,
+        attachments=files
     )
     
     await state.clear()
+    return report_id
 
-@router.callback_query(F.data == "my_requests")
+@router.callback_query(F.data.startswith("my_requests"))
 async def my_reports(callback: CallbackQuery):
-    """Show user's reports"""
+    """Show user's reports (10 per page)"""
     user_id = callback.from_user.id
-    reports = get_user_reports(user_id)
+    direction, cursor = parse_page_callback(callback.data)
+    page = await get_user_reports(user_id, cursor, direction)
     
-    if not reports:
+    if not page.rows:
         await callback.answer("У вас пока нет обращений", show_alert=True)
         return
     
-    # Format reports list
-    reports_text = "📋 Ваши обращения:\n\n"
-    
-    for report in reports[:10]:  # Show last 10 reports
-        status_emoji = {
-            'pending': '⏳',
-            'in_progress': '🔄',
-            'completed': '✅'
-        }.get(report['status'], '❓')
-        
-        status_text = {
-            'pending': 'Ожидает',
-            'in_progress': 'В работе',
-            'completed': 'Выполнено'
-        }.get(report['status'], 'Неизвестно')
-        
-        reports_text += (
-            f"{status_emoji} Обращение #{report['id']}\n"
-            f"Тип: {report['report_type']}\n"
-            f"Статус: {status_text}\n"
-        )
-        
-        if report['responsible_user_name']:
-            reports_text += f"Ответственный: {report['responsible_user_name']}\n"
-        
-        if report['completed_at']:
-            reports_text += f"Завершено: {report['completed_at'].strftime('%d.%m.%Y %H:%M')}\n"
-        
-        reports_text += "\n"
+    # Rows that don't fit into one message move to the next page
+    reports_text, page = render.fit_page("📋 Ваши обращения:\n\n", page, render.user_item)
     
     await callback.message.edit_text(
         reports_text,
-        reply_markup=get_cancel_keyboard()
+        reply_markup=get_pagination_keyboard("my_requests", page, with_cancel=True)
     )
     await callback.answer()
 
@@ -197,7 +170,7 @@ async def my_reports(callback: CallbackQuery):
 async def view_report_details(callback: CallbackQuery):
     """View detailed report information"""
     report_id = int(callback.data.split("_")[2])
-    report = get_report(report_id)
+    report = await get_report(report_id)
     
     if not report:
         await callback.answer("❌ Обращение не найдено", show_alert=True)
@@ -208,31 +181,5 @@ async def view_report_details(callback: CallbackQuery):
         await callback.answer("❌ Это не ваше обращение", show_alert=True)
         return
     
-    status_text = {
-        'pending': '⏳ Ожидает обработки',
-        'in_progress': '🔄 В работе',
-        'completed': '✅ Выполнено'
-    }.get(report['status'], '❓ Неизвестно')
-    
-    details = (
-        f"📋 Обращение #{report['id']}\n\n"
-        f"📌 Тип: {report['report_type']}\n"
-        f"📊 Статус: {status_text}\n"
-        f"⏰ Создано: {report['created_at'].strftime('%d.%m.%Y %H:%M')}\n\n"
-        f"💬 Ваше сообщение:\n{report['report_text']}\n"
-    )
-    
-    if report['responsible_user_name']:
-        details += f"\n👤 Ответственный: {report['responsible_user_name']}\n"
-    
-    if report['taken_at']:
-        details += f"🕐 Взято в работу: {report['taken_at'].strftime('%d.%m.%Y %H:%M')}\n"
-    
-    if report['admin_response']:
-        details += f"\n🔧 Ответ:\n{report['admin_response']}\n"
-    
-    if report['completed_at']:
-        details += f"\n✅ Завершено: {report['completed_at'].strftime('%d.%m.%Y %H:%M')}"
-    
-    await callback.message.edit_text(details, reply_markup=get_cancel_keyboard())
+    await callback.message.edit_text(render.fit_text(render.user_details(report)), reply_markup=get_cancel_keyboard())
     await callback.answer()
@@ -1,8 +1,11 @@
+from typing import NamedTuple, Optional
+from datetime import datetime, timedelta
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-def get_main_menu() -> InlineKeyboardMarkup:
-    """Главное меню для пользователя"""
+_EPOCH = datetime(1970, 1, 1)
+
+def _build_main_menu() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.row(
         InlineKeyboardButton(text="🔧 Сообщить о проблеме", callback_data="report_problem")
@@ -18,8 +21,7 @@ def get_main_menu() -> InlineKeyboardMarkup:
     )
     return builder.as_markup()
 
-def get_request_type_keyboard() -> InlineKeyboardMarkup:
-    """Клавиатура выбора типа проблемы"""
+def _build_request_type_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.row(
         InlineKeyboardButton(text="🏫 Помещение/оборудование", callback_data="type_facility")
@@ -35,6 +37,30 @@ def get_request_type_keyboard() -> InlineKeyboardMarkup:
     )
     return builder.as_markup()
 
+def _build_cancel_keyboard() -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        InlineKeyboardButton(text="❌ Отменить", callback_data="cancel")
+    )
+    return builder.as_markup()
+
+# Static keyboards are built once and shared by all messages (never mutate them)
+_MAIN_MENU = _build_main_menu()
+_REQUEST_TYPE_KEYBOARD = _build_request_type_keyboard()
+_CANCEL_KEYBOARD = _build_cancel_keyboard()
+
+def get_main_menu() -> InlineKeyboardMarkup:
+    """Главное меню для пользователя"""
+    return _MAIN_MENU
+
+def get_request_type_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура выбора типа проблемы"""
+    return _REQUEST_TYPE_KEYBOARD
+
+def get_cancel_keyboard() -> InlineKeyboardMarkup:
+    """Кнопка отмены"""
+    return _CANCEL_KEYBOARD
+
 def get_admin_action_keyboard(request_id: int) -> InlineKeyboardMarkup:
     """Кнопка для админа - взяться за работу"""
     builder = InlineKeyboardBuilder()
@@ -46,11 +72,154 @@ def get_admin_action_keyboard(request_id: int) -> InlineKeyboardMarkup:
     )
     return builder.as_markup()
 
-def get_cancel_keyboard() -> InlineKeyboardMarkup:
-    """Кнопка отмены"""
+def get_broadcast_confirm_keyboard() -> InlineKeyboardMarkup:
+    """Отправить или отменить рассылку"""
     builder = InlineKeyboardBuilder()
-    builder.row(
-        InlineKeyboardButton(text="❌ Отменить", callback_data="cancel")
-    )
+    builder.button(text="✅ Отправить", callback_data="bc_confirm")
+    builder.button(text="❌ Отмена", callback_data="bc_abort")
     return builder.as_markup()
 
+def get_broadcast_abort_keyboard() -> InlineKeyboardMarkup:
+    """Отмена рассылки, пока ждем текст"""
+    builder = InlineKeyboardBuilder()
+    builder.button(text="❌ Отмена", callback_data="bc_abort")
+    return builder.as_markup()
+
+def get_broadcast_stop_keyboard(broadcast_id: int) -> InlineKeyboardMarkup:
+    """Остановить идущую рассылку"""
+    builder = InlineKeyboardBuilder()
+    builder.button(text="⛔ Остановить", callback_data=f"bc_stop:{broadcast_id}")
+    return builder.as_markup()
+
+def get_digest_keyboard(report_ids: list) -> Optional[InlineKeyboardMarkup]:
+    """Кнопки «взять» для каждого обращения в сводке"""
+    if not report_ids:
+        return None
+    builder = InlineKeyboardBuilder()
+    for report_id in report_ids:
+        builder.button(text=f"✅ #{report_id}", callback_data=f"take_request_{report_id}")
+    builder.adjust(3)
+    return builder.as_markup()
+
+def encode_cursor(cursor) -> str:
+    """Pack (created_at, id) cursor into callback data"""
+    created_at, report_id = cursor
+    microseconds = (created_at - _EPOCH) // timedelta(microseconds=1)
+    return f"{microseconds}:{report_id}"
+
+def parse_page_callback(data: str):
+    """Parse '<prefix>:<next|prev>:<cursor>' into (direction, cursor)
+
+    Callback data without a cursor (e.g. plain 'my_requests') means the first page.
+    """
+    parts = data.rsplit(":", 3)
+    if len(parts) < 4 or parts[1] not in ("next", "prev"):
+        return "next", None
+    _, direction, microseconds, report_id = parts
+    created_at = _EPOCH + timedelta(microseconds=int(microseconds))
+    return direction, (created_at, int(report_id))
+
+def get_pagination_keyboard(prefix: str, page, with_cancel: bool = False) -> InlineKeyboardMarkup:
+    """Кнопки «назад/вперед» по страницам списка"""
+    builder = InlineKeyboardBuilder()
+    buttons = []
+    if page.has_prev:
+        buttons.append(InlineKeyboardButton(
+            text="⬅️ Новее",
+            callback_data=f"{prefix}:prev:{encode_cursor(page.first_cursor)}"
+        ))
+    if page.has_next:
+        buttons.append(InlineKeyboardButton(
+            text="Старее ➡️",
+            callback_data=f"{prefix}:next:{encode_cursor(page.last_cursor)}"
+        ))
+    if buttons:
+        builder.row(*buttons)
+    if with_cancel:
+        builder.row(
+            InlineKeyboardButton(text="❌ Отменить", callback_data="cancel")
+        )
+    return builder.as_markup()
+
+def get_page_number_keyboard(prefix: str, page_number: int, page) -> InlineKeyboardMarkup:
+    """Кнопки «назад/вперед» для списков с номерами страниц"""
+    builder = InlineKeyboardBuilder()
+    buttons = []
+    if page.has_prev:
+        buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"{prefix}:{page_number - 1}"))
+    if page.has_next:
+        buttons.append(InlineKeyboardButton(text="Далее ➡️", callback_data=f"{prefix}:{page_number + 1}"))
+    if buttons:
+        builder.row(*buttons)
+    return builder.as_markup()
+
+# History list filters as they go into callback data ("-" is any)
+HISTORY_STATUSES = (("-", "Все"), ("pending", "⏳ Ждут"), ("in_progress", "🔄 В работе"), ("completed", "✅ Готово"))
+HISTORY_TYPES = (
+    ("-", "Все типы"),
+    ("Помещение/оборудование", "🏫 Помещение"),
+    ("Учебный процесс", "📚 Учеба"),
+    ("Персонал", "👥 Персонал"),
+    ("Предложение", "💡 Предложения"),
+    ("Обратная связь", "💬 Отзывы"),
+)
+HISTORY_PERIODS = ((0, "Все время"), (1, "24 ч"), (7, "7 дн"), (30, "30 дн"), (90, "90 дн"))
+HISTORY_NOOP = "h:-"
+_STATUS_CODES = {"-": "-", "pending": "p", "in_progress": "i", "completed": "c"}
+_CODE_STATUSES = {code: status for status, code in _STATUS_CODES.items()}
+
+class HistoryView(NamedTuple):
+    """What a history list shows: scope ('w' worker, 'u' author, 'r' all), its id and the filters"""
+    scope: str
+    target: int = 0
+    status: str = "-"
+    type_index: int = 0
+    days: int = 0
+
+    @property
+    def prefix(self) -> str:
+        # h:<scope>:<id>:<status>:<type>:<days>, a page cursor is appended after it
+        return f"h:{self.scope}:{self.target}:{_STATUS_CODES[self.status]}:{self.type_index}:{self.days}"
+
+    @property
+    def report_type(self) -> Optional[str]:
+        return HISTORY_TYPES[self.type_index][0] if self.type_index else None
+
+def parse_history_callback(data: str):
+    """Parse a history list button into (view, direction, cursor); ValueError for HISTORY_NOOP"""
+    direction, cursor = parse_page_callback(data)
+    _, scope, target, status, type_index, days = data.split(":")[:6]
+    view = HistoryView(scope, int(target), _CODE_STATUSES[status], int(type_index), int(days))
+    if not 0 <= view.type_index < len(HISTORY_TYPES):
+        raise ValueError(f"Unknown report type index {view.type_index}")
+    return view, direction, cursor
+
+def get_history_keyboard(view: HistoryView, page) -> InlineKeyboardMarkup:
+    """Фильтры по статусу, типу и периоду и «назад/вперед» по страницам"""
+    builder = InlineKeyboardBuilder()
+
+    def option(label: str, selected: bool, changed: HistoryView) -> InlineKeyboardButton:
+        # The selected option changes nothing: only answered (editing to the same text fails)
+        return InlineKeyboardButton(
+            text=f"• {label}" if selected else label,
+            callback_data=HISTORY_NOOP if selected else changed.prefix
+        )
+
+    builder.row(*(
+        option(label, view.status == status, view._replace(status=status))
+        for status, label in HISTORY_STATUSES
+    ))
+    types = [
+        option(label, view.type_index == index, view._replace(type_index=index))
+        for index, (_, label) in enumerate(HISTORY_TYPES)
+    ]
+    builder.row(*types[:3])
+    builder.row(*types[3:])
+    builder.row(*(
+        option(label, view.days == days, view._replace(days=days))
+        for days, label in HISTORY_PERIODS
+    ))
+    pages = get_pagination_keyboard(view.prefix, page)
+    for row in pages.inline_keyboard:
+        builder.row(*row)
+    return builder.as_markup()
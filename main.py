@@ -1,11 +1,33 @@
+import time
+# Process start for the "Startup:" log lines, before the heavy imports
+_STARTED = time.perf_counter()
+
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-from config import BOT_TOKEN
-from db.queries import init_db
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from config import BOT_TOKEN, BOT_MODE, METRICS_PORT, CACHE_LISTEN, CACHE_WARM_REPORTS, TELEGRAM_API_URL
+from archive import start_archiver
+from assignment import start_assignment
+from attachments import start_attachment_archive
+from broadcast import start_broadcasts
+from db.queries import init_pool, close_pool, set_ready, warm_report_cache
+from db.cache import start_cache_listener
+from db.migrate import ensure_schema
 from handlers import user, admin
+from digest import stop_digest
+from handlers.fsm_storage import create_storage
+from metrics import start_metrics_server
+from middlewares.metrics import setup_metrics
+from middlewares.album import setup_album
+from middlewares.report_guard import setup_report_guard
+from profiler import start_profiler
 from scheduler import start_scheduler
+from sender import start_sender, stop_sender
+from outbox import start_outbox, stop_outbox
+from supervisor import run_supervisor, run_worker
+from webhook import run_webhook
 
 # Configure logging
 logging.basicConfig(
@@ -13,26 +35,112 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
+def create_bot() -> Bot:
+    if TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+        return Bot(token=BOT_TOKEN, session=session)
+    return Bot(token=BOT_TOKEN)
+
+def build_dispatcher(storage=None) -> Dispatcher:
+    """Dispatcher with the middlewares and all routers"""
+    dp = Dispatcher(storage=storage)
+    setup_metrics(dp)
+    setup_album(dp)
+    setup_report_guard(dp)
+    dp.include_router(user.router)
+    dp.include_router(admin.router)
+    return dp
+
+def _elapsed_ms() -> int:
+    return round((time.perf_counter() - _STARTED) * 1000)
+
+async def init_database(background: list):
+    """Pool, schema check, then the tasks that need the database
+
+    Runs while the bot already takes updates: queries wait for set_ready().
+    The started tasks are appended to background.
+    """
+    await init_pool(ready=False)
+    await ensure_schema()
+    set_ready()
+    logging.info(f"Startup: database ready after {_elapsed_ms()} ms")
+    
+    if CACHE_LISTEN:
+        background.append(start_cache_listener())
+    # Start scheduler for reminders (runs in one process at a time)
+    background.append(start_scheduler())
+    archiver = start_archiver()
+    if archiver is not None:
+        background.append(archiver)
+    # Routing of new reports to staff by skill and load (if configured)
+    assignment = start_assignment()
+    if assignment is not None:
+        background.append(assignment)
+    # Broadcasts left unfinished by a stopped process
+    background.append(start_broadcasts())
+    
+    if CACHE_WARM_REPORTS > 0:
+        started = time.perf_counter()
+        count = await warm_report_cache(CACHE_WARM_REPORTS)
+        logging.info(f"Startup: cache warmed ({count} reports) in {round((time.perf_counter() - started) * 1000)} ms")
+
 async def main():
-    # Initialize database
-    init_db()
-    logging.info("Database initialized")
+    logging.info(f"Startup: imports in {_elapsed_ms()} ms")
+    if BOT_MODE == "supervisor":
+        # Only receives and routes updates, the workers do everything else
+        await run_supervisor(build_dispatcher().resolve_used_update_types())
+        return
+    
+    # Database setup runs in the background, updates are taken right away
+    background = []
+    init = asyncio.create_task(init_database(background))
     
     # Initialize bot and dispatcher
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
+    bot = create_bot()
+    storage = create_storage()
+    dp = build_dispatcher(storage)
     
-    # Register routers
-    dp.include_router(user.router)
-    dp.include_router(admin.router)
+    # Metrics endpoint and optional profiler
+    metrics_runner = await start_metrics_server() if METRICS_PORT else None
+    start_profiler()
     
-    # Start scheduler for reminders
-    await start_scheduler(bot)
-    logging.info("Reminder scheduler started")
+    # Start outgoing message queue
+    start_sender(bot)
+    # Relay of notifications queued in the outbox table
+    start_outbox()
+    # Local copies of report attachments (if configured)
+    attachment_archive = start_attachment_archive(bot)
+    if attachment_archive is not None:
+        background.append(attachment_archive)
     
-    # Start polling
-    logging.info("Bot started")
-    await dp.start_polling(bot)
+    # Start receiving updates
+    logging.info(f"Bot started ({BOT_MODE})")
+    if BOT_MODE == "webhook":
+        receiving = asyncio.create_task(run_webhook(bot, dp))
+    elif BOT_MODE == "worker":
+        receiving = asyncio.create_task(run_worker(bot, dp))
+    else:
+        receiving = asyncio.create_task(dp.start_polling(bot))
+    logging.info(f"Startup: receiving updates after {_elapsed_ms()} ms")
+    try:
+        # Stop if the database can't be set up, keep running once it is
+        await asyncio.wait([init, receiving], return_when=asyncio.FIRST_EXCEPTION)
+        if init.done() and init.exception() is not None:
+            logging.error("Database initialization failed, stopping")
+            init.result()
+        await receiving
+    finally:
+        for task in (init, receiving, *background):
+            task.cancel()
+        await asyncio.gather(receiving, return_exceptions=True)
+        await stop_outbox()
+        stop_digest()
+        await stop_sender()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await storage.close()
+        await close_pool()
+        logging.info("Database pool closed")
 
 if __name__ == "__main__":
     asyncio.run(main())
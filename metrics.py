@@ -0,0 +1,222 @@
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from aiohttp import web
+from config import METRICS_HOST, METRICS_PORT
+import profiler
+
+# Seconds; covers fast cache-like queries up to slow Bot API calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# All metrics in definition order, rendered by /metrics
+_registry = []
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labels)
+
+    def _samples(self):
+        for key, value in self._values.items():
+            yield self.name, key, "", value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, extra, value in self._samples():
+            lines.append(f"{name}{_format_labels(self.labels, key, extra)} {value}")
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """Current value; set directly or read from a function at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        super().__init__(name, documentation, labels)
+        self._function = None
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """Read the (unlabelled) value from function() on every scrape"""
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            try:
+                yield self.name, (), "", self._function()
+            except Exception:
+                logging.exception(f"Failed to read gauge {self.name}")
+            return
+        yield from super()._samples()
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # [per-bucket counts..., +Inf count], sum
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        counts = state[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with-block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                yield f"{self.name}_bucket", key, f'le="{le}"', cumulative
+            yield f"{self.name}_sum", key, "", total
+            yield f"{self.name}_count", key, "", cumulative
+
+def timed(histogram: Histogram, errors: Counter = None):
+    """Decorator for coroutine functions: observe duration labelled with the function name"""
+    label = histogram.labels[0]
+
+    def decorator(func):
+        name = func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(**{label: name})
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, **{label: name})
+        return wrapper
+    return decorator
+
+# Updates and handlers (middlewares/metrics.py)
+UPDATE_SECONDS = Histogram("bot_update_duration_seconds", "Time to process one update", ["type"])
+UPDATES_INFLIGHT = Gauge("bot_updates_inflight", "Updates being processed right now")
+HANDLER_SECONDS = Histogram("bot_handler_duration_seconds", "Handler latency", ["handler"])
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Handlers that raised an exception", ["handler"])
+
+# Report guard (middlewares/report_guard.py)
+REPORTS_SUPPRESSED = Counter("bot_reports_suppressed_total", "New reports not created: duplicate or rate_limit", ["reason"])
+REPORT_GUARD_USERS = Gauge("bot_report_guard_users", "Users tracked by the report guard")
+REPORT_GUARD_SECONDS = Histogram("bot_report_guard_duration_seconds", "Time the report guard adds to a new report")
+
+# Database (db/queries.py)
+DB_QUERY_SECONDS = Histogram("bot_db_query_duration_seconds", "Duration of a db.queries call", ["query"])
+DB_QUERY_ERRORS = Counter("bot_db_query_errors_total", "db.queries calls that raised", ["query"])
+
+CACHE_REQUESTS = Counter("bot_cache_requests_total", "Cache lookups by result (hit/miss)", ["cache", "result"])
+
+# Outgoing messages (sender.py)
+SEND_SECONDS = Histogram("bot_send_duration_seconds", "Bot API call duration", ["method"])
+SENT = Counter("bot_messages_sent_total", "Bot API calls that succeeded", ["method"])
+SEND_FAILURES = Counter("bot_send_failures_total", "Bot API calls that failed for good", ["method", "error"])
+SEND_RETRIES = Counter("bot_send_retries_total", "Bot API calls scheduled for retry", ["reason"])
+SEND_QUEUE_SIZE = Gauge("bot_send_queue_size", "Messages waiting in the send queue")
+
+# Reminders (scheduler.py)
+PENDING_REPORTS = Gauge("bot_pending_reports", "Reports waiting to be taken")
+SCHEDULER_LAG = Gauge("bot_scheduler_lag_seconds", "How late the scheduler is with the earliest due reminder")
+REMINDERS_SENT = Counter("bot_reminders_sent_total", "Reminders sent", ["tier"])
+
+# Assignment of new reports (assignment.py)
+ASSIGNMENTS = Counter("bot_assignments_total", "New reports by routing: assigned, group (nobody available) or disabled", ["result"])
+ASSIGNMENT_LOAD = Gauge("bot_assignment_open_reports", "Open reports counted against staff in the assignment pool")
+
+# Attachment archive (attachments.py)
+ATTACHMENTS_ARCHIVED = Counter("bot_attachments_archived_total", "Report attachments downloaded to the local archive", ["kind"])
+ATTACHMENT_DOWNLOAD_FAILURES = Counter("bot_attachment_download_failures_total", "Attachment downloads that failed", ["kind"])
+ATTACHMENT_DOWNLOAD_SECONDS = Histogram("bot_attachment_download_seconds", "Time to download one attachment")
+
+# Archive (archive.py)
+REPORTS_ARCHIVED = Counter("bot_reports_archived_total", "Completed reports moved to reports_archive")
+
+# Broadcasts (broadcast.py)
+BROADCAST_MESSAGES = Counter("bot_broadcast_messages_total", "Broadcast deliveries: sent, blocked or failed", ["result"])
+BROADCASTS_RUNNING = Gauge("bot_broadcasts_running", "Broadcasts being sent by this process")
+
+# Notification outbox (outbox.py)
+OUTBOX_SENT = Counter("bot_outbox_sent_total", "Outbox notifications delivered", ["kind"])
+OUTBOX_RETRIES = Counter("bot_outbox_retries_total", "Outbox deliveries that failed and were rescheduled", ["kind"])
+OUTBOX_FAILED = Counter("bot_outbox_failed_total", "Outbox notifications given up on", ["kind"])
+OUTBOX_DELAY = Histogram(
+    "bot_outbox_delay_seconds", "Time from queueing a notification to its delivery", ["kind"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 3600)
+)
+
+def render() -> str:
+    """All metrics in Prometheus text format"""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+async def start_metrics_server():
+    """Serve /metrics (and profiler endpoints) on METRICS_HOST:METRICS_PORT, returns the runner"""
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    profiler.add_routes(app)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    logging.info(f"Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return runner
@@ -0,0 +1,57 @@
+"""
+Album collection for handlers flagged with album (process_report_message).
+
+Telegram delivers an album as separate messages sharing a media_group_id.
+The first part starts a collection window of ALBUM_WAIT seconds and the
+handler runs once, after it, with data["album"] holding all parts in order;
+the other parts end here. The update of the first part doesn't wait for the
+window: in supervisor workers a user's updates run one after another, so
+waiting would hold back the very parts being collected.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import Message, TelegramObject
+from config import ALBUM_WAIT
+
+class AlbumMiddleware(BaseMiddleware):
+    """Inner middleware on dp.message for handlers with flags={"album": True}"""
+
+    def __init__(self):
+        # (chat_id, media_group_id) -> parts received so far
+        self.albums = {}
+        self.tasks = set()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not get_flag(data, "album") or event.media_group_id is None:
+            return await handler(event, data)
+
+        key = (event.chat.id, event.media_group_id)
+        parts = self.albums.get(key)
+        if parts is not None:
+            parts.append(event)
+            return None
+        self.albums[key] = [event]
+        task = asyncio.create_task(self._handle_album(key, handler, event, data))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return None
+
+    async def _handle_album(self, key: tuple, handler, event: Message, data: Dict[str, Any]):
+        await asyncio.sleep(ALBUM_WAIT)
+        data["album"] = sorted(self.albums.pop(key), key=lambda message: message.message_id)
+        try:
+            await handler(event, data)
+        except Exception:
+            logging.exception(f"Failed to process album {event.media_group_id} from chat {event.chat.id}")
+
+def setup_album(dp):
+    """Register album collection on the dispatcher (before the report guard, which sees whole albums)"""
+    dp.message.middleware(AlbumMiddleware())
@@ -0,0 +1,54 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from metrics import UPDATE_SECONDS, UPDATES_INFLIGHT, HANDLER_SECONDS, HANDLER_ERRORS
+import profiler
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Outer middleware on dp.update: update latency, in-flight count, profiler hook"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        event_type = event.event_type
+        profile = profiler.start_update(event.update_id, event_type)
+        UPDATES_INFLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            duration = time.perf_counter() - start
+            UPDATES_INFLIGHT.dec()
+            UPDATE_SECONDS.observe(duration, type=event_type)
+            if profile is not None:
+                profiler.finish_update(profile, duration)
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner middleware: latency and errors per handler function"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        name = data["handler"].callback.__name__
+        profiler.set_handler(name)
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - start, handler=name)
+
+def setup_metrics(dp):
+    """Register metrics middlewares on the dispatcher (applies to all routers)"""
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
@@ -0,0 +1,164 @@
+"""
+Report guard: per-user rate limit and duplicate merging for new reports.
+
+Applies to handlers flagged with report_guard (process_report_message).
+A report whose text is nearly the same as one of the user's recent reports
+is merged into that report (its duplicate_count goes up) instead of
+creating a new row and a new admin group notification; other reports take
+a token from the user's bucket, and without one the user is asked to wait.
+
+Texts are compared by bottom-k MinHash signatures of character shingles:
+the SIGNATURE_SIZE smallest shingle hashes, which estimate the Jaccard
+similarity of two texts from the signatures alone. Each update costs one
+signature (bounded by Telegram's message length) and at most
+DUPLICATE_HISTORY comparisons; state is kept for at most
+REPORT_GUARD_MAX_USERS users, least recently active are dropped first.
+"""
+import heapq
+import re
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import Message, TelegramObject
+from config import (
+    REPORT_RATE_LIMIT,
+    REPORT_RATE_PERIOD,
+    DUPLICATE_THRESHOLD,
+    DUPLICATE_WINDOW,
+    DUPLICATE_HISTORY,
+    REPORT_GUARD_MAX_USERS,
+)
+from attachments import extract, message_text
+from db.queries import merge_duplicate_report
+from keyboards.inline_kb import get_main_menu
+from metrics import REPORTS_SUPPRESSED, REPORT_GUARD_USERS, REPORT_GUARD_SECONDS
+from sender import send_message, PRIORITY_USER
+import render
+
+# Characters per shingle and shingle hashes kept per signature
+SHINGLE_SIZE = 5
+SIGNATURE_SIZE = 64
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+def signature(text: str) -> frozenset:
+    """Bottom-k MinHash signature of the text's character shingles"""
+    text = _NON_WORD.sub(" ", text.lower()).strip()
+    if len(text) <= SHINGLE_SIZE:
+        return frozenset((hash(text),))
+    shingles = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    return frozenset(heapq.nsmallest(SIGNATURE_SIZE, map(hash, shingles)))
+
+def similarity(a: frozenset, b: frozenset) -> float:
+    """Estimated Jaccard similarity of the texts behind two signatures"""
+    # The k smallest hashes of the union are in a | b; those in both
+    # signatures are exactly the ones in both texts
+    union = heapq.nsmallest(SIGNATURE_SIZE, a | b)
+    return sum(1 for h in union if h in a and h in b) / len(union)
+
+class _UserState:
+    __slots__ = ('tokens', 'updated', 'recent')
+
+    def __init__(self, now: float):
+        self.tokens = float(REPORT_RATE_LIMIT)
+        self.updated = now
+        # (report_id, signature, time) of the latest reports
+        self.recent = deque(maxlen=DUPLICATE_HISTORY)
+
+    def take(self, now: float) -> float:
+        """Take a token; seconds until one is available if there is none"""
+        rate = REPORT_RATE_LIMIT / REPORT_RATE_PERIOD
+        self.tokens = min(REPORT_RATE_LIMIT, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+    def find_duplicate(self, text_signature: frozenset, now: float):
+        """Most similar recent report at or above DUPLICATE_THRESHOLD, else None"""
+        best, best_score = None, DUPLICATE_THRESHOLD
+        for report_id, report_signature, created in self.recent:
+            if now - created > DUPLICATE_WINDOW:
+                continue
+            score = similarity(text_signature, report_signature)
+            if score >= best_score:
+                best, best_score = report_id, score
+        return best
+
+class ReportGuardMiddleware(BaseMiddleware):
+    """Inner middleware on dp.message for handlers with flags={"report_guard": True}
+
+    The handler returns the ID of the created report.
+    """
+
+    def __init__(self):
+        # user_id -> _UserState, least recently active first
+        self.users = OrderedDict()
+
+    def _user(self, user_id: int, now: float) -> _UserState:
+        state = self.users.get(user_id)
+        if state is None:
+            state = self.users[user_id] = _UserState(now)
+            if len(self.users) > REPORT_GUARD_MAX_USERS:
+                self.users.popitem(last=False)
+        else:
+            self.users.move_to_end(user_id)
+        return state
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not get_flag(data, "report_guard") or event.from_user is None:
+            return await handler(event, data)
+        # A report is a text, files with an optional caption, or an album of them
+        messages = data.get("album") or [event]
+        text = message_text(messages)
+        has_files = any(extract(message) for message in messages)
+        if not text and not has_files:
+            # Nothing to save, the handler asks again
+            return await handler(event, data)
+
+        start = time.perf_counter()
+        now = time.monotonic()
+        user = self._user(event.from_user.id, now)
+        text_signature = signature(text) if text and DUPLICATE_THRESHOLD > 0 else None
+
+        # A repeat with files becomes a report of its own: merging would drop them
+        if text_signature is not None and not has_files:
+            report_id = user.find_duplicate(text_signature, now)
+            # Completed or archived meanwhile: a new report after all
+            report = await merge_duplicate_report(report_id, event.from_user.id) if report_id else None
+            if report is not None:
+                REPORTS_SUPPRESSED.inc(reason="duplicate")
+                REPORT_GUARD_SECONDS.observe(time.perf_counter() - start)
+                await data["state"].clear()
+                send_message(
+                    event.chat.id, render.duplicate_merged(report),
+                    priority=PRIORITY_USER, reply_markup=get_main_menu()
+                )
+                return None
+
+        wait = user.take(now) if REPORT_RATE_LIMIT > 0 else 0.0
+        REPORT_GUARD_SECONDS.observe(time.perf_counter() - start)
+        if wait:
+            # The dialog stays open: the user can send the text again later
+            REPORTS_SUPPRESSED.inc(reason="rate_limit")
+            send_message(event.chat.id, render.report_rate_limited(wait), priority=PRIORITY_USER)
+            return None
+
+        report_id = await handler(event, data)
+        if report_id is not None and text_signature is not None:
+            user.recent.append((report_id, text_signature, now))
+        return report_id
+
+def setup_report_guard(dp):
+    """Register the report guard on the dispatcher (applies to flagged handlers of all routers)"""
+    guard = ReportGuardMiddleware()
+    REPORT_GUARD_USERS.set_function(lambda: len(guard.users))
+    dp.message.middleware(guard)
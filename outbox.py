@@ -0,0 +1,224 @@
+"""
+Notification outbox.
+
+Handlers don't send notifications about report changes themselves: the
+query that creates or completes a report also writes them to the outbox
+table (db/queries.py), so either both happen or neither. The relay here
+claims due rows in batches, renders each from the current report and sends
+it through the send queue, then marks it sent. A row whose process dies
+before that is claimed again after OUTBOX_LEASE seconds, so delivery is at
+least once; idempotency keys keep a notification from being queued twice.
+
+Failed deliveries are retried with backoff and marked failed after
+OUTBOX_MAX_ATTEMPTS (at once for errors that won't go away, e.g. the user
+blocked the bot). To list and requeue them:
+
+    python -m outbox failed
+    python -m outbox replay            # all failed
+    python -m outbox replay 12 15
+"""
+import argparse
+import asyncio
+import logging
+import time
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from attachments import send_with_attachments
+from config import (
+    ADMIN_GROUP_ID,
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_POLL_INTERVAL,
+    OUTBOX_LEASE,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_KEEP_DAYS,
+)
+from db.queries import (
+    init_pool, close_pool, add_report_listener,
+    claim_outbox, mark_outbox_sent, retry_outbox, get_failed_outbox, replay_outbox, purge_outbox,
+)
+from digest import notify_new_report, flush_new_reports
+from keyboards.inline_kb import get_main_menu, get_admin_action_keyboard
+from metrics import OUTBOX_SENT, OUTBOX_RETRIES, OUTBOX_FAILED, OUTBOX_DELAY
+from sender import send_message, PRIORITY_USER, PRIORITY_ADMIN
+import render
+
+# Notification kinds
+ACCEPTED = 'accepted'      # confirmation to the author of a new report
+NEW_REPORT = 'new_report'  # admin group notification, payload: {'username': ..., 'assignee': name if routed first}
+ASSIGNED = 'assigned'      # direct message to the staff member a report is routed to (assignment.py)
+COMPLETED = 'completed'    # answer to the author of a completed report
+
+# A payload's "delay" postpones delivery by that many seconds (db/queries.py)
+
+# Errors retrying won't fix
+PERMANENT_ERRORS = (TelegramForbiddenError, TelegramBadRequest)
+
+# Seconds between purges of delivered rows
+PURGE_INTERVAL = 3600
+
+def _accepted(report: dict, payload: dict):
+    return send_message(
+        report['user_id'],
+        render.report_accepted(report['id'], report['report_type']),
+        priority=PRIORITY_USER,
+        reply_markup=get_main_menu()
+    )
+
+def _new_report(report: dict, payload: dict):
+    if report['status'] != 'pending':
+        # Taken before the notification went out (e.g. redelivered after a restart)
+        return None
+    text = render.new_report(report, payload.get('username'), report['created_at'])
+    if payload.get('assignee'):
+        # Routed to a staff member who hasn't taken it in time
+        text += render.assignment_expired(payload['assignee'], payload.get('delay', 0))
+    return send_with_attachments(notify_new_report(report, text), ADMIN_GROUP_ID, report, PRIORITY_ADMIN)
+
+def _assigned(report: dict, payload: dict):
+    if report['status'] != 'pending':
+        return None
+    message = send_message(
+        report['assigned_user_id'],
+        render.assigned_dm(report, payload.get('username'), payload.get('sla', 0)),
+        priority=PRIORITY_ADMIN,
+        reply_markup=get_admin_action_keyboard(report['id'])
+    )
+    return send_with_attachments(message, report['assigned_user_id'], report, PRIORITY_ADMIN)
+
+def _completed(report: dict, payload: dict):
+    return send_message(report['user_id'], render.completed_user(report), priority=PRIORITY_USER)
+
+# kind -> render and queue: (report, payload) -> future of the sent message, None to skip
+KINDS = {
+    ACCEPTED: _accepted,
+    NEW_REPORT: _new_report,
+    ASSIGNED: _assigned,
+    COMPLETED: _completed,
+}
+
+_wakeup = asyncio.Event()
+_relay_task = None
+_batches = set()
+
+def wake(*_):
+    """Look for new rows now instead of after OUTBOX_POLL_INTERVAL"""
+    _wakeup.set()
+
+def _retry_delay(attempts: int) -> float:
+    return min(3600.0, 10.0 * 2 ** (attempts - 1))
+
+async def _deliver(rows: list):
+    """Send a claimed batch and record the outcome of every row"""
+    futures = []
+    for row in rows:
+        try:
+            if row['report'] is None:
+                raise LookupError(f"report {row['report_id']} not found")
+            future = KINDS[row['kind']](row['report'], row['payload'])
+            if future is None:
+                future = asyncio.get_running_loop().create_future()
+                future.set_result(None)
+        except Exception as e:
+            future = asyncio.get_running_loop().create_future()
+            future.set_exception(e)
+        futures.append(future)
+    results = await asyncio.gather(*futures, return_exceptions=True)
+
+    sent, retries = [], []
+    for row, result in zip(rows, results):
+        if not isinstance(result, BaseException):
+            sent.append(row['id'])
+            OUTBOX_SENT.inc(kind=row['kind'])
+            delay = time.time() - row['created_at'].timestamp() - row['payload'].get('delay', 0)
+            OUTBOX_DELAY.observe(max(0.0, delay), kind=row['kind'])
+            continue
+        give_up = (
+            isinstance(result, PERMANENT_ERRORS + (LookupError,))
+            or row['attempts'] >= OUTBOX_MAX_ATTEMPTS
+        )
+        if give_up:
+            OUTBOX_FAILED.inc(kind=row['kind'])
+            logging.error(f"Outbox {row['id']} ({row['kind']} #{row['report_id']}) failed: {result!r}")
+        else:
+            OUTBOX_RETRIES.inc(kind=row['kind'])
+        retries.append((row['id'], repr(result), None if give_up else _retry_delay(row['attempts'])))
+
+    if sent:
+        await mark_outbox_sent(sent)
+    await retry_outbox(retries)
+
+def _batch_done(task: asyncio.Task):
+    _batches.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        # Rows stay claimed and are delivered again after the lease
+        logging.error("Outbox batch failed", exc_info=task.exception())
+
+async def _relay_loop():
+    last_purge = 0.0
+    while True:
+        _wakeup.clear()
+        rows = []
+        try:
+            rows = await claim_outbox(OUTBOX_BATCH_SIZE, OUTBOX_LEASE)
+            if OUTBOX_KEEP_DAYS > 0 and time.monotonic() - last_purge > PURGE_INTERVAL:
+                last_purge = time.monotonic()
+                await purge_outbox(OUTBOX_KEEP_DAYS)
+        except Exception:
+            logging.exception("Outbox relay failed")
+        if rows:
+            # Digested notifications wait for their digest, don't hold up the next batch
+            task = asyncio.create_task(_deliver(rows))
+            _batches.add(task)
+            task.add_done_callback(_batch_done)
+            if len(rows) == OUTBOX_BATCH_SIZE:
+                continue
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=OUTBOX_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+def start_outbox():
+    """Start the relay; new and completed reports wake it up"""
+    global _relay_task
+    add_report_listener(lambda event, report: event in ('created', 'completed') and wake())
+    _relay_task = asyncio.create_task(_relay_loop())
+
+async def stop_outbox(timeout: float = 10):
+    """Stop claiming rows and wait up to timeout seconds for claimed ones (before the sender stops)
+
+    Rows still unconfirmed are delivered again after their lease runs out.
+    """
+    if _relay_task is not None:
+        _relay_task.cancel()
+    # Let claimed batches queue their messages, then send their digest now
+    await asyncio.sleep(0)
+    flush_new_reports()
+    if _batches:
+        _, pending = await asyncio.wait(set(_batches), timeout=timeout)
+        for task in pending:
+            task.cancel()
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    failed = sub.add_parser("failed", help="list failed notifications")
+    failed.add_argument("--limit", type=int, default=100)
+    replay = sub.add_parser("replay", help="queue failed notifications for delivery again")
+    replay.add_argument("ids", type=int, nargs="*", help="outbox ids (default: all failed)")
+    args = parser.parse_args()
+
+    await init_pool()
+    try:
+        if args.command == "failed":
+            rows = await get_failed_outbox(args.limit)
+            for row in rows:
+                print(f"{row['id']:>8}  {row['idempotency_key']:<28} attempts {row['attempts']}  "
+                      f"{row['created_at']:%d.%m.%Y %H:%M}  {row['last_error']}")
+            print(f"{len(rows)} failed")
+        else:
+            count = await replay_outbox(args.ids or None)
+            print(f"Queued {count} notifications, the running bot sends them within {OUTBOX_POLL_INTERVAL:g}s")
+    finally:
+        await close_pool()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,141 @@
+"""
+Sampling profiler for slow updates.
+
+While enabled, a background thread samples the event loop thread's stack
+every PROFILER_INTERVAL seconds and charges the sample to the update whose
+task is running at that moment. The PROFILER_KEEP slowest updates are kept
+with their most frequent stacks. Switch it on at runtime:
+
+    curl -X POST 'http://127.0.0.1:9100/debug/profiler?enabled=1'
+    curl http://127.0.0.1:9100/debug/slow-updates
+"""
+import asyncio
+import heapq
+import itertools
+import sys
+import threading
+import time
+from collections import Counter
+from aiohttp import web
+from config import PROFILER_ENABLED, PROFILER_INTERVAL, PROFILER_KEEP
+
+# Frames shown per sampled stack, innermost last
+STACK_DEPTH = 12
+
+class UpdateProfile:
+    __slots__ = ('update_id', 'event_type', 'handler', 'duration', 'samples')
+
+    def __init__(self, update_id: int, event_type: str):
+        self.update_id = update_id
+        self.event_type = event_type
+        self.handler = None
+        self.duration = 0.0
+        self.samples = Counter()
+
+_enabled = False
+_loop = None
+_loop_thread_id = None
+_sampler = None
+# task -> UpdateProfile of the update it processes
+_running = {}
+# min-heap of (duration, seq, UpdateProfile) - the slowest updates
+_slowest = []
+_seq = itertools.count()
+
+def is_enabled() -> bool:
+    return _enabled
+
+def enable():
+    """Start sampling (call from the event loop thread)"""
+    global _enabled, _loop, _loop_thread_id, _sampler
+    if _enabled:
+        return
+    _enabled = True
+    _loop = asyncio.get_running_loop()
+    _loop_thread_id = threading.get_ident()
+    _sampler = threading.Thread(target=_sample_loop, name="profiler", daemon=True)
+    _sampler.start()
+
+def disable():
+    """Stop sampling, collected slow updates are kept"""
+    global _enabled
+    _enabled = False
+    _running.clear()
+
+def _format_stack(frame) -> tuple:
+    stack = []
+    while frame is not None and len(stack) < STACK_DEPTH:
+        code = frame.f_code
+        stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno} {code.co_name}")
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+def _sample_loop():
+    while _enabled:
+        time.sleep(PROFILER_INTERVAL)
+        profile = _running.get(asyncio.current_task(_loop))
+        if profile is None:
+            continue
+        frame = sys._current_frames().get(_loop_thread_id)
+        if frame is not None:
+            profile.samples[_format_stack(frame)] += 1
+
+def start_update(update_id: int, event_type: str):
+    """Register the current task as processing an update, returns its profile or None"""
+    if not _enabled:
+        return None
+    profile = UpdateProfile(update_id, event_type)
+    _running[asyncio.current_task()] = profile
+    return profile
+
+def set_handler(name: str):
+    """Name the handler that processes the current task's update"""
+    profile = _running.get(asyncio.current_task())
+    if profile is not None:
+        profile.handler = name
+
+def finish_update(profile: UpdateProfile, duration: float):
+    _running.pop(asyncio.current_task(), None)
+    profile.duration = duration
+    item = (duration, next(_seq), profile)
+    if len(_slowest) < PROFILER_KEEP:
+        heapq.heappush(_slowest, item)
+    elif duration > _slowest[0][0]:
+        heapq.heapreplace(_slowest, item)
+
+def dump_slow_updates(top_stacks: int = 5) -> str:
+    """Slowest updates with their most sampled stacks, slowest first"""
+    if not _slowest:
+        return "No profiled updates" + ("" if _enabled else " (profiler is disabled)") + "\n"
+    lines = []
+    for duration, _, profile in sorted(_slowest, key=lambda item: -item[0]):
+        total = sum(profile.samples.values())
+        lines.append(
+            f"update {profile.update_id} ({profile.event_type}, {profile.handler or 'no handler'}): "
+            f"{duration * 1000:.1f} ms, {total} samples"
+        )
+        for stack, count in profile.samples.most_common(top_stacks):
+            lines.append(f"  {count} samples:")
+            lines.extend(f"    {frame}" for frame in stack)
+        lines.append("")
+    return "\n".join(lines)
+
+def add_routes(app: web.Application):
+    """Profiler switch and dump endpoints"""
+
+    async def switch(request: web.Request) -> web.Response:
+        if request.query.get("enabled", "1") in ("1", "true"):
+            enable()
+        else:
+            disable()
+        return web.json_response({"enabled": _enabled})
+
+    async def slow_updates(request: web.Request) -> web.Response:
+        return web.Response(text=dump_slow_updates())
+
+    app.router.add_post("/debug/profiler", switch)
+    app.router.add_get("/debug/slow-updates", slow_updates)
+
+def start_profiler():
+    if PROFILER_ENABLED:
+        enable()
@@ -0,0 +1,503 @@
+"""
+Texts of report messages.
+
+Every report card the bot sends is built here from module-level templates,
+so handlers, digests and the scheduler don't assemble f-strings by hand and
+the status labels are created once. Telegram rejects messages longer than
+MESSAGE_LIMIT characters: split_text() cuts a long text into several
+messages at paragraph or line boundaries, fit_page() shortens a list page
+that has to stay one message and fit_text() truncates what can't be split.
+"""
+from aiogram.types import Message
+
+# Telegram's limit for message text, in characters
+MESSAGE_LIMIT = 4096
+
+STATUS_EMOJI = {
+    'pending': '⏳',
+    'in_progress': '🔄',
+    'completed': '✅',
+}
+STATUS_TEXT = {
+    'pending': 'Ожидает',
+    'in_progress': 'В работе',
+    'completed': 'Завершено',
+}
+# Users see "Выполнено" rather than "Завершено"
+USER_STATUS_TEXT = {
+    'pending': 'Ожидает',
+    'in_progress': 'В работе',
+    'completed': 'Выполнено',
+}
+USER_STATUS_LONG = {
+    'pending': '⏳ Ожидает обработки',
+    'in_progress': '🔄 В работе',
+    'completed': '✅ Выполнено',
+}
+
+def _datetime(value) -> str:
+    return value.strftime('%d.%m.%Y %H:%M')
+
+def _short(value) -> str:
+    return value.strftime('%d.%m %H:%M')
+
+def _cut(text: str, length: int) -> str:
+    return text[:length] + "..." if len(text) > length else text
+
+# Templates are filled with str.format: report fields plus the named extras
+
+_NEW_REPORT = (
+    "🔔 НОВОЕ ОБРАЩЕНИЕ #{id}\n\n"
+    "👤 От: {user_name} (@{username})\n"
+    "🆔 User ID: {user_id}\n"
+    "📌 Тип: {report_type}\n"
+    "📊 Статус: Pending\n\n"
+    "💬 Сообщение:\n{report_text}\n\n"
+    "{files}"
+    "⏰ Время: {time}"
+)
+
+_REPORT_ACCEPTED = (
+    "✅ Ваше обращение #{id} принято!\n\n"
+    "📌 Тип: {report_type}\n"
+    "📊 Статус: Ожидает обработки\n\n"
+    "Мы свяжемся с вами в ближайшее время."
+)
+
+_TAKEN_FOOTER = "\n\n✅ Взял(а) в работу: {worker_name}\n🕐 Время: {time}"
+
+_TAKEN_DM = (
+    "✅ Вы взяли обращение #{id} в работу\n\n"
+    "👤 От: {user_name}\n"
+    "🆔 User ID: {user_id}\n"
+    "📌 Тип: {report_type}\n"
+    "💬 Сообщение:\n{report_text}\n\n"
+    "📊 Статус: В работе\n"
+    "⏰ Создано: {created}\n\n"
+    "Когда выполните работу, отправьте ответ:\n"
+    "/complete_{id} [ваш ответ]\n\n"
+    "Пример:\n"
+    "/complete_{id} Проблема решена, заменили оборудование"
+)
+
+_COMPLETE_USAGE = (
+    "❌ Укажите ответ после команды:\n\n"
+    "Формат:\n"
+    "/complete_{id} [ваш ответ]\n\n"
+    "Пример:\n"
+    "/complete_{id} Проблема решена, заменили оборудование"
+)
+
+_ALREADY_COMPLETED = (
+    "⚠️ Обращение #{id} уже завершено\n"
+    "Завершил: {responsible_user_name}\n"
+    "Время: {completed}"
+)
+
+_NOT_RESPONSIBLE = (
+    "❌ Вы не ответственный за это обращение\n"
+    "Ответственный: {responsible_user_name}"
+)
+
+_COMPLETED_ADMIN = (
+    "✅ Обращение #{id} завершено!\n\n"
+    "📌 Тип: {report_type}\n"
+    "👤 От: {user_name}\n"
+    "💬 Проблема: {problem}...\n\n"
+    "🔧 Ваш ответ: {admin_response}\n\n"
+    "Пользователь получил уведомление. ✉️"
+)
+
+_COMPLETED_USER = (
+    "✅ Ваше обращение #{id} выполнено!\n\n"
+    "📌 Тип: {report_type}\n"
+    "⏰ Создано: {created}\n"
+    "✓ Завершено: Сейчас\n\n"
+    "💬 Ваше сообщение:\n{report_text}\n\n"
+    "🔧 Ответ ({responsible_user_name}):\n{admin_response}\n\n"
+    "Спасибо за обращение! 🙏"
+)
+
+_ASSIGNED_DM = (
+    "📥 Вам назначено обращение #{id}\n\n"
+    "👤 От: {user_name} (@{username})\n"
+    "🆔 User ID: {user_id}\n"
+    "📌 Тип: {report_type}\n\n"
+    "💬 Сообщение:\n{report_text}\n\n"
+    "{files}"
+    "⏰ Создано: {created}\n\n"
+    "Возьмите его в работу кнопкой ниже в течение {minutes} мин, "
+    "иначе обращение уйдет в общую группу."
+)
+
+_ASSIGNMENT_EXPIRED = "\n\n⏱ Было назначено: {name}, не взято за {minutes} мин"
+
+_REMINDER = (
+    "⚠️ НАПОМИНАНИЕ ({tier}/{tiers}): "
+    "Обращение без ответа уже {age}!\n\n"
+    "📋 Обращение #{id}\n"
+    "⏰ Создано: {created}\n\n"
+    "👤 От: {user_name}\n"
+    "📌 Тип: {report_type}\n"
+    "💬 Сообщение:\n{text}...\n\n"
+    "❗ Пожалуйста, возьмите обращение в работу!"
+)
+
+_ADMIN_DETAILS = (
+    "{emoji} Обращение #{id}\n\n"
+    "👤 От: {user_name}\n"
+    "🆔 User ID: {user_id}\n"
+    "📌 Тип: {report_type}\n"
+    "📊 Статус: {status_text}\n"
+    "⏰ Создано: {created}\n{repeats}{files}\n"
+    "💬 Сообщение:\n{report_text}\n"
+)
+
+_REPEATS = "🔁 Автор писал об этом еще раз: {count}\n"
+
+_FILES = "📎 Вложений: {count}\n"
+
+_ATTACHMENTS_CAPTION = "📎 Вложения к обращению #{id} ({count})"
+
+_DUPLICATE_MERGED = (
+    "🔁 Похоже, вы уже сообщали об этом: обращение #{id} ({status_text}).\n\n"
+    "Мы отметили, что вопрос все еще актуален, — отдельное обращение не создано."
+)
+
+_RATE_LIMITED = (
+    "⏳ Вы отправили много обращений подряд.\n\n"
+    "Новое обращение можно будет отправить через {minutes} мин."
+)
+
+_USER_DETAILS = (
+    "📋 Обращение #{id}\n\n"
+    "📌 Тип: {report_type}\n"
+    "📊 Статус: {status_text}\n"
+    "⏰ Создано: {created}\n\n"
+    "💬 Ваше сообщение:\n{report_text}\n"
+)
+
+_PENDING_ITEM = (
+    "📋 #{id} - {report_type}\n"
+    "👤 {user_name}\n"
+    "⏰ {created}\n"
+    "💬 {text}...\n\n"
+)
+
+_IN_PROGRESS_ITEM = (
+    "📋 #{id} - {report_type}\n"
+    "👤 Пользователь: {user_name}\n"
+    "👨‍💼 Ответственный: {responsible_user_name}\n"
+    "🕐 Взято: {taken}\n\n"
+)
+
+_COMPLETED_ITEM = (
+    "📋 #{id} - {report_type}\n"
+    "👤 Пользователь: {user_name}\n"
+    "👨‍💼 Выполнил: {responsible_user_name}\n"
+    "✓ {completed}\n\n"
+)
+
+_SEARCH_ITEM = (
+    "{emoji} #{id} - {report_type}\n"
+    "👤 {user_name} · {created}\n"
+    "💬 {snippet}\n"
+    "/report_{id}\n\n"
+)
+
+_USER_ITEM = (
+    "{emoji} Обращение #{id}\n"
+    "Тип: {report_type}\n"
+    "Статус: {status_text}\n"
+)
+
+_HISTORY_ITEM = (
+    "{emoji} #{id} · {report_type} · {created}\n"
+    "{people}\n"
+    "/report_{id}\n\n"
+)
+
+_DIGEST_ENTRY = (
+    "#{id} · {report_type}{extra}\n"
+    "👤 {user_name}\n"
+    "💬 {text}"
+)
+
+_BROADCAST_ASK = (
+    "📣 Рассылка\n"
+    "{audience}\n"
+    "Получателей: {total}\n\n"
+    "Отправьте текст сообщения одним сообщением"
+)
+
+_BROADCAST_PREVIEW = (
+    "📣 Рассылка · получателей: {total}\n"
+    "{audience}\n\n"
+    "{text}"
+)
+
+_BROADCAST_PROGRESS = (
+    "📣 Рассылка #{id} · {state}\n"
+    "{audience}\n\n"
+    "✉️ Доставлено: {sent} из {total}\n"
+    "🚫 Недоступны: {blocked}\n"
+    "⚠️ Ошибки: {failed}\n"
+    "{speed}"
+)
+
+BROADCAST_STATE = {
+    'running': '⏳ идет',
+    'done': '✅ завершена',
+    'cancelled': '⛔ остановлена',
+}
+
+def _files(report: dict, suffix: str = "") -> str:
+    count = report.get('attachment_count')
+    return _FILES.format(count=count) + suffix if count else ""
+
+def new_report(report: dict, username: str, time) -> str:
+    """Admin group notification about a new report"""
+    return _NEW_REPORT.format_map({
+        **report, 'username': username or 'без username', 'files': _files(report, "\n"),
+        'time': _datetime(time),
+    })
+
+def attachments_caption(report_id: int, count: int) -> str:
+    """Caption of the first of a report's attachments sent to admins"""
+    return _ATTACHMENTS_CAPTION.format(id=report_id, count=count)
+
+def report_accepted(report_id: int, report_type: str) -> str:
+    return _REPORT_ACCEPTED.format(id=report_id, report_type=report_type)
+
+def taken_footer(worker_name: str, time) -> str:
+    """Line appended to the group notification when a worker takes the report"""
+    return _TAKEN_FOOTER.format(worker_name=worker_name, time=_datetime(time))
+
+def taken_dm(report: dict) -> str:
+    """Private message to the worker who took the report"""
+    return _TAKEN_DM.format_map({**report, 'created': _datetime(report['created_at'])})
+
+def assigned_dm(report: dict, username: str, sla_seconds: float) -> str:
+    """Private message to the staff member a new report is routed to"""
+    return _ASSIGNED_DM.format_map({
+        **report,
+        'username': username or 'без username',
+        'files': _files(report, "\n"),
+        'created': _datetime(report['created_at']),
+        'minutes': max(1, round(sla_seconds / 60)),
+    })
+
+def assignment_expired(name: str, sla_seconds: float) -> str:
+    """Line appended to the group notification of a report the assignee didn't take"""
+    return _ASSIGNMENT_EXPIRED.format(name=name, minutes=max(1, round(sla_seconds / 60)))
+
+def complete_usage(report_id: int) -> str:
+    return _COMPLETE_USAGE.format(id=report_id)
+
+def already_completed(report: dict) -> str:
+    return _ALREADY_COMPLETED.format_map({**report, 'completed': _datetime(report['completed_at'])})
+
+def not_responsible(report: dict) -> str:
+    return _NOT_RESPONSIBLE.format_map(report)
+
+def completed_admin(report: dict) -> str:
+    """Confirmation for the worker who completed the report"""
+    return _COMPLETED_ADMIN.format_map({**report, 'problem': report['report_text'][:100]})
+
+def completed_user(report: dict) -> str:
+    """Notification for the author of a completed report"""
+    return _COMPLETED_USER.format_map({**report, 'created': _datetime(report['created_at'])})
+
+def duplicate_merged(report: dict) -> str:
+    """Answer to a report merged into the author's earlier one"""
+    return _DUPLICATE_MERGED.format(id=report['id'], status_text=USER_STATUS_TEXT.get(report['status'], 'Неизвестно'))
+
+def report_rate_limited(wait_seconds: float) -> str:
+    return _RATE_LIMITED.format(minutes=max(1, round(wait_seconds / 60)))
+
+def reminder(report: dict, tiers: int, age: str) -> str:
+    """Reminder about a report still pending at reminder tier report['tier']"""
+    return _REMINDER.format_map({
+        **report,
+        'tiers': tiers,
+        'age': age,
+        'created': _datetime(report['created_at']),
+        'text': report['report_text'][:150],
+    })
+
+def _details_tail(report: dict, responsible_id: bool) -> str:
+    tail = ""
+    if report['responsible_user_name']:
+        if responsible_id:
+            tail += f"\n👨‍💼 Ответственный: {report['responsible_user_name']}\n🆔 ID: {report['responsible_user_id']}\n"
+        else:
+            tail += f"\n👤 Ответственный: {report['responsible_user_name']}\n"
+    if report['taken_at']:
+        tail += f"🕐 Взято в работу: {_datetime(report['taken_at'])}\n"
+    if report['admin_response']:
+        tail += f"\n🔧 Ответ:\n{report['admin_response']}\n"
+    if report['completed_at']:
+        tail += f"\n✅ Завершено: {_datetime(report['completed_at'])}"
+    return tail
+
+def admin_details(report: dict) -> str:
+    """Full report card for /report_<id>"""
+    return _ADMIN_DETAILS.format_map({
+        **report,
+        'emoji': STATUS_EMOJI.get(report['status'], '❓'),
+        'status_text': STATUS_TEXT.get(report['status'], 'Неизвестно'),
+        'created': _datetime(report['created_at']),
+        'repeats': _REPEATS.format(count=report['duplicate_count']) if report.get('duplicate_count') else "",
+        'files': _files(report),
+    }) + _details_tail(report, responsible_id=True)
+
+def user_details(report: dict) -> str:
+    """Full report card for its author"""
+    return _USER_DETAILS.format_map({
+        **report,
+        'status_text': USER_STATUS_LONG.get(report['status'], '❓ Неизвестно'),
+        'created': _datetime(report['created_at']),
+    }) + _details_tail(report, responsible_id=False)
+
+def pending_item(report: dict) -> str:
+    return _PENDING_ITEM.format_map({**report, 'created': _short(report['created_at']), 'text': report['report_text'][:50]})
+
+def in_progress_item(report: dict) -> str:
+    return _IN_PROGRESS_ITEM.format_map({**report, 'taken': _short(report['taken_at'])})
+
+def completed_item(report: dict) -> str:
+    return _COMPLETED_ITEM.format_map({**report, 'completed': _short(report['completed_at'])})
+
+def search_item(report: dict) -> str:
+    return _SEARCH_ITEM.format_map({
+        **report,
+        'emoji': STATUS_EMOJI.get(report['status'], '❓'),
+        'created': report['created_at'].strftime('%d.%m.%Y'),
+    })
+
+def user_item(report: dict) -> str:
+    """Entry of the author's "Мои обращения" list"""
+    text = _USER_ITEM.format_map({
+        **report,
+        'emoji': STATUS_EMOJI.get(report['status'], '❓'),
+        'status_text': USER_STATUS_TEXT.get(report['status'], 'Неизвестно'),
+    })
+    if report['responsible_user_name']:
+        text += f"Ответственный: {report['responsible_user_name']}\n"
+    if report['completed_at']:
+        text += f"Завершено: {_datetime(report['completed_at'])}\n"
+    return text + "\n"
+
+def history_item(report: dict, author: bool = True) -> str:
+    """Entry of an admin history list: the author (with their /user_ link) and who took it"""
+    people = f"👤 {report['user_name']} /user_{report['user_id']}" if author else ""
+    if report['responsible_user_name']:
+        people += f"{' · ' if people else ''}👨‍💼 {report['responsible_user_name']}"
+    return _HISTORY_ITEM.format_map({
+        **report,
+        'emoji': STATUS_EMOJI.get(report['status'], '❓'),
+        'created': _datetime(report['created_at']),
+        'people': people or "👨‍💼 не взято",
+    })
+
+def history_header(title: str, count: int, exact: bool) -> str:
+    """Title of a history list with the number of matching reports (≈ for an estimate)"""
+    return f"{title}\nНайдено: {'' if exact else '≈'}{count:,}\n\n".replace(",", " ")
+
+def _duration(seconds: float) -> str:
+    seconds = round(seconds)
+    if seconds < 60:
+        return f"{seconds} с"
+    if seconds < 3600:
+        return f"{seconds // 60} мин {seconds % 60} с"
+    return f"{seconds // 3600} ч {seconds % 3600 // 60} мин"
+
+def broadcast_audience(filters: dict) -> str:
+    """Who a broadcast goes to, from its filters (status, type, since, until as ISO dates)"""
+    parts = []
+    if filters.get('status'):
+        parts.append(f"статус «{STATUS_TEXT.get(filters['status'], filters['status'])}»")
+    if filters.get('type'):
+        parts.append(f"тип «{filters['type']}»")
+    if filters.get('since'):
+        parts.append(f"с {filters['since'][:10]}")
+    if filters.get('until'):
+        parts.append(f"до {filters['until'][:10]}")
+    return "Авторы обращений: " + ", ".join(parts) if parts else "Все авторы обращений"
+
+def broadcast_ask(filters: dict, total: int) -> str:
+    return _BROADCAST_ASK.format(audience=broadcast_audience(filters), total=total)
+
+def broadcast_preview(filters: dict, total: int, text: str) -> str:
+    """Broadcast text as it will be sent, under a header, for confirmation"""
+    header = _BROADCAST_PREVIEW.format(audience=broadcast_audience(filters), total=total, text="")
+    return header + fit_text(text, MESSAGE_LIMIT - len(header))
+
+def broadcast_progress(broadcast: dict, rate: float = None) -> str:
+    """Progress message of a broadcast; rate is messages per second of a running one"""
+    done = broadcast['sent'] + broadcast['blocked'] + broadcast['failed']
+    if broadcast['status'] != 'running':
+        speed = ""
+    elif not rate:
+        speed = "⚡ начинаем…"
+    else:
+        left = max(0, broadcast['total'] - done)
+        speed = f"⚡ {rate:.1f} сообщ./с · осталось ≈{_duration(left / rate)}"
+    return _BROADCAST_PROGRESS.format_map({
+        **broadcast,
+        'state': BROADCAST_STATE.get(broadcast['status'], broadcast['status']),
+        'audience': broadcast_audience(broadcast['filters']),
+        'speed': speed,
+    }).rstrip()
+
+def digest_entry(report: dict, extra: str = "") -> str:
+    """Short entry of a digest message"""
+    if report.get('attachment_count'):
+        extra = f" · 📎 {report['attachment_count']}{extra}"
+    return _DIGEST_ENTRY.format_map({**report, 'extra': extra, 'text': _cut(report['report_text'], 100)})
+
+def split_text(text: str, limit: int = MESSAGE_LIMIT) -> list:
+    """Split text into messages of at most limit characters
+
+    Cuts at the last blank line, else the last line break, else the last
+    space in the second half of the window, so parts don't get tiny; text
+    without any of them is cut hard.
+    """
+    parts = []
+    while len(text) > limit:
+        window = text[:limit + 1]
+        for separator in ("\n\n", "\n", " "):
+            cut = window.rfind(separator)
+            if cut >= limit // 2:
+                break
+        else:
+            cut, separator = limit, ""
+        parts.append(text[:cut])
+        text = text[cut + len(separator):]
+    parts.append(text)
+    return parts
+
+def fit_text(text: str, limit: int = MESSAGE_LIMIT) -> str:
+    """Truncate text that must stay a single message (e.g. edit_text)"""
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+def fit_page(header: str, page, format_item, limit: int = MESSAGE_LIMIT):
+    """Render a keyset page as header + items, dropping tail rows that don't fit
+
+    Returns (text, page); dropped rows move to the next page, so the
+    returned page's last_cursor points at the last row shown.
+    """
+    text = header
+    for shown, row in enumerate(page.rows):
+        item = format_item(row)
+        if shown and len(text) + len(item) > limit:
+            return text, page._replace(rows=page.rows[:shown], has_next=True)
+        text += item
+    return fit_text(text, limit), page
+
+async def answer(message: Message, text: str, **kwargs):
+    """Reply with text split into as many messages as needed, kwargs go to the last one"""
+    *head, last = split_text(text)
+    for part in head:
+        await message.answer(part)
+    return await message.answer(last, **kwargs)
@@ -1,64 +1,231 @@
 import asyncio
-from datetime import datetime, timedelta
-from aiogram import Bot
-from db.queries import get_old_pending_reports
+import heapq
+import logging
+import time
+import asyncpg
+from db.queries import get_pending_deadlines, claim_reminders, add_report_listener
+from db.cache import CHANNEL
 from keyboards.inline_kb import get_admin_action_keyboard
-from config import ADMIN_GROUP_ID
+from config import ADMIN_GROUP_ID, DATABASE_URL, REMINDER_TIERS_HOURS, DIGEST_MODE, DIGEST_WINDOW
+from digest import send_digest
+import render
+from sender import send_message, PRIORITY_REMINDER
+from metrics import PENDING_REPORTS, SCHEDULER_LAG, REMINDERS_SENT
 
-# Store IDs of reports that already got reminders
-reminded_reports = set()
+# Deadlines are in time.monotonic() seconds. Report ages come from the
+# database (NOW() - created_at), so the bot host's clock and timezone
+# don't matter.
 
-async def check_pending_reports(bot: Bot):
-    """Check for reports pending more than 1 hour"""
+# Min-heap of (due_at, report_id, tier) - next reminder for each pending report
+_deadlines = []
+
+# report_id -> monotonic time of creation for reports that are still pending.
+# Heap entries of reports missing here are stale and skipped when popped.
+_pending = {}
+
+# Set when a new deadline is pushed, so the loop recalculates its sleep
+_wakeup = asyncio.Event()
+
+# Only the process holding this advisory lock sends reminders (several
+# bot processes or supervisor workers share one database)
+SCHEDULER_LOCK_ID = 7_142_002
+# Seconds between attempts to take the lock and leader health checks
+LEADER_CHECK_INTERVAL = 10
+# Seconds before reminders that failed to send are tried again
+REMINDER_RETRY_DELAY = 60
+
+# Reminder loop task while this process is the leader
+_loop_task = None
+# Reports changed by other processes, synced in one query
+_changed = set()
+_sync_task = None
+
+def _created(age: float) -> float:
+    """Monotonic time of creation of a report age seconds old"""
+    return time.monotonic() - age
+
+def _tier_due(created: float, tier: int) -> float:
+    return created + REMINDER_TIERS_HOURS[tier] * 3600
+
+def _schedule(report_id: int, created: float, sent_tier: int):
+    """Push deadline of the next reminder tier after sent_tier"""
+    if sent_tier >= len(REMINDER_TIERS_HOURS):
+        return
+    due_at = _tier_due(created, sent_tier)
+    heapq.heappush(_deadlines, (due_at, report_id, sent_tier + 1))
+    _wakeup.set()
+
+def on_report_event(event: str, report: dict):
+    """Keep deadlines in sync with report state changes"""
+    if _loop_task is None:
+        return
+    if event == 'created':
+        # Created by this process just now
+        _pending[report['id']] = time.monotonic()
+        _schedule(report['id'], _pending[report['id']], 0)
+    else:
+        _pending.pop(report['id'], None)
+
+def _format_age(age: float) -> str:
+    total_minutes = int(age) // 60
+    hours, minutes = divmod(total_minutes, 60)
+    return f"{hours}ч {minutes}м"
+
+def _send_single_reminder(report: dict):
+    send_message(
+        ADMIN_GROUP_ID,
+        render.reminder(report, len(REMINDER_TIERS_HOURS), _format_age(report['age'])),
+        priority=PRIORITY_REMINDER,
+        reply_markup=get_admin_action_keyboard(report['id'])
+    )
+
+async def send_reminders(due: list):
+    """Send reminders for [(report_id, tier), ...] unless already sent
+
+    Several reminders of one cycle go out as a single summary, oldest first.
+    """
+    reports = await claim_reminders(due)
+    # Reports missing here were taken in the meantime or reminded before a restart
+
+    if len(reports) == 1 or DIGEST_MODE == "off":
+        for report in reports:
+            _send_single_reminder(report)
+    elif reports:
+        reports.sort(key=lambda r: r['created_at'])
+        send_digest(
+            "⚠️ НАПОМИНАНИЕ: обращения без ответа",
+            [
+                (r['id'], render.digest_entry(r, f" — ждет {_format_age(r['age'])} ({r['tier']}/{len(REMINDER_TIERS_HOURS)})"))
+                for r in reports
+            ],
+            priority=PRIORITY_REMINDER
+        )
+
+    for report in reports:
+        REMINDERS_SENT.inc(tier=report['tier'])
+        _schedule(report['id'], _created(report['age']), report['tier'])
+
+def _lag() -> float:
+    """Seconds the earliest deadline is overdue (0 while the loop keeps up)"""
+    if not _deadlines:
+        return 0.0
+    return max(0.0, time.monotonic() - _deadlines[0][0])
+
+async def check_pending_reports():
+    """Sleep until the nearest deadline and send due reminders"""
     while True:
+        _wakeup.clear()
+        now = time.monotonic()
+
+        # With digests, reminders due within the window are pulled forward
+        # and sent together with the ones already due
+        cutoff = now if DIGEST_MODE == "off" else now + DIGEST_WINDOW
+        due = []
+        while _deadlines and _deadlines[0][0] <= cutoff:
+            due_at, report_id, tier = heapq.heappop(_deadlines)
+            if report_id not in _pending:
+                continue
+            # After downtime skip straight to the highest tier that is due
+            created = _pending[report_id]
+            while tier < len(REMINDER_TIERS_HOURS) and _tier_due(created, tier) <= cutoff:
+                tier += 1
+            due.append((report_id, tier))
+
+        if due:
+            try:
+                await send_reminders(due)
+            except Exception:
+                logging.exception(f"Failed to send reminders for reports {[report_id for report_id, _ in due]}")
+                # Popped from the heap already: put them back to try again
+                retry_at = time.monotonic() + REMINDER_RETRY_DELAY
+                for report_id, tier in due:
+                    if report_id in _pending:
+                        heapq.heappush(_deadlines, (retry_at, report_id, tier))
+            now = time.monotonic()
+
+        timeout = _deadlines[0][0] - now if _deadlines else None
         try:
-            # Get reports older than 1 hour
-            old_reports = get_old_pending_reports(hours=1)
-            
-            for report in old_reports:
-                # Skip if already reminded
-                if report['id'] in reminded_reports:
-                    continue
-                
-                # Calculate time since creation
-                time_diff = datetime.now() - report['created_at']
-                hours = time_diff.seconds // 3600
-                minutes = (time_diff.seconds % 3600) // 60
-                
-                # Send reminder
-                reminder_message = (
-                    f"⚠️ НАПОМИНАНИЕ: Обращение без ответа уже {hours}ч {minutes}м!\n\n"
-                    f"📋 Обращение #{report['id']}\n"
-                    f"⏰ Создано: {report['created_at'].strftime('%d.%m.%Y %H:%M')}\n\n"
-                    f"👤 От: {report['user_name']}\n"
-                    f"📌 Тип: {report['report_type']}\n"
-                    f"💬 Сообщение:\n{report['report_text'][:150]}...\n\n"
-                    f"❗ Пожалуйста, возьмите обращение в работу!"
-                )
-                
-                await bot.send_message(
-                    chat_id=ADMIN_GROUP_ID,
-                    text=reminder_message,
-                    reply_markup=get_admin_action_keyboard(report['id'])
-                )
-                
-                # Mark as reminded
-                reminded_reports.add(report['id'])
-                
-                # Wait between reminders
-                await asyncio.sleep(5)
-            
-            # Clear reminded reports older than 24 hours
-            if len(reminded_reports) > 100:
-                reminded_reports.clear()
-                
-        except Exception as e:
-            print(f"❌ Error in scheduler: {e}")
-        
-        # Check every 30 minutes
-        await asyncio.sleep(1800)
-
-async def start_scheduler(bot: Bot):
-    """Start the background scheduler"""
-    asyncio.create_task(check_pending_reports(bot))
-    print("✅ Reminder scheduler started - checking every 30 minutes")
+            await asyncio.wait_for(_wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+async def _sync_changed():
+    # Let a burst of notifications collect first
+    await asyncio.sleep(0.1)
+    global _sync_task
+    report_ids = list(_changed)
+    _changed.clear()
+    _sync_task = None
+    try:
+        pending = {report['id']: report for report in await get_pending_deadlines(report_ids)}
+    except Exception:
+        logging.exception(f"Failed to sync changed reports {report_ids}")
+        return
+    if _loop_task is None:
+        return
+    for report_id in report_ids:
+        report = pending.get(report_id)
+        if report is None:
+            _pending.pop(report_id, None)
+        elif report_id not in _pending:
+            _pending[report_id] = _created(report['age'])
+            _schedule(report_id, _pending[report_id], report['reminder_tier'])
+
+def _on_change(connection, pid, channel, payload: str):
+    """Report changed in any process (reports_notify trigger)"""
+    global _sync_task
+    _changed.add(int(payload.partition(":")[0]))
+    if _sync_task is None:
+        _sync_task = asyncio.create_task(_sync_changed())
+
+async def _lead(conn):
+    """Run the reminder loop while conn holds the lock"""
+    global _loop_task
+    await conn.add_listener(CHANNEL, _on_change)
+    _pending.clear()
+    _deadlines.clear()
+    for report in await get_pending_deadlines():
+        _pending[report['id']] = _created(report['age'])
+        _schedule(report['id'], _pending[report['id']], report['reminder_tier'])
+    _loop_task = asyncio.create_task(check_pending_reports())
+    logging.info(f"Reminder scheduler started - {len(_pending)} pending reports, tiers {REMINDER_TIERS_HOURS}h")
+    try:
+        # The lock goes away with the connection
+        while True:
+            await asyncio.sleep(LEADER_CHECK_INTERVAL)
+            await conn.fetchval('SELECT 1')
+    finally:
+        _loop_task.cancel()
+        _loop_task = None
+        _pending.clear()
+        _deadlines.clear()
+        _changed.clear()
+
+async def _elect():
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(DATABASE_URL)
+            while not await conn.fetchval('SELECT pg_try_advisory_lock($1)', SCHEDULER_LOCK_ID):
+                await asyncio.sleep(LEADER_CHECK_INTERVAL)
+            await _lead(conn)
+        except asyncio.CancelledError:
+            if conn is not None:
+                await conn.close()
+            raise
+        except Exception:
+            logging.exception("Reminder scheduler lost its database connection")
+        if conn is not None:
+            conn.terminate()
+        await asyncio.sleep(LEADER_CHECK_INTERVAL)
+
+def start_scheduler() -> asyncio.Task:
+    """Start the reminder scheduler once this process is elected leader
+
+    Cancelling the returned task stops the reminder loop and closes the
+    leader connection.
+    """
+    add_report_listener(on_report_event)
+    PENDING_REPORTS.set_function(lambda: len(_pending))
+    SCHEDULER_LAG.set_function(_lag)
+    return asyncio.create_task(_elect())
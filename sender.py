@@ -0,0 +1,292 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from aiogram import Bot
+from aiogram.methods import SendMediaGroup, SendMessage
+from aiogram.methods.base import TelegramMethod
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramServerError
+from config import (
+    SEND_GLOBAL_RATE,
+    SEND_GROUP_RATE,
+    SEND_PRIVATE_RATE,
+    SEND_CONCURRENCY,
+    SEND_MAX_RETRIES,
+    SEND_MAX_FLOOD_RETRIES,
+    BROADCAST_RATE,
+    BOT_MODE,
+    WORKERS,
+)
+from render import split_text
+from metrics import SEND_SECONDS, SENT, SEND_FAILURES, SEND_RETRIES, SEND_QUEUE_SIZE
+
+# Priorities: lower value is sent first
+PRIORITY_USER = 0      # confirmations and answers to users
+PRIORITY_ADMIN = 1     # admin group notifications and admin DMs
+PRIORITY_REMINDER = 2  # scheduler reminders
+PRIORITY_BROADCAST = 3 # announcements, sent only when nothing else waits
+
+class TokenBucket:
+    """Token bucket that hands out send slots in order.
+
+    reserve() always takes a token and returns how long to wait for it,
+    so the balance may go negative while callers are queued.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now: float, cost: float = 1) -> float:
+        """Take cost tokens (a media group counts as one message per item)
+
+        The call waits only for its first token, the rest delay the calls
+        after it.
+        """
+        self._refill(now)
+        self.tokens -= cost
+        shortfall = -(self.tokens + cost - 1)
+        return 0.0 if shortfall <= 0 else shortfall / self.rate
+
+    def pause(self, seconds: float):
+        """Block the bucket for given seconds (e.g. after RetryAfter)"""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+class _Outgoing:
+    __slots__ = ('method', 'chat_id', 'cost', 'priority', 'future', 'attempts', 'flood_retries', 'reserved')
+
+    def __init__(self, method: TelegramMethod, chat_id, priority: int, future: asyncio.Future):
+        self.method = method
+        self.chat_id = chat_id
+        self.cost = len(method.media) if isinstance(method, SendMediaGroup) else 1
+        self.priority = priority
+        self.future = future
+        self.attempts = 0
+        self.flood_retries = 0
+        # Chat slot already taken, skip the per-chat bucket on next dispatch
+        self.reserved = False
+
+_bot = None
+_ready = []    # heap of (priority, seq, item)
+_delayed = []  # heap of (ready_at, seq, item)
+_seq = itertools.count()
+_wakeup = asyncio.Event()
+_inflight = set()
+# Supervisor workers share the bot's limits; a private chat is always served
+# by the same worker, the overall and group limits are split between them
+_share = WORKERS if BOT_MODE == "worker" else 1
+_global_bucket = TokenBucket(SEND_GLOBAL_RATE / _share, SEND_GLOBAL_RATE / _share)
+# Broadcast messages take from this one as well
+_broadcast_bucket = TokenBucket(BROADCAST_RATE / _share, BROADCAST_RATE / _share)
+_chat_buckets = {}
+_dispatcher_task = None
+# Seconds within which RetryAfter for two different chats means the
+# bot-wide limit was hit, and (time, chat_id) of the last RetryAfter
+FLOOD_WINDOW = 1.0
+_last_flood = (float("-inf"), None)
+
+def _chat_bucket(chat_id) -> TokenBucket:
+    chat_id = str(chat_id)
+    bucket = _chat_buckets.get(chat_id)
+    if bucket is None:
+        # Negative IDs are groups, @username is a channel or supergroup
+        if chat_id.startswith(("-", "@")):
+            bucket = TokenBucket(SEND_GROUP_RATE / 60 / _share, max(1.0, SEND_GROUP_RATE / _share))
+        else:
+            bucket = TokenBucket(SEND_PRIVATE_RATE, max(1.0, SEND_PRIVATE_RATE))
+        _chat_buckets[chat_id] = bucket
+    return bucket
+
+def _prune_buckets(now: float):
+    """Drop buckets of chats that have been quiet long enough to be full again"""
+    for chat_id in [c for c, b in _chat_buckets.items() if b.is_idle(now)]:
+        del _chat_buckets[chat_id]
+
+def _log_failure(future: asyncio.Future):
+    # Retrieve the exception so fire-and-forget sends don't warn on GC
+    if not future.cancelled() and future.exception() is not None:
+        logging.warning(f"Send failed: {future.exception()!r}")
+
+def send(method: TelegramMethod, priority: int = PRIORITY_ADMIN, log_failure: bool = True) -> asyncio.Future:
+    """Queue any Bot API method; returns a future with its result.
+
+    Handlers may ignore the future - failures are logged by the dispatcher.
+    Callers that handle failures themselves pass log_failure=False.
+    """
+    future = asyncio.get_running_loop().create_future()
+    if log_failure:
+        future.add_done_callback(_log_failure)
+    item = _Outgoing(method, getattr(method, 'chat_id', None), priority, future)
+    heapq.heappush(_ready, (priority, next(_seq), item))
+    _wakeup.set()
+    return future
+
+def send_message(chat_id, text: str, priority: int = PRIORITY_ADMIN, **kwargs) -> asyncio.Future:
+    """Queue a text message
+
+    Text over Telegram's limit goes out as several messages, each queued
+    after the previous one is sent so they arrive in order. reply_markup
+    is attached to the last one, whose result the returned future gets.
+    """
+    parts = split_text(text)
+    if len(parts) == 1:
+        return send(SendMessage(chat_id=chat_id, text=text, **kwargs), priority)
+
+    reply_markup = kwargs.pop('reply_markup', None)
+    result = asyncio.get_running_loop().create_future()
+
+    def send_part(index: int):
+        last = index == len(parts) - 1
+        future = send(SendMessage(
+            chat_id=chat_id, text=parts[index], reply_markup=reply_markup if last else None, **kwargs
+        ), priority)
+        future.add_done_callback(lambda f: on_sent(f, index))
+
+    def on_sent(future: asyncio.Future, index: int):
+        if future.cancelled():
+            result.cancel()
+        elif future.exception() is not None:
+            result.set_exception(future.exception())
+        elif index == len(parts) - 1:
+            result.set_result(future.result())
+        else:
+            send_part(index + 1)
+
+    # Failed parts are logged already, only mark the exception as retrieved
+    result.add_done_callback(lambda f: f.cancelled() or f.exception())
+    send_part(0)
+    return result
+
+def _retry_later(item: _Outgoing, delay: float):
+    heapq.heappush(_delayed, (time.monotonic() + delay, next(_seq), item))
+    _wakeup.set()
+
+def _fail(item: _Outgoing, error: Exception):
+    if not item.future.done():
+        item.future.set_exception(error)
+
+async def _deliver(item: _Outgoing):
+    global _last_flood
+    method_name = type(item.method).__name__
+    start = time.perf_counter()
+    try:
+        result = await _bot(item.method)
+    except TelegramRetryAfter as e:
+        item.flood_retries += 1
+        if item.flood_retries > SEND_MAX_FLOOD_RETRIES:
+            SEND_FAILURES.inc(method=method_name, error=type(e).__name__)
+            _fail(item, e)
+            return
+        logging.warning(f"Flood control for chat {item.chat_id}, retry in {e.retry_after}s")
+        SEND_RETRIES.inc(reason="flood_control")
+        now = time.monotonic()
+        last_time, last_chat = _last_flood
+        _last_flood = (now, item.chat_id)
+        if item.chat_id is not None:
+            _chat_bucket(item.chat_id).pause(e.retry_after)
+        # Telegram doesn't say which limit was hit: no chat, or several chats
+        # limited at once, means the bot-wide one and everything waits
+        if item.chat_id is None or (now - last_time < FLOOD_WINDOW and last_chat != item.chat_id):
+            _global_bucket.pause(e.retry_after)
+        item.reserved = True
+        _retry_later(item, e.retry_after)
+    except (TelegramNetworkError, TelegramServerError) as e:
+        item.attempts += 1
+        if item.attempts > SEND_MAX_RETRIES:
+            SEND_FAILURES.inc(method=method_name, error=type(e).__name__)
+            _fail(item, e)
+            return
+        SEND_RETRIES.inc(reason=type(e).__name__)
+        item.reserved = False
+        _retry_later(item, min(60, 2 ** item.attempts))
+    except Exception as e:
+        SEND_FAILURES.inc(method=method_name, error=type(e).__name__)
+        _fail(item, e)
+    else:
+        SENT.inc(method=method_name)
+        # The caller may have cancelled its future meanwhile
+        if not item.future.done():
+            item.future.set_result(result)
+    finally:
+        SEND_SECONDS.observe(time.perf_counter() - start, method=method_name)
+
+async def _dispatch(semaphore: asyncio.Semaphore):
+    last_prune = time.monotonic()
+    while True:
+        _wakeup.clear()
+        now = time.monotonic()
+
+        while _delayed and _delayed[0][0] <= now:
+            _, seq, item = heapq.heappop(_delayed)
+            heapq.heappush(_ready, (item.priority, seq, item))
+
+        if now - last_prune > 300:
+            _prune_buckets(now)
+            last_prune = now
+
+        if not _ready:
+            timeout = _delayed[0][0] - now if _delayed else None
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        _, seq, item = heapq.heappop(_ready)
+        # Cancelled by the caller: nobody waits for it
+        if item.future.done():
+            continue
+
+        # Chat (or the broadcast rate) is over its limit: park the item, keep serving other chats
+        if item.chat_id is not None and not item.reserved:
+            delay = _chat_bucket(item.chat_id).reserve(now, item.cost)
+            if item.priority == PRIORITY_BROADCAST:
+                delay = max(delay, _broadcast_bucket.reserve(now, item.cost))
+            if delay > 0:
+                item.reserved = True
+                heapq.heappush(_delayed, (now + delay, seq, item))
+                continue
+        item.reserved = False
+
+        delay = _global_bucket.reserve(now, item.cost)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        await semaphore.acquire()
+        task = asyncio.create_task(_deliver(item))
+        _inflight.add(task)
+        task.add_done_callback(_inflight.discard)
+        task.add_done_callback(lambda _: semaphore.release())
+
+def queue_size() -> int:
+    """Number of messages waiting to be sent"""
+    return len(_ready) + len(_delayed)
+
+def start_sender(bot: Bot):
+    """Start the background send dispatcher"""
+    global _bot, _dispatcher_task
+    _bot = bot
+    SEND_QUEUE_SIZE.set_function(queue_size)
+    _dispatcher_task = asyncio.create_task(_dispatch(asyncio.Semaphore(SEND_CONCURRENCY)))
+
+async def stop_sender(timeout: float = 10):
+    """Send what is queued (up to timeout seconds) and stop the dispatcher"""
+    deadline = time.monotonic() + timeout
+    while (_ready or _delayed or _inflight) and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    if _dispatcher_task is not None:
+        _dispatcher_task.cancel()
+    if queue_size():
+        logging.warning(f"Sender stopped with {queue_size()} unsent messages")
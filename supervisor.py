@@ -0,0 +1,303 @@
+"""
+Supervisor mode: one ingress process, WORKERS bot processes.
+
+The supervisor receives updates (long polling or webhook, SUPERVISOR_INGRESS)
+without parsing them and routes each to worker user_id % WORKERS, so all
+updates of one user go to the same worker. Updates are forwarded to a
+worker in batches, one request at a time, and the worker processes the
+updates of one user one after another (different users in parallel), so a
+user's FSM steps keep their order. Crashed workers are restarted; their
+updates wait in the supervisor's queue meanwhile.
+
+Workers are main.py processes with BOT_MODE=worker listening on
+127.0.0.1:WORKER_BASE_PORT+i. Reminders are sent by whichever process
+holds the scheduler lock (scheduler.py).
+"""
+import asyncio
+import hmac
+import itertools
+import logging
+import os
+import secrets
+import signal
+import sys
+from collections import deque
+import aiohttp
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from config import (
+    BOT_TOKEN,
+    TELEGRAM_API_URL,
+    WORKERS,
+    SUPERVISOR_INGRESS,
+    WORKER_BASE_PORT,
+    WORKER_ID,
+    WORKER_SECRET,
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+    WEBHOOK_DRAIN_TIMEOUT,
+    METRICS_PORT,
+)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+WORKER_SECRET_HEADER = "X-Worker-Secret"
+
+# Updates per request to a worker
+FORWARD_BATCH = 100
+# Seconds before retrying a worker that doesn't answer (e.g. still starting)
+FORWARD_RETRY_DELAY = 0.5
+# Seconds before restarting a crashed worker
+RESTART_DELAY = 1
+# getUpdates long polling timeout, seconds
+POLL_TIMEOUT = 30
+
+def update_key(update: dict) -> int:
+    """User ID of an update (chat ID if it has no user, else update_id)"""
+    for payload in update.values():
+        if not isinstance(payload, dict):
+            continue
+        user = payload.get("from") or payload.get("user")
+        if user:
+            return user["id"]
+        chat = payload.get("chat") or payload.get("message", {}).get("chat")
+        if chat:
+            return chat["id"]
+    return update["update_id"]
+
+def stop_event() -> asyncio.Event:
+    """Event set on SIGINT/SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows: rely on KeyboardInterrupt
+            pass
+    return stop
+
+# Supervisor side
+
+class _Worker:
+    def __init__(self, index: int):
+        self.index = index
+        self.port = WORKER_BASE_PORT + index
+        self.process = None
+        self.queue = deque()
+        self.wakeup = asyncio.Event()
+
+    def put(self, update: dict):
+        self.queue.append(update)
+        self.wakeup.set()
+
+class Supervisor:
+    def __init__(self, allowed_updates: list):
+        self.allowed_updates = allowed_updates
+        self.secret = secrets.token_hex(16)
+        self.workers = [_Worker(i) for i in range(WORKERS)]
+        self.stopping = False
+        api = (TELEGRAM_API_URL or "https://api.telegram.org").rstrip("/")
+        self.api_url = f"{api}/bot{BOT_TOKEN}"
+
+    def route(self, update: dict):
+        self.workers[update_key(update) % len(self.workers)].put(update)
+
+    async def _spawn(self, worker: _Worker):
+        env = {
+            **os.environ,
+            "BOT_MODE": "worker",
+            "WORKERS": str(len(self.workers)),
+            "WORKER_ID": str(worker.index),
+            "WORKER_SECRET": self.secret,
+            "WORKER_BASE_PORT": str(WORKER_BASE_PORT),
+            # Each worker serves its own metrics on the next ports
+            "METRICS_PORT": str(METRICS_PORT + 1 + worker.index if METRICS_PORT else 0),
+        }
+        main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+        worker.process = await asyncio.create_subprocess_exec(sys.executable, main_path, env=env)
+        logging.info(f"Started worker {worker.index} (pid {worker.process.pid}, port {worker.port})")
+
+    async def _supervise(self, worker: _Worker):
+        """Keep the worker process running"""
+        while not self.stopping:
+            await self._spawn(worker)
+            code = await worker.process.wait()
+            if not self.stopping:
+                logging.error(f"Worker {worker.index} exited with code {code}, restarting")
+                await asyncio.sleep(RESTART_DELAY)
+
+    async def _forward(self, worker: _Worker, session: aiohttp.ClientSession):
+        """Send the worker's queue in order, one batch at a time"""
+        url = f"http://127.0.0.1:{worker.port}/updates"
+        headers = {WORKER_SECRET_HEADER: self.secret}
+        while True:
+            if not worker.queue:
+                worker.wakeup.clear()
+                await worker.wakeup.wait()
+                continue
+            batch = list(itertools.islice(worker.queue, FORWARD_BATCH))
+            try:
+                async with session.post(url, json=batch, headers=headers) as response:
+                    response.raise_for_status()
+            except (aiohttp.ClientError, OSError):
+                # Not up yet or restarting; the updates stay queued
+                await asyncio.sleep(FORWARD_RETRY_DELAY)
+                continue
+            for _ in batch:
+                worker.queue.popleft()
+
+    async def _poll(self, session: aiohttp.ClientSession):
+        offset = None
+        while True:
+            try:
+                async with session.post(f"{self.api_url}/getUpdates", json={
+                    "offset": offset,
+                    "timeout": POLL_TIMEOUT,
+                    "allowed_updates": self.allowed_updates,
+                }, timeout=aiohttp.ClientTimeout(total=POLL_TIMEOUT + 10)) as response:
+                    data = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.warning(f"getUpdates failed: {e!r}")
+                await asyncio.sleep(5)
+                continue
+            if not data.get("ok"):
+                retry_after = (data.get("parameters") or {}).get("retry_after", 5)
+                logging.warning(f"getUpdates failed: {data.get('description')}")
+                await asyncio.sleep(retry_after)
+                continue
+            for update in data["result"]:
+                self.route(update)
+                offset = update["update_id"] + 1
+
+    async def _serve_webhook(self, session: aiohttp.ClientSession) -> web.AppRunner:
+        async def handle_update(request: web.Request) -> web.Response:
+            secret = request.headers.get(SECRET_HEADER, "")
+            if not hmac.compare_digest(secret, WEBHOOK_SECRET):
+                return web.Response(status=401)
+            self.route(await request.json())
+            return web.Response()
+
+        async def health(request: web.Request) -> web.Response:
+            return web.json_response({
+                "status": "ok",
+                "queued": {worker.index: len(worker.queue) for worker in self.workers},
+            })
+
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, handle_update)
+        app.router.add_get("/health", health)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+        async with session.post(f"{self.api_url}/setWebhook", json={
+            "url": WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            "secret_token": WEBHOOK_SECRET,
+            "allowed_updates": self.allowed_updates,
+        }) as response:
+            data = await response.json()
+            if not data.get("ok"):
+                raise RuntimeError(f"setWebhook failed: {data.get('description')}")
+        logging.info(f"Webhook server listening on {WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH}")
+        return runner
+
+    async def _drain(self, timeout: float):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while any(worker.queue for worker in self.workers) and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        lost = sum(len(worker.queue) for worker in self.workers)
+        if lost:
+            logging.warning(f"Stopping with {lost} updates not forwarded")
+
+    async def run(self):
+        stop = stop_event()
+        async with aiohttp.ClientSession() as session:
+            supervisors = [asyncio.create_task(self._supervise(worker)) for worker in self.workers]
+            forwarders = [asyncio.create_task(self._forward(worker, session)) for worker in self.workers]
+            webhook_runner = poller = None
+            if SUPERVISOR_INGRESS == "webhook":
+                webhook_runner = await self._serve_webhook(session)
+            else:
+                poller = asyncio.create_task(self._poll(session))
+            logging.info(f"Supervisor started: {len(self.workers)} workers, {SUPERVISOR_INGRESS} ingress")
+
+            try:
+                await stop.wait()
+            finally:
+                logging.info("Stopping supervisor")
+                if poller is not None:
+                    poller.cancel()
+                if webhook_runner is not None:
+                    await webhook_runner.cleanup()
+                await self._drain(WEBHOOK_DRAIN_TIMEOUT)
+                self.stopping = True
+                for task in forwarders:
+                    task.cancel()
+                for worker in self.workers:
+                    if worker.process is not None and worker.process.returncode is None:
+                        worker.process.terminate()
+                await asyncio.gather(*supervisors, return_exceptions=True)
+
+async def run_supervisor(allowed_updates: list):
+    """Run the ingress and worker processes until SIGINT/SIGTERM"""
+    await Supervisor(allowed_updates).run()
+
+# Worker side
+
+# routing key -> task processing the latest update of that user
+_chains = {}
+
+async def _process_after(previous, bot: Bot, dp: Dispatcher, update: dict):
+    if previous is not None:
+        await asyncio.wait([previous])
+    try:
+        await dp.feed_raw_update(bot, update)
+    except Exception:
+        logging.exception(f"Failed to process update {update.get('update_id')}")
+
+def _enqueue(bot: Bot, dp: Dispatcher, update: dict):
+    """Process update after the previous update of the same user"""
+    key = update_key(update)
+    task = asyncio.create_task(_process_after(_chains.get(key), bot, dp, update))
+    _chains[key] = task
+    task.add_done_callback(lambda t: _chains.pop(key) if _chains.get(key) is t else None)
+
+async def run_worker(bot: Bot, dp: Dispatcher):
+    """Process updates forwarded by the supervisor until SIGINT/SIGTERM"""
+
+    async def receive(request: web.Request) -> web.Response:
+        secret = request.headers.get(WORKER_SECRET_HEADER, "")
+        if not hmac.compare_digest(secret, WORKER_SECRET):
+            return web.Response(status=401)
+        for update in await request.json():
+            _enqueue(bot, dp, update)
+        return web.Response()
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", "users": len(_chains)})
+
+    app = web.Application()
+    app.router.add_post("/updates", receive)
+    app.router.add_get("/health", health)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    port = WORKER_BASE_PORT + WORKER_ID
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    logging.info(f"Worker {WORKER_ID} listening on 127.0.0.1:{port}")
+
+    stop = stop_event()
+    try:
+        await stop.wait()
+    finally:
+        await site.stop()
+        if _chains:
+            logging.info(f"Waiting for updates of {len(_chains)} users")
+            _, pending = await asyncio.wait(set(_chains.values()), timeout=WEBHOOK_DRAIN_TIMEOUT)
+            for task in pending:
+                task.cancel()
+        await runner.cleanup()
+        await bot.session.close()
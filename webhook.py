@@ -0,0 +1,102 @@
+import asyncio
+import hmac
+import logging
+import signal
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from config import (
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+    WEBHOOK_HANDLE_IN_BACKGROUND,
+    WEBHOOK_DRAIN_TIMEOUT,
+)
+from db.queries import is_ready
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Updates that are being processed right now
+_inflight = set()
+
+async def _process_update(bot: Bot, dp: Dispatcher, update: Update):
+    try:
+        await dp.feed_update(bot, update)
+    except Exception:
+        logging.exception(f"Failed to process update {update.update_id}")
+
+def create_app(bot: Bot, dp: Dispatcher) -> web.Application:
+    """aiohttp app with the webhook endpoint, /health and /ready"""
+
+    async def handle_update(request: web.Request) -> web.Response:
+        secret = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(secret, WEBHOOK_SECRET):
+            return web.Response(status=401)
+
+        update = Update.model_validate(await request.json(), context={"bot": bot})
+        if WEBHOOK_HANDLE_IN_BACKGROUND:
+            task = asyncio.create_task(_process_update(bot, dp, update))
+            _inflight.add(task)
+            task.add_done_callback(_inflight.discard)
+        else:
+            await _process_update(bot, dp, update)
+        return web.Response()
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", "inflight": len(_inflight), "db_ready": is_ready()})
+
+    async def ready(request: web.Request) -> web.Response:
+        # Updates are accepted before this, they wait for the database
+        return web.json_response({"ready": is_ready()}, status=200 if is_ready() else 503)
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.router.add_get("/health", health)
+    app.router.add_get("/ready", ready)
+    return app
+
+async def drain_updates(timeout: float = WEBHOOK_DRAIN_TIMEOUT):
+    """Wait for in-flight updates to finish"""
+    if not _inflight:
+        return
+    logging.info(f"Waiting for {len(_inflight)} in-flight updates")
+    _, pending = await asyncio.wait(set(_inflight), timeout=timeout)
+    if pending:
+        logging.warning(f"{len(pending)} updates still running after {timeout}s, cancelling")
+        for task in pending:
+            task.cancel()
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """Serve the webhook until SIGINT/SIGTERM, then drain and stop"""
+    runner = web.AppRunner(create_app(bot, dp))
+    await runner.setup()
+    site = web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT)
+    await site.start()
+
+    await bot.set_webhook(
+        url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    logging.info(f"Webhook server listening on {WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows: rely on KeyboardInterrupt
+            pass
+
+    try:
+        await stop.wait()
+    finally:
+        logging.info("Stopping webhook server")
+        # Stop accepting new updates; Telegram will redeliver them to the next instance
+        await site.stop()
+        await drain_updates()
+        await runner.cleanup()
+        await bot.session.close()